@@ -0,0 +1,191 @@
+"""
+Collector benchmark: run_download_process against N simulated printers.
+
+Starts mock MFP servers (benchmarks/mock_mfp.py), points the collector at
+them and reports wall time, per-printer latency, retry counts and failures.
+
+By default ingest is parse-only: the CSVs are parsed and counted, every
+database step of the run is stubbed, and any pymysql.connect raises, so the
+run never touches DB_CONFIG. With --db the real sync functions write to the
+benchmark database (see benchmarks/fixture.py).
+
+Usage:
+    python benchmarks/bench_collector.py --printers 8 --rows 20000
+    python benchmarks/bench_collector.py --printers 4 --error-rate 0.1 --timeout-rate 0.05 --client-timeout 2
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict
+
+import pymysql
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fixture  # noqa: E402
+from mock_mfp import MockMFPConfig, start_mock_servers, stop_mock_servers  # noqa: E402
+
+
+def _no_database(*args, **kwargs):
+    raise RuntimeError("bench_collector: parse-only run tried to open a database connection (use --db)")
+
+
+def parse_only(sharp_mfp_export) -> None:
+    """Same CPU work on the CSVs, no database round trips."""
+    # Guard first: anything not stubbed below fails loudly instead of
+    # writing mock job logs into whatever DB_CONFIG points at
+    pymysql.connect = _no_database
+    sharp_mfp_export.get_db_connection = _no_database
+
+    # The streaming path ingests on its own writer thread; use download-then-ingest
+    sharp_mfp_export.STREAM_INGEST = False
+    # Both read job_logs before / after the export
+    sharp_mfp_export.JOBLOG_RANGE_EXPORT = False
+    sharp_mfp_export.JOBLOG_DRAIN = False
+    sharp_mfp_export._retry_pending_drains = lambda jl_dir: iter(())
+
+    sharp_mfp_export.init_db = lambda: None
+    sharp_mfp_export.sync_csv_to_db = lambda path, printer_addr, bulk=False: len(
+        sharp_mfp_export._joblog_records_from_csv(path)
+    )
+    sharp_mfp_export.sync_usercount_to_db = lambda path, printer_addr: len(
+        sharp_mfp_export._read_csv_rows_raw(path)
+    )
+    sharp_mfp_export.update_search_index = lambda: {"rows": 0, "values": 0}
+    sharp_mfp_export.refresh_count_sketches = lambda: 0
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    config = MockMFPConfig(
+        joblog_rows=args.rows, users=args.users, latency=args.latency,
+        latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate, hang_seconds=args.hang_seconds,
+        session_ttl=args.session_ttl, session_max_requests=args.session_max_requests,
+    )
+    print(f"啟動 {args.printers} 台模擬列印機 ({args.rows} 筆 job log)...")
+    servers = start_mock_servers(args.printers, config)
+    printers = [s.base_url for s in servers]
+
+    if args.db:
+        fixture.configure_environment(printers)
+    import sharp_mfp_export
+
+    sharp_mfp_export.TIMEOUT = args.client_timeout
+    sharp_mfp_export.SLEEP_BETWEEN_PRINTERS = args.sleep_between
+    sharp_mfp_export.USERNAME = config.username
+    sharp_mfp_export.PASSWORD = config.password
+
+    if args.db:
+        fixture.reset_database()
+    else:
+        parse_only(sharp_mfp_export)
+
+    # Count attempts per request_with_retry call to derive retries per printer
+    retries: Dict[str, int] = defaultdict(int)
+    current = {"printer": ""}
+    original_retry = sharp_mfp_export.request_with_retry
+
+    def counting_retry(fn, *fn_args, **fn_kwargs):
+        attempts = {"n": 0}
+
+        def attempt(*a, **kw):
+            attempts["n"] += 1
+            return fn(*a, **kw)
+
+        try:
+            return original_retry(attempt, *fn_args, **fn_kwargs)
+        finally:
+            retries[current["printer"]] += max(attempts["n"] - 1, 0)
+
+    sharp_mfp_export.request_with_retry = counting_retry
+
+    latencies: Dict[str, float] = {}
+    failures: Dict[str, str] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        sharp_mfp_export.OUT_DIR = Path(tmp)
+        t_start = time.perf_counter()
+        t_printer = t_start
+        for msg in sharp_mfp_export.run_download_process(printers, "bench"):
+            now = time.perf_counter()
+            if msg.startswith("== ") and msg.endswith(" =="):
+                if current["printer"]:
+                    latencies[current["printer"]] = now - t_printer
+                current["printer"] = msg[3:-3]
+                t_printer = now
+            elif msg.startswith("FAIL"):
+                failures[current["printer"]] = msg
+            elif msg.startswith("LOG:") and current["printer"] and current["printer"] not in latencies:
+                latencies[current["printer"]] = now - t_printer
+            if args.verbose:
+                print(f"  {msg}")
+        wall = time.perf_counter() - t_start
+
+    server_stats = {s.base_url: s.stats.as_dict() for s in servers}
+    stop_mock_servers(servers)
+
+    values = list(latencies.values()) or [0.0]
+    result = {
+        "printers": args.printers,
+        "rows_per_printer": args.rows,
+        "wall_seconds": wall,
+        "latency": {
+            "min": min(values),
+            "median": statistics.median(values),
+            "max": max(values),
+            "per_printer": latencies,
+        },
+        "retries": dict(retries),
+        "total_retries": sum(retries.values()),
+        "failures": failures,
+        "server_stats": server_stats,
+    }
+
+    print(f"\n總耗時 {wall:.2f}s，{len(failures)} 台失敗，重試 {result['total_retries']} 次")
+    print(
+        f"單台延遲: min {result['latency']['min']:.2f}s / "
+        f"median {result['latency']['median']:.2f}s / max {result['latency']['max']:.2f}s"
+    )
+    for printer in printers:
+        stats = server_stats[printer]
+        status = "FAIL" if printer in failures else "OK"
+        print(
+            f"  {printer}: {latencies.get(printer, 0):.2f}s {status} | retries {retries.get(printer, 0)} | "
+            f"5xx {stats['errors']} / hang {stats['timeouts']} / expired {stats['expired_sessions']}"
+        )
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Collector benchmark against mock MFPs")
+    parser.add_argument("--printers", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=5000, help="每台 job log 筆數")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--hang-seconds", type=float, default=10.0)
+    parser.add_argument("--session-ttl", type=float, default=0.0)
+    parser.add_argument("--session-max-requests", type=int, default=0)
+    parser.add_argument("--client-timeout", type=float, default=5.0, help="覆寫 sharp_mfp_export.TIMEOUT")
+    parser.add_argument("--sleep-between", type=float, default=0.0, help="覆寫 SLEEP_BETWEEN_PRINTERS")
+    parser.add_argument("--db", action="store_true", help="寫入基準測試資料庫 (預設只解析)")
+    parser.add_argument("--out", help="將結果寫入 JSON")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Import-time budget for the CLI and the webapp.
+
+Imports each module in a fresh interpreter with `python -X importtime` and
+checks it against benchmarks/import_budget.json:
+
+- max_ms: cumulative import time of the module (best of --repeat runs, so
+  interpreter start-up and disk cache noise are left out)
+- forbidden: heavy dependencies that must not load at import time; they are
+  imported by the subcommand / route that needs them
+
+Exits 1 when a module is over budget or pulls in a forbidden dependency.
+
+Usage:
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --repeat 10 --top 15
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+BUDGET_FILE = Path(__file__).resolve().parent / "import_budget.json"
+
+# import time: <self us> | <cumulative us> | <indented module name>
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def measure(module: str) -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """
+    (cumulative ms of `module`, {module it imported: (depth, cumulative us)}).
+    Only the subtree under `module` counts; start-up imports (site, .pth
+    hooks) are not attributed to it.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    entries = []
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            # One leading space for a top-level import, two more per level
+            entries.append(((len(m.group(3)) - 1) // 2, int(m.group(2)), m.group(4)))
+
+    # -X importtime prints in post-order: a module's imports precede it
+    for end in range(len(entries) - 1, -1, -1):
+        depth, cumulative_us, name = entries[end]
+        if depth == 0 and name == module:
+            break
+    else:
+        return 0.0, {}
+    modules: Dict[str, Tuple[int, int]] = {}
+    for depth, child_us, name in reversed(entries[:end]):
+        if depth == 0:
+            break
+        modules[name] = (depth, child_us)
+    return cumulative_us / 1000, modules
+
+
+def check(module: str, budget: Dict[str, Any], repeat: int, top: int) -> List[str]:
+    runs = [measure(module) for _ in range(repeat)]
+    best_ms, modules = min(runs, key=lambda run: run[0])
+    max_ms = budget.get("max_ms")
+    loaded = [name for name in budget.get("forbidden", []) if name in modules]
+
+    status = "OK"
+    problems = []
+    if max_ms is not None and best_ms > max_ms:
+        problems.append(f"{module}: {best_ms:.1f} ms > budget {max_ms} ms")
+    for name in loaded:
+        problems.append(f"{module}: imports {name} at load time")
+    if problems:
+        status = "OVER"
+    print(f"{module:20s} {best_ms:8.1f} ms  (budget {max_ms} ms)  {status}")
+
+    heaviest = sorted(
+        ((cumulative, name) for name, (depth, cumulative) in modules.items() if depth == 1),
+        reverse=True,
+    )[:top]
+    for cumulative, name in heaviest:
+        print(f"    {name:28s} {cumulative / 1000:8.1f} ms")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="模組載入時間預算檢查 (python -X importtime)")
+    parser.add_argument("--budget", default=str(BUDGET_FILE), help="預算檔 (JSON)")
+    parser.add_argument("--repeat", type=int, default=5, help="每個模組量測次數 (取最佳值)")
+    parser.add_argument("--top", type=int, default=8, help="列出最耗時的前幾個相依模組")
+    parser.add_argument("--only", help="只檢查指定模組 (逗號分隔)")
+    args = parser.parse_args()
+
+    with open(args.budget, encoding="utf-8") as fh:
+        budgets = json.load(fh)["modules"]
+    only = set(args.only.split(",")) if args.only else None
+
+    problems: List[str] = []
+    for module, budget in budgets.items():
+        if only and module not in only:
+            continue
+        problems.extend(check(module, budget, args.repeat, args.top))
+
+    if problems:
+        print("\n超出預算:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print("\n全部模組皆在預算內")
+
+
+if __name__ == "__main__":
+    main()
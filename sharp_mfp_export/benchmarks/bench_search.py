@@ -0,0 +1,166 @@
+"""
+Keyword search benchmark on the run_benchmarks.py dataset.
+
+Loads one generated dataset into the benchmark database (see
+benchmarks/fixture.py), then times the /jobs filename filter for each
+keyword three ways, each followed by the COUNT(*) it feeds:
+
+    like      LIKE '%kw%' on job_logs (SEARCH_BACKEND=like)
+    groupby   the previous resolve_values: GROUP BY value_id HAVING COUNT(*)
+              over the postings of every query term, then IN or LIKE
+    rarest    search_index.resolve_values: bounded per-term probes, postings
+              of the rarest term only, then IN or LIKE
+
+Counts must agree, or the numbers mean nothing. Common terms ("pdf") show
+the difference: groupby scans their postings before giving up, rarest gives
+up after SEARCH_MAX_CANDIDATES index entries.
+
+Usage:
+    python benchmarks/bench_search.py --size 1m
+    python benchmarks/bench_search.py --size 100k --keywords pdf,數學,0131 --out search.json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fixture  # noqa: E402
+import generate_data  # noqa: E402
+from run_benchmarks import ensure_dataset, parse_size  # noqa: E402
+
+DEFAULT_KEYWORDS = "pdf,數學,工作紙,0131,example,找不到的檔名"
+
+
+def previous_resolve_values(search_index, cursor, keyword: str, fields: Sequence[str]) -> Optional[Dict[str, List[str]]]:
+    """resolve_values before the rarest-term lookup, kept here as the baseline."""
+    if "%" in keyword or "_" in keyword or "\\" in keyword:
+        return None
+    terms = sorted(search_index.query_terms(keyword))
+    if not terms or not search_index._index_ready(cursor):
+        return None
+    field_ph = ", ".join(["%s"] * len(fields))
+    term_ph = ", ".join(["%s"] * len(terms))
+    cursor.execute(
+        f"""
+        SELECT v.field, v.value
+        FROM search_values v
+        JOIN (
+            SELECT value_id FROM search_postings
+            WHERE field IN ({field_ph}) AND term IN ({term_ph})
+            GROUP BY value_id
+            HAVING COUNT(*) = %s
+        ) p ON p.value_id = v.id
+        WHERE v.value LIKE %s
+        LIMIT %s
+        """,
+        list(fields) + terms + [len(terms), f"%{keyword}%", search_index.SEARCH_MAX_VALUES + 1],
+    )
+    rows = cursor.fetchall()
+    if len(rows) > search_index.SEARCH_MAX_VALUES:
+        return None
+    matches: Dict[str, List[str]] = {f: [] for f in fields}
+    for r in rows:
+        matches.setdefault(r["field"], []).append(r["value"])
+    return matches
+
+
+def filtered_count(search_index, cursor, keyword: str, method: str) -> Dict[str, Any]:
+    fields = search_index.FILENAME_FIELDS
+    t0 = time.perf_counter()
+    if method == "like":
+        matches = None
+    elif method == "groupby":
+        matches = previous_resolve_values(search_index, cursor, keyword, fields)
+    else:
+        matches = search_index.resolve_values(cursor, keyword, fields)
+    resolved = time.perf_counter() - t0
+
+    if matches is None:
+        path = "like"
+        where = "(" + " OR ".join(f"{f} LIKE %s" for f in fields) + ")"
+        params: List[Any] = [f"%{keyword}%"] * len(fields)
+    else:
+        path = "index"
+        clauses, params = search_index._in_clauses(fields, matches)
+        where = "(" + " OR ".join(clauses) + ")" if clauses else "(1=0)"
+    cursor.execute(f"SELECT COUNT(*) AS cnt FROM job_logs WHERE {where}", params)
+    count = cursor.fetchone()["cnt"]
+    return {"seconds": time.perf_counter() - t0, "resolve_seconds": resolved, "path": path, "count": count}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fixture.configure_environment(generate_data.printer_addrs(args.printers))
+    import search_index
+    import sharp_mfp_export
+
+    rows = parse_size(args.size)
+    data_dir = ensure_dataset(Path(args.data_dir), rows, args)
+    if not args.reuse_db:
+        fixture.reset_database()
+        ingest = fixture.load_fixture(data_dir, workers=args.workers)
+        print(f"匯入 {ingest['rows']} 筆，{ingest['seconds']:.1f}s")
+    print(
+        f"job_logs {fixture.table_rows('job_logs')} 筆 / search_values {fixture.table_rows('search_values')}"
+        f" / search_postings {fixture.table_rows('search_postings')}"
+    )
+
+    results: Dict[str, Any] = {"size": rows, "max_values": search_index.SEARCH_MAX_VALUES,
+                               "max_candidates": search_index.SEARCH_MAX_CANDIDATES, "keywords": {}}
+    conn = sharp_mfp_export.get_db_connection(read_only=True)
+    try:
+        with conn.cursor() as cursor:
+            for keyword in args.keywords.split(","):
+                outcome: Dict[str, Any] = {}
+                for method in ("like", "groupby", "rarest"):
+                    runs = [filtered_count(search_index, cursor, keyword, method) for _ in range(args.repeat)]
+                    outcome[method] = {
+                        "median": statistics.median(r["seconds"] for r in runs),
+                        "resolve_median": statistics.median(r["resolve_seconds"] for r in runs),
+                        "path": runs[-1]["path"],
+                        "count": runs[-1]["count"],
+                    }
+                counts = {m: o["count"] for m, o in outcome.items()}
+                assert len(set(counts.values())) == 1, f"{keyword}: counts differ {counts}"
+                results["keywords"][keyword] = outcome
+                print(
+                    f"  {keyword:12s} {counts['like']:8d} rows | "
+                    + " | ".join(
+                        f"{m} {o['median'] * 1000:8.1f} ms ({o['path']}, resolve {o['resolve_median'] * 1000:.1f} ms)"
+                        for m, o in outcome.items()
+                    )
+                )
+    finally:
+        conn.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="關鍵字搜尋基準測試")
+    parser.add_argument("--size", default="100k", help="資料量 (例如 100k, 1m)")
+    parser.add_argument("--keywords", default=DEFAULT_KEYWORDS, help="逗號分隔的檔名關鍵字")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--printers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=4, help="匯入並行數")
+    parser.add_argument("--data-dir", default="bench_data")
+    parser.add_argument("--reuse-db", action="store_true", help="沿用已載入的基準測試資料庫")
+    parser.add_argument("--out", help="將結果寫入 JSON")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, ensure_ascii=False, indent=2)
+        print(f"結果已寫入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Micro-benchmark: job log timestamp parsing.
+
+Compares the original per-cell format loop (_parse_time_value_slow, i.e. what
+parse_time_value did for every cell) with TimestampParser on the start/end
+columns of real job log exports.
+
+Usage:
+    python benchmarks/bench_timestamps.py                      # ./exports/joblog/*.csv
+    python benchmarks/bench_timestamps.py path/to/joblog.csv ...
+    python benchmarks/bench_timestamps.py --synthetic 200000   # no export files at hand
+"""
+
+import argparse
+import csv
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sharp_mfp_export import (  # noqa: E402
+    CSV_ENCODING,
+    CSV_ERRORS,
+    OUT_DIR,
+    TimestampParser,
+    _extract_column,
+    _parse_time_value_slow,
+    _resolve_joblog_columns,
+)
+
+
+def load_time_columns(path: Path) -> List[List[Optional[str]]]:
+    with open(path, encoding=CSV_ENCODING, errors=CSV_ERRORS, newline="") as fh:
+        reader = csv.reader(fh)
+        header = next(reader, None) or []
+        rows = [row for row in reader if row]
+    columns = _resolve_joblog_columns(header)
+    return [
+        _extract_column(rows, columns["start"], coalesce=True),
+        _extract_column(rows, columns["end"], coalesce=True),
+    ]
+
+
+def synthetic_columns(count: int) -> List[List[Optional[str]]]:
+    base = datetime(2026, 1, 5, 7, 30, 0)
+    start = []
+    end = []
+    for i in range(count):
+        t = base + timedelta(seconds=i * 37)
+        start.append(t.strftime("%Y/%m/%d %H:%M:%S"))
+        end.append((t + timedelta(seconds=12)).strftime("%Y/%m/%d %H:%M:%S"))
+    return [start, end]
+
+
+def legacy_parse(values: List[Optional[str]]) -> List[Optional[datetime]]:
+    parsed = []
+    for value in values:
+        if not value:
+            parsed.append(None)
+            continue
+        cleaned = value.strip()
+        if not cleaned or cleaned.upper() == "N/A":
+            parsed.append(None)
+            continue
+        parsed.append(_parse_time_value_slow(cleaned))
+    return parsed
+
+
+def best_of(repeat: int, fn, *args) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_source(label: str, columns: List[List[Optional[str]]], repeat: int) -> None:
+    cells = sum(len(col) for col in columns)
+    if not cells:
+        print(f"{label}: (no timestamp cells)")
+        return
+
+    def run_legacy():
+        for col in columns:
+            legacy_parse(col)
+
+    def run_parser():
+        for col in columns:
+            TimestampParser().parse_many(col)
+
+    # Same results, or the numbers mean nothing
+    for col in columns:
+        assert legacy_parse(col) == TimestampParser().parse_many(col), f"{label}: parsers disagree"
+
+    legacy = best_of(repeat, run_legacy)
+    fast = best_of(repeat, run_parser)
+    print(
+        f"{label}: {cells} cells | legacy {legacy * 1000:.1f} ms ({legacy / cells * 1e6:.2f} µs/cell)"
+        f" | TimestampParser {fast * 1000:.1f} ms ({fast / cells * 1e6:.2f} µs/cell)"
+        f" | x{legacy / fast if fast else float('inf'):.1f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Timestamp parsing micro-benchmark")
+    parser.add_argument("files", nargs="*", help="Job log CSV 檔案 (預設: exports/joblog/*.csv)")
+    parser.add_argument("--synthetic", type=int, default=0, help="改用 N 筆合成資料")
+    parser.add_argument("--repeat", type=int, default=3, help="每項重複次數 (取最佳)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        bench_source(f"synthetic[{args.synthetic}]", synthetic_columns(args.synthetic), args.repeat)
+        return
+
+    paths = [Path(f) for f in args.files] or sorted((OUT_DIR / "joblog").glob("*.csv"))
+    if not paths:
+        print("找不到 job log 檔案，請指定路徑或使用 --synthetic N")
+        sys.exit(1)
+
+    for path in paths:
+        bench_source(path.name, load_time_columns(path), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Local MySQL/MariaDB fixture for the benchmark suite.
+
+Points sharp_mfp_export at a throw-away database and loads generated exports
+into it. Configure with environment variables:
+
+    BENCH_DB_HOST (127.0.0.1)  BENCH_DB_PORT (3306)
+    BENCH_DB_USER (root)       BENCH_DB_PASS ("")
+    BENCH_DB_NAME (printer_bench)   -- must contain "bench", tables are dropped
+
+configure_environment() must run before sharp_mfp_export / webapp are imported,
+because both read their configuration at import time.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+BENCH_DB = {
+    "host": os.getenv("BENCH_DB_HOST", "127.0.0.1"),
+    "port": int(os.getenv("BENCH_DB_PORT", "3306")),
+    "user": os.getenv("BENCH_DB_USER", "root"),
+    "password": os.getenv("BENCH_DB_PASS", ""),
+    "database": os.getenv("BENCH_DB_NAME", "printer_bench"),
+}
+
+
+def configure_environment(printers: List[str]) -> None:
+    """Route the app's DB_* / SHARP_PRINTERS settings to the benchmark database."""
+    if "bench" not in BENCH_DB["database"]:
+        raise RuntimeError(f"BENCH_DB_NAME 必須包含 'bench' (收到 {BENCH_DB['database']})，以免清空正式資料庫")
+    os.environ["DB_HOST"] = BENCH_DB["host"]
+    os.environ["DB_PORT"] = str(BENCH_DB["port"])
+    os.environ["DB_USER"] = BENCH_DB["user"]
+    os.environ["DB_PASS"] = BENCH_DB["password"]
+    os.environ["DB_NAME"] = BENCH_DB["database"]
+    os.environ["SHARP_PRINTERS"] = ",".join(printers)
+    # Warm-up pings and LDAP lookups would measure the network, not the app
+    os.environ.pop("WEBAPP_URL", None)
+    os.environ.pop("WARMUP_URLS", None)
+
+
+def create_database() -> None:
+    import pymysql
+
+    conn = pymysql.connect(
+        host=BENCH_DB["host"], port=BENCH_DB["port"],
+        user=BENCH_DB["user"], password=BENCH_DB["password"],
+        charset="utf8mb4", autocommit=True,
+    )
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"CREATE DATABASE IF NOT EXISTS `{BENCH_DB['database']}` "
+                "CHARACTER SET utf8mb4 COLLATE utf8mb4_general_ci"
+            )
+    finally:
+        conn.close()
+
+
+def reset_database() -> None:
+    """Drop every table in the benchmark database and recreate the schema."""
+    import sharp_mfp_export
+
+    create_database()
+    conn = sharp_mfp_export.get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW TABLES")
+            tables = [list(row.values())[0] for row in cursor.fetchall()]
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+            for table in tables:
+                cursor.execute(f"DROP TABLE IF EXISTS `{table}`")
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+    finally:
+        conn.close()
+    # Ids, readiness flags and counts cached for the previous size are stale
+    sharp_mfp_export.reset_db_caches()
+    sharp_mfp_export.init_db(force=True)
+
+
+def load_fixture(data_dir: Path, bulk: bool = True, workers: int = 4) -> Dict[str, Any]:
+    """Import generated exports and close an update_logs entry (the ingestion generation)."""
+    import sharp_mfp_export
+
+    log_id = sharp_mfp_export.log_update_event("bench", "running", "benchmark fixture", 0)
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        stats = sharp_mfp_export.import_exports(
+            [str(data_dir)],
+            workers=workers,
+            bulk=bulk,
+            state_path=Path(tmp) / "state.json",
+            restart=True,
+        )
+    elapsed = time.perf_counter() - t0
+    sharp_mfp_export.log_update_event("bench", "success", "benchmark fixture", log_id)
+    # update_logs restarts at id 1 after a reset: never reuse the previous size's generation
+    sharp_mfp_export.reset_db_caches()
+    return {"seconds": elapsed, **stats}
+
+
+def table_rows(table: str) -> int:
+    import sharp_mfp_export
+
+    conn = sharp_mfp_export.get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) AS cnt FROM `{table}`")
+            return cursor.fetchone()["cnt"]
+    finally:
+        conn.close()
@@ -0,0 +1,202 @@
+"""
+Synthetic Sharp MFP export generator (Big5 job log / user count CSVs).
+
+Files are named like real collector output (joblog_<tag>_<ts>.csv /
+uc_<tag>_<ts>.csv) so `sharp_mfp_export.py import` can load them directly.
+
+Usage:
+    python benchmarks/generate_data.py --rows 100000 --printers 4 --users 300 --months 6 --out bench_data
+"""
+
+import argparse
+import csv
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+CSV_ENCODING = "big5"
+
+JOBLOG_HEADER = [
+    "工作ID", "帳戶工作ID", "工作模式", "電腦名稱", "用戶名稱", "登入名稱",
+    "開始日期", "完成日期", "黑白總張數", "全彩總張數", "檔案名稱", "傳送類型", "直接位址",
+]
+
+USERCOUNT_HEADER = [
+    "用戶名稱",
+    "印表機:黑白:已使用", "印表機:黑白:限制",
+    "印表機:全彩:已使用", "印表機:全彩:限制",
+    "影印:黑白:已使用", "影印:黑白:限制",
+    "影印:全彩:已使用", "影印:全彩:限制",
+    "掃描:已使用",
+]
+
+# (mode, weight, colour share)
+JOB_MODES = [
+    ("列印", 0.62, 0.15),
+    ("影印", 0.25, 0.08),
+    ("掃描", 0.10, 0.0),
+    ("傳真", 0.03, 0.0),
+]
+
+SURNAMES = "陳黃李張梁何林吳劉郭蔡鄭謝楊許馮羅曾彭"
+GIVEN = "家嘉文偉明華志國美玲惠芳建雅詩敏俊傑欣怡子"
+SUBJECTS = ["中文", "英文", "數學", "常識", "物理", "化學", "歷史", "地理", "音樂", "通告", "測驗", "工作紙"]
+
+
+def printer_addrs(count: int) -> List[str]:
+    return [f"http://10.200.0.{i + 1}" for i in range(count)]
+
+
+def host_tag(base: str) -> str:
+    return base.split("://", 1)[-1].replace(":", "_")
+
+
+def make_users(count: int, rng: random.Random) -> List[Dict[str, str]]:
+    users = []
+    for i in range(count):
+        name = rng.choice(SURNAMES) + rng.choice(GIVEN) + rng.choice(GIVEN)
+        login = f"t{i:04d}"
+        users.append({"name": name, "login": login, "computer": f"PC-{rng.randint(1, count // 2 + 1):03d}"})
+    return users
+
+
+def job_pages(rng: random.Random, max_pages: int) -> int:
+    # Heavy-tailed: most jobs are a few pages, worksheets for a class are 30-40
+    return max(1, min(max_pages, int(rng.paretovariate(1.3))))
+
+
+def write_joblogs(
+    out_dir: Path,
+    rows: int,
+    printers: List[str],
+    users: List[Dict[str, str]],
+    months: int,
+    max_pages: int,
+    rng: random.Random,
+) -> List[Path]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    end = datetime(2026, 1, 31, 18, 0, 0)
+    start = end - timedelta(days=30 * months)
+    span = int((end - start).total_seconds())
+    # Zipf-ish popularity: a few heavy users per school
+    weights = [1.0 / (i + 1) ** 0.8 for i in range(len(users))]
+    modes = [m[0] for m in JOB_MODES]
+    mode_weights = [m[1] for m in JOB_MODES]
+    colour_share = {m[0]: m[2] for m in JOB_MODES}
+
+    per_printer = [rows // len(printers)] * len(printers)
+    per_printer[0] += rows - sum(per_printer)
+
+    paths = []
+    stamp = end.strftime("%Y%m%d-%H%M%S")
+    for printer, count in zip(printers, per_printer):
+        path = out_dir / f"joblog_{host_tag(printer)}_{stamp}.csv"
+        offsets = sorted(rng.randrange(span) for _ in range(count))
+        with open(path, "w", encoding=CSV_ENCODING, newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(JOBLOG_HEADER)
+            for job_id, offset in enumerate(offsets, start=1):
+                user = rng.choices(users, weights)[0]
+                mode = rng.choices(modes, mode_weights)[0]
+                pages = job_pages(rng, max_pages)
+                color = pages if rng.random() < colour_share[mode] else 0
+                bw = pages - color if mode in ("列印", "影印") else 0
+                t0 = start + timedelta(seconds=offset)
+                t1 = t0 + timedelta(seconds=5 + pages * 2)
+                subject = rng.choice(SUBJECTS)
+                writer.writerow([
+                    str(job_id),
+                    str(100000 + job_id),
+                    mode,
+                    user["computer"],
+                    user["name"],
+                    user["login"],
+                    t0.strftime("%Y/%m/%d %H:%M:%S"),
+                    t1.strftime("%Y/%m/%d %H:%M:%S"),
+                    str(bw),
+                    str(color),
+                    f"{subject}_{t0:%m%d}_{job_id}.pdf" if mode == "列印" else "",
+                    "Scan to E-mail" if mode == "掃描" else "",
+                    f"{user['login']}@school.example" if mode == "掃描" else "",
+                ])
+        paths.append(path)
+    return paths
+
+
+def write_usercounts(
+    out_dir: Path,
+    printers: List[str],
+    users: List[Dict[str, str]],
+    snapshots: int,
+    rng: random.Random,
+) -> List[Path]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    base = datetime(2026, 1, 31, 18, 0, 0)
+    for printer in printers:
+        totals = {u["login"]: [0] * 5 for u in users}
+        for snap in range(snapshots):
+            stamp = (base - timedelta(days=snapshots - snap - 1)).strftime("%Y%m%d-%H%M%S")
+            path = out_dir / f"uc_{host_tag(printer)}_{stamp}.csv"
+            with open(path, "w", encoding=CSV_ENCODING, newline="") as fh:
+                writer = csv.writer(fh)
+                writer.writerow(USERCOUNT_HEADER)
+                for user in users:
+                    counters = totals[user["login"]]
+                    for i in range(5):
+                        counters[i] += rng.randint(0, 40 if i in (0, 2) else 6)
+                    writer.writerow([
+                        user["login"],
+                        counters[0], "無限制",
+                        counters[1], "無限制",
+                        counters[2], "無限制",
+                        counters[3], "無限制",
+                        counters[4],
+                    ])
+            paths.append(path)
+    return paths
+
+
+def generate(
+    out_dir: Path,
+    rows: int,
+    printers: int = 4,
+    users: int = 300,
+    months: int = 6,
+    max_pages: int = 60,
+    snapshots: int = 2,
+    seed: int = 42,
+) -> Dict[str, List[Path]]:
+    rng = random.Random(seed)
+    addrs = printer_addrs(printers)
+    people = make_users(users, rng)
+    return {
+        "printers": addrs,
+        "joblog": write_joblogs(out_dir / "joblog", rows, addrs, people, months, max_pages, rng),
+        "usercount": write_usercounts(out_dir / "usercount", addrs, people, snapshots, rng),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="產生合成 Sharp MFP 匯出檔 (Big5)")
+    parser.add_argument("--rows", type=int, default=10000, help="job log 總筆數")
+    parser.add_argument("--printers", type=int, default=4, help="列印機數量")
+    parser.add_argument("--users", type=int, default=300, help="用戶數量")
+    parser.add_argument("--months", type=int, default=6, help="涵蓋月份")
+    parser.add_argument("--max-pages", type=int, default=60, help="單一工作最大張數")
+    parser.add_argument("--snapshots", type=int, default=2, help="每台列印機的 user count 快照數")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="bench_data", help="輸出目錄")
+    args = parser.parse_args()
+
+    result = generate(
+        Path(args.out), args.rows, args.printers, args.users,
+        args.months, args.max_pages, args.snapshots, args.seed,
+    )
+    print(f"列印機: {', '.join(result['printers'])}")
+    print(f"job log: {len(result['joblog'])} 個檔案，user count: {len(result['usercount'])} 個檔案 -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Mock Sharp MFP embedded web server.
+
+Implements the pages SharpMFP talks to (login.html token2 login, main.html
+session check, user count and job log token1/token2 export flows) and serves
+generated Big5 CSVs of configurable size. Faults can be injected: latency,
+hangs longer than the client timeout, 5xx responses and session expiry.
+
+Standalone:
+    python benchmarks/mock_mfp.py --port 8081 --rows 50000 --error-rate 0.05
+    python sharp_mfp_export.py download -p 127.0.0.1:8081
+"""
+
+import argparse
+import random
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import generate_data  # noqa: E402
+
+SESSION_COOKIE = "MFPSESSIONID"
+
+
+@dataclass
+class MockMFPConfig:
+    joblog_rows: int = 5000
+    users: int = 200
+    months: int = 3
+    username: str = "admin"
+    password: str = "admin"
+    latency: float = 0.0          # seconds added to every response
+    latency_jitter: float = 0.0   # +/- uniform jitter
+    error_rate: float = 0.0       # probability of a 503 on any request
+    timeout_rate: float = 0.0     # probability of hanging for hang_seconds
+    hang_seconds: float = 60.0
+    session_ttl: float = 0.0      # seconds until a session expires (0 = never)
+    session_max_requests: int = 0  # requests per session before expiry (0 = unlimited)
+    seed: int = 1
+
+
+@dataclass
+class MockMFPStats:
+    requests: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    expired_sessions: int = 0
+    logins: int = 0
+    bytes_sent: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def bump(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "expired_sessions": self.expired_sessions,
+            "logins": self.logins,
+            "bytes_sent": self.bytes_sent,
+        }
+
+
+def _build_exports(config: MockMFPConfig, printer: str) -> Tuple[bytes, bytes]:
+    rng = random.Random(config.seed)
+    users = generate_data.make_users(config.users, rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        joblog = generate_data.write_joblogs(
+            tmp_dir, config.joblog_rows, [printer], users, config.months, 60, rng
+        )[0]
+        usercount = generate_data.write_usercounts(tmp_dir, [printer], users, 1, rng)[0]
+        return joblog.read_bytes(), usercount.read_bytes()
+
+
+class MockMFPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], config: MockMFPConfig):
+        super().__init__(address, MockMFPHandler)
+        self.config = config
+        self.stats = MockMFPStats()
+        self.rng = random.Random(config.seed)
+        self.rng_lock = threading.Lock()
+        self.sessions: Dict[str, Dict[str, float]] = {}
+        self.base_url = f"http://{self.server_address[0]}:{self.server_address[1]}"
+        self.joblog_csv, self.usercount_csv = _build_exports(config, self.base_url)
+
+    def roll(self) -> float:
+        with self.rng_lock:
+            return self.rng.random()
+
+
+class MockMFPHandler(BaseHTTPRequestHandler):
+    server: MockMFPServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # noqa: A002 - BaseHTTPRequestHandler signature
+        pass
+
+    # ---------- helpers ----------
+    def _send(self, status: int, body: bytes, content_type: str = "text/html; charset=utf-8",
+              headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats.bump("bytes_sent", len(body))
+
+    def _redirect(self, location: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send(302, b"", headers={"Location": location, **(headers or {})})
+
+    def _session_id(self) -> Optional[str]:
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        morsel = cookie.get(SESSION_COOKIE)
+        return morsel.value if morsel else None
+
+    def _valid_session(self) -> bool:
+        sid = self._session_id()
+        session = self.server.sessions.get(sid) if sid else None
+        if not session:
+            return False
+        config = self.server.config
+        session["requests"] += 1
+        expired = (config.session_ttl and time.monotonic() - session["created"] > config.session_ttl) or (
+            config.session_max_requests and session["requests"] > config.session_max_requests
+        )
+        if expired:
+            self.server.sessions.pop(sid, None)
+            self.server.stats.bump("expired_sessions")
+            return False
+        return True
+
+    def _token_page(self, title: str) -> bytes:
+        token1 = secrets.token_hex(8)
+        token2 = secrets.token_hex(8)
+        return (
+            f"<html><head><title>{title}</title></head><body><form method=\"post\">"
+            f"<input type=\"hidden\" name=\"token1\" value=\"{token1}\">"
+            f"<input type=\"hidden\" name=\"token2\" value=\"{token2}\">"
+            "</form></body></html>"
+        ).encode("utf-8")
+
+    def _read_form(self) -> Dict[str, List[str]]:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length).decode("utf-8", errors="replace") if length else ""
+        return parse_qs(raw)
+
+    def _inject_faults(self) -> bool:
+        """Apply latency / hang / 5xx. Returns True when the request was consumed."""
+        config = self.server.config
+        self.server.stats.bump("requests")
+        delay = config.latency
+        if config.latency_jitter:
+            delay += (self.server.roll() * 2 - 1) * config.latency_jitter
+        if delay > 0:
+            time.sleep(delay)
+        if config.timeout_rate and self.server.roll() < config.timeout_rate:
+            self.server.stats.bump("timeouts")
+            time.sleep(config.hang_seconds)
+            self.close_connection = True
+            return True
+        if config.error_rate and self.server.roll() < config.error_rate:
+            self.server.stats.bump("errors")
+            self._send(503, b"<html><body>Service Unavailable</body></html>")
+            return True
+        return False
+
+    # ---------- routes ----------
+    def do_GET(self):  # noqa: N802 - http.server naming
+        if self._inject_faults():
+            return
+        path = urlparse(self.path).path
+
+        if path == "/login.html":
+            self._send(200, self._token_page("login"))
+        elif path in ("/", "/main.html"):
+            if self._valid_session():
+                self._send(200, b"<html><body>main</body></html>")
+            else:
+                self._redirect("/login.html?/main.html")
+        elif path in ("/account_usercountlist_save.html", "/sysmgt_joblog_save.html"):
+            if self._valid_session():
+                self._send(200, self._token_page(path.strip("/")))
+            else:
+                self._redirect("/login.html?/main.html")
+        elif path == "/account_count_save.html":
+            if self._valid_session():
+                self._send(200, self.server.usercount_csv, "text/csv; charset=big5")
+            else:
+                self._redirect("/login.html?/main.html")
+        elif path == "/joblog_download.html":
+            if self._valid_session():
+                self._send(200, self.server.joblog_csv, "text/csv; charset=big5")
+            else:
+                self._redirect("/login.html?/main.html")
+        else:
+            self._send(404, b"not found")
+
+    def do_POST(self):  # noqa: N802 - http.server naming
+        form = self._read_form()
+        if self._inject_faults():
+            return
+        path = urlparse(self.path).path
+        config = self.server.config
+
+        if path == "/login.html":
+            user = (form.get("ggt_textbox(10002)") or [""])[0]
+            password = (form.get("ggt_textbox(10003)") or [""])[0]
+            if user != config.username or password != config.password or not form.get("token2"):
+                self._redirect("/login.html?/main.html")
+                return
+            sid = secrets.token_hex(16)
+            self.server.sessions[sid] = {"created": time.monotonic(), "requests": 0}
+            self.server.stats.bump("logins")
+            self._redirect("/main.html", {"Set-Cookie": f"{SESSION_COOKIE}={sid}; Path=/"})
+        elif path in ("/account_usercountlist_save.html", "/sysmgt_joblog_save.html"):
+            if not form.get("token1") or not form.get("token2"):
+                self._send(400, b"missing token")
+            elif self._valid_session():
+                self._send(200, b"<html><body>ok</body></html>")
+            else:
+                self._redirect("/login.html?/main.html")
+        else:
+            self._send(404, b"not found")
+
+
+def start_mock_servers(count: int, config: MockMFPConfig, host: str = "127.0.0.1") -> List[MockMFPServer]:
+    """Start `count` mock printers on ephemeral ports, each in a daemon thread."""
+    servers = []
+    for i in range(count):
+        server_config = MockMFPConfig(**{**config.__dict__, "seed": config.seed + i})
+        server = MockMFPServer((host, 0), server_config)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def stop_mock_servers(servers: List[MockMFPServer]) -> None:
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock Sharp MFP web server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rows", type=int, default=5000, help="job log 筆數")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--hang-seconds", type=float, default=60.0)
+    parser.add_argument("--session-ttl", type=float, default=0.0)
+    parser.add_argument("--session-max-requests", type=int, default=0)
+    args = parser.parse_args()
+
+    config = MockMFPConfig(
+        joblog_rows=args.rows, users=args.users, latency=args.latency,
+        latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate, hang_seconds=args.hang_seconds,
+        session_ttl=args.session_ttl, session_max_requests=args.session_max_requests,
+    )
+    server = MockMFPServer((args.host, args.port), config)
+    print(f"Mock MFP listening on {server.base_url} ({len(server.joblog_csv)} bytes job log)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(server.stats.as_dict())
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Reproducible load-test benchmarks against a local MySQL/MariaDB.
+
+For each dataset size: generate Big5 exports (cached under --data-dir),
+reset the benchmark DB, time the ingest, then time every report page and
+export route through Flask's test client with the view cache cleared.
+Results go to a JSON file that can be compared between runs.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 10k,1m --out bench_results.json
+    python benchmarks/run_benchmarks.py --compare old.json new.json
+
+See benchmarks/fixture.py for the BENCH_DB_* settings.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fixture  # noqa: E402
+import generate_data  # noqa: E402
+
+BENCH_MONTH = "2026-01"
+
+# (scenario name, URL)
+SCENARIOS: List[Tuple[str, str]] = [
+    ("counts_single_printer", "/counts?view_mode=single_printer"),
+    ("counts_all_printers", "/counts?view_mode=all_printers"),
+    ("counts_aggregated", "/counts?view_mode=aggregated"),
+    ("counts_month_all_printers", f"/counts?view_mode=all_printers&time_mode=month&month={BENCH_MONTH}"),
+    ("jobs", "/jobs"),
+    ("jobs_filename_filter", "/jobs?filename=數學"),
+    ("jobs_filename_common", "/jobs?filename=pdf"),
+    ("jobs_filename_date", "/jobs?filename=0131"),
+    ("jobs_month", f"/jobs?time_mode=month&month={BENCH_MONTH}"),
+    ("leaders_all_printers", "/leaders?view_mode=all_printers"),
+    ("leaders_single_printer", "/leaders?view_mode=single_printer"),
+    ("leaders_aggregated", "/leaders?view_mode=aggregated"),
+    ("export_jobs", "/export/jobs"),
+    ("export_stats_single_printer", "/export/stats?view_mode=single_printer"),
+    ("export_stats_all_printers", "/export/stats?view_mode=all_printers"),
+    ("export_stats_aggregated", "/export/stats?view_mode=aggregated"),
+    ("export_stats_all_scope", "/export/stats?view_mode=all_printers&export_scope=all"),
+    ("export_leaders_all_data", "/export/leaders?export_range=all_data"),
+]
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    factor = 1
+    if text.endswith("k"):
+        factor, text = 1000, text[:-1]
+    elif text.endswith("m"):
+        factor, text = 1000000, text[:-1]
+    return int(float(text) * factor)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).resolve().parent, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def ensure_dataset(data_dir: Path, rows: int, args: argparse.Namespace) -> Path:
+    # Every generator parameter is part of the name, so changing one never reuses old data
+    target = data_dir / f"rows_{rows}_p{args.printers}_u{args.users}_m{args.months}_s{args.seed}"
+    marker = target / ".complete"
+    if not marker.exists():
+        print(f"產生 {rows} 筆資料 -> {target}")
+        generate_data.generate(
+            target, rows, printers=args.printers, users=args.users,
+            months=args.months, seed=args.seed,
+        )
+        marker.write_text(datetime.now().isoformat())
+    return target
+
+
+def time_route(client, cache, url: str, repeat: int) -> Dict[str, Any]:
+    import sharp_mfp_export
+
+    runs = []
+    status = None
+    size = 0
+    for _ in range(repeat):
+        # Every run measures the full render, pagination COUNTs included
+        cache.clear()
+        sharp_mfp_export.COUNT_STORE.clear()
+        t0 = time.perf_counter()
+        response = client.get(url)
+        data = response.get_data()
+        runs.append(time.perf_counter() - t0)
+        status = response.status_code
+        size = len(data)
+    return {
+        "runs": runs,
+        "median": statistics.median(runs),
+        "min": min(runs),
+        "status": status,
+        "bytes": size,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    printers = generate_data.printer_addrs(args.printers)
+    fixture.configure_environment(printers)
+
+    import ldap_service
+    if not args.with_ldap:
+        ldap_service.LDAP_AVAILABLE = False
+
+    import webapp
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "repeat": args.repeat,
+            "printers": args.printers,
+            "users": args.users,
+            "months": args.months,
+            "seed": args.seed,
+        },
+        "sizes": {},
+    }
+
+    for size_text in args.sizes.split(","):
+        rows = parse_size(size_text)
+        data_dir = ensure_dataset(Path(args.data_dir), rows, args)
+        print(f"\n== {rows} rows ==")
+
+        fixture.reset_database()
+        ingest = fixture.load_fixture(data_dir, bulk=not args.no_bulk, workers=args.workers)
+        print(f"  ingest: {ingest['seconds']:.2f}s ({ingest['rows']} rows reported)")
+
+        size_result: Dict[str, Any] = {
+            "job_logs": fixture.table_rows("job_logs"),
+            "scenarios": {"ingest": {"runs": [ingest["seconds"]], "median": ingest["seconds"], "min": ingest["seconds"]}},
+        }
+        with webapp.app.test_client() as client:
+            for name, url in SCENARIOS:
+                if args.only and name not in args.only.split(","):
+                    continue
+                outcome = time_route(client, webapp.cache, url, args.repeat)
+                size_result["scenarios"][name] = outcome
+                flag = "" if outcome["status"] == 200 else f"  [HTTP {outcome['status']}]"
+                print(f"  {name:32s} median {outcome['median'] * 1000:9.1f} ms{flag}")
+        results["sizes"][str(rows)] = size_result
+
+    return results
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path, encoding="utf-8") as fh:
+        old = json.load(fh)
+    with open(new_path, encoding="utf-8") as fh:
+        new = json.load(fh)
+    print(f"{old['meta'].get('revision')} -> {new['meta'].get('revision')}")
+    for size, new_size in new["sizes"].items():
+        old_size = old["sizes"].get(size)
+        if not old_size:
+            continue
+        print(f"\n== {size} rows ==")
+        for name, outcome in new_size["scenarios"].items():
+            before = old_size["scenarios"].get(name)
+            if not before:
+                continue
+            a, b = before["median"], outcome["median"]
+            change = (b - a) / a * 100 if a else 0.0
+            print(f"  {name:32s} {a * 1000:9.1f} ms -> {b * 1000:9.1f} ms  ({change:+.1f}%)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="列印機系統效能基準測試")
+    parser.add_argument("--sizes", default="10k", help="資料量，逗號分隔 (例如 10k,1m,10m)")
+    parser.add_argument("--repeat", type=int, default=3, help="每個情境重複次數")
+    parser.add_argument("--printers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--months", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=4, help="匯入並行數")
+    parser.add_argument("--no-bulk", action="store_true", help="匯入時不使用 LOAD DATA")
+    parser.add_argument("--with-ldap", action="store_true", help="保留 LDAP 查詢 (預設停用)")
+    parser.add_argument("--only", help="只執行指定情境 (逗號分隔)")
+    parser.add_argument("--data-dir", default="bench_data")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="比較兩個結果檔")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run(args)
+    with open(args.out, "w", encoding="utf-8") as fh:
+        json.dump(results, fh, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Pagination totals without a COUNT per request.
+
+Every /jobs and /counts render used to run COUNT(DISTINCT user_name,
+login_name), often COUNT(DISTINCT user, login, printer) and COUNT(*) over
+the same filtered job_logs rows, just to print "page X of Y". CountStore
+keeps those totals per process, keyed by (kind, normalised filter
+signature, ingestion generation). A repeat is a dict lookup; a new ingest
+starts a new generation and the old totals are dropped.
+
+Optional approximate counts (COUNT_SKETCHES=1): count_sketches holds one
+row per day and printer with the exact job count and a HyperLogLog sketch
+of the distinct (user, login) pairs. A window filtered only by printer and
+whole days, and at least COUNT_SKETCH_MIN_DAYS long (or unbounded), is then
+counted from those rows instead of job_logs:
+
+- jobs: sum of the per-day counts
+- users: merged sketch (about 1.6% standard error)
+- pairs: one merged sketch per printer, summed
+
+Sketches are rebuilt for the last SKETCH_REFRESH_DAYS days after each
+download; `sharp_mfp_export.py sketch-counts --all` rebuilds them after a
+historical import. count_sketch_state records which days that covers: a
+full rebuild covers every day, a partial one the days from its first day
+on, carried over while each refresh reaches back to the previous one. A
+window with days outside that range, narrower or keyword-filtered
+windows, and databases without sketches run the exact COUNT on the first
+request and cache it.
+"""
+
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+
+COUNT_CACHE_SIZE = int(os.getenv("COUNT_CACHE_SIZE", "2048"))
+COUNT_SKETCHES = os.getenv("COUNT_SKETCHES", "0").lower() in ("1", "true", "yes", "on")
+SKETCH_MIN_DAYS = int(os.getenv("COUNT_SKETCH_MIN_DAYS", "28"))
+SKETCH_REFRESH_DAYS = int(os.getenv("COUNT_SKETCH_REFRESH_DAYS", "3"))
+HLL_PRECISION = 12  # 4096 one-byte registers per sketch
+
+COUNT_SKETCHES_DDL = """
+CREATE TABLE IF NOT EXISTS count_sketches (
+    day DATE NOT NULL,
+    printer_addr VARCHAR(100) NOT NULL,
+    jobs INT NOT NULL DEFAULT 0,
+    users BLOB NOT NULL,
+    built_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (day, printer_addr)
+);
+"""
+
+COUNT_SKETCH_STATE_DDL = """
+CREATE TABLE IF NOT EXISTS count_sketch_state (
+    name VARCHAR(32) PRIMARY KEY,
+    covered_from DATE NULL,
+    refreshed_on DATE NOT NULL
+);
+"""
+
+# Filters that a sketch can answer; any other non-empty filter means an exact count
+_SKETCH_FILTERS = ("printer", "start", "end")
+_POW2 = [2.0 ** -i for i in range(65)]
+
+
+def _normalise(value: Any) -> Any:
+    if isinstance(value, str):
+        value = value.strip()
+        return value.lower() or None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def filter_signature(filters: Dict[str, Any]) -> str:
+    """Stable hash of the filters; blank values and printer "all" count as unset."""
+    normalised = {k: _normalise(v) for k, v in filters.items()}
+    if normalised.get("printer") == "all":
+        normalised["printer"] = None
+    normalised = {k: v for k, v in normalised.items() if v is not None}
+    return hashlib.md5(json.dumps(normalised, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class HyperLogLog:
+    """Distinct-count sketch; merge() is the register-wise maximum."""
+
+    __slots__ = ("p", "registers")
+
+    def __init__(self, p: int = HLL_PRECISION, registers: Optional[bytes] = None):
+        self.p = p
+        self.registers = bytearray(registers) if registers else bytearray(1 << p)
+
+    def add(self, value: str) -> None:
+        x = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        bits = 64 - self.p
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(map(_POW2.__getitem__, self.registers))
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+
+def user_pair_key(user_name: Optional[str], login_name: Optional[str]) -> str:
+    # Folded like the column collation, so case variants count once as in GROUP BY
+    def fold(value: Optional[str]) -> str:
+        return "\x00" if value is None else value.casefold().rstrip(" ")
+
+    return f"{fold(user_name)}\x1f{fold(login_name)}"
+
+
+def build_sketches(rows: Iterable[Dict[str, Any]]) -> Dict[Tuple[date, str], Tuple[int, HyperLogLog]]:
+    """rows: day, printer_addr, user_name, login_name, jobs (grouped) -> {(day, printer): (jobs, sketch)}."""
+    sketches: Dict[Tuple[date, str], List[Any]] = {}
+    for row in rows:
+        key = (row["day"], row["printer_addr"])
+        entry = sketches.get(key)
+        if entry is None:
+            entry = sketches[key] = [0, HyperLogLog()]
+        entry[0] += int(row["jobs"])
+        entry[1].add(user_pair_key(row["user_name"], row["login_name"]))
+    return {key: (jobs, sketch) for key, (jobs, sketch) in sketches.items()}
+
+
+def sketch_window(filters: Dict[str, Any]) -> Optional[Tuple[Optional[date], Optional[date], Optional[str]]]:
+    """
+    (first day, last day, printer) when the sketches can answer the filters:
+    nothing but printer and whole-day bounds, spanning at least
+    SKETCH_MIN_DAYS (open ends allowed). None otherwise.
+    """
+    for key, value in filters.items():
+        if key not in _SKETCH_FILTERS and _normalise(value) is not None:
+            return None
+    start, end = filters.get("start"), filters.get("end")
+    if start is not None and start.time() != dt_time.min:
+        return None
+    if end is not None and end.time() < dt_time(23, 59, 59):
+        return None
+    first = start.date() if start is not None else None
+    last = end.date() if end is not None else None
+    if first is not None and last is not None and (last - first).days + 1 < SKETCH_MIN_DAYS:
+        return None
+    printer = filters.get("printer")
+    return first, last, (printer if printer and printer != "all" else None)
+
+
+def estimate(kind: str, rows: Iterable[Dict[str, Any]]) -> Optional[int]:
+    """Count of `kind` (jobs | users | pairs) from count_sketches rows (printer_addr, jobs, users)."""
+    rows = list(rows)
+    if not rows:
+        return None
+    if kind == "jobs":
+        return sum(int(r["jobs"]) for r in rows)
+    groups: Dict[str, List[bytes]] = {}
+    for r in rows:
+        groups.setdefault(r["printer_addr"] if kind == "pairs" else "", []).append(r["users"])
+    return sum(merged(registers).count() for registers in groups.values())
+
+
+def merged(registers: List[bytes]) -> HyperLogLog:
+    """Union of many sketches in one pass (a register-wise max across all of them)."""
+    if len(registers) == 1:
+        return HyperLogLog(registers=registers[0])
+    return HyperLogLog(registers=bytes(map(max, *registers)))
+
+
+def refresh_since(days: Optional[int], today: Optional[date] = None) -> Optional[date]:
+    """First day to rebuild: None (everything) or `days` days back."""
+    return None if days is None else (today or date.today()) - timedelta(days=days - 1)
+
+
+def coverage_after_refresh(state: Optional[Dict[str, Any]], since: Optional[date]) -> Optional[date]:
+    """
+    covered_from once the sketches from `since` on (None: every day) are rebuilt.
+    Earlier coverage carries over only if the previous refresh reached `since`;
+    otherwise the days in between were never sketched.
+    """
+    if since is None:
+        return None
+    if state is not None and state["refreshed_on"] >= since:
+        return state["covered_from"]
+    return since
+
+
+def sketches_cover(
+    state: Optional[Dict[str, Any]], first: Optional[date], last: Optional[date], today: Optional[date] = None
+) -> bool:
+    """
+    True when count_sketch_state row `state` (covered_from, refreshed_on) says
+    every day of the window first..last (None: open) has been sketched.
+    """
+    if state is None:
+        # Never built
+        return False
+    covered_from = state["covered_from"]
+    if covered_from is not None and (first is None or first < covered_from):
+        return False
+    # Days after the last refresh may already hold new jobs
+    today = today or date.today()
+    return min(last, today) <= state["refreshed_on"] if last is not None else today <= state["refreshed_on"]
+
+
+class CountStore:
+    """Pagination totals per (kind, filter signature, ingestion generation), thread-safe."""
+
+    def __init__(
+        self,
+        generation: Callable[[], Tuple[int, Any]],
+        estimate: Optional[Callable[[str, Dict[str, Any]], Optional[int]]] = None,
+        max_entries: int = COUNT_CACHE_SIZE,
+    ):
+        # generation() -> (generation, last_modified), e.g. get_ingestion_generation;
+        # estimate(kind, filters) -> approximate count or None to count exactly
+        self._generation = generation
+        self._estimate = estimate
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._entries_generation = None
+        self._lock = threading.Lock()
+
+    def count(self, kind: str, filters: Dict[str, Any], exact: Callable[[], int]) -> int:
+        generation = self._generation()[0]
+        key = (kind, filter_signature(filters))
+        if generation:
+            with self._lock:
+                if self._entries_generation == generation and key in self._entries:
+                    self._entries.move_to_end(key)
+                    metrics.PAGINATION_COUNTS.inc(kind=kind, result="hit")
+                    return self._entries[key]
+
+        value = None
+        result = "exact"
+        if self._estimate is not None:
+            try:
+                value = self._estimate(kind, filters)
+            except Exception as e:
+                print(f"Count sketch lookup failed: {e}")
+            if value is not None:
+                result = "approx"
+        if value is None:
+            value = exact()
+        metrics.PAGINATION_COUNTS.inc(kind=kind, result=result)
+
+        # Generation 0 means unknown (lookup failed): nothing to key on
+        if generation:
+            with self._lock:
+                if self._entries_generation != generation:
+                    self._entries.clear()
+                    self._entries_generation = generation
+                self._entries[key] = value
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
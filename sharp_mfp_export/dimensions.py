@@ -0,0 +1,255 @@
+"""
+Surrogate-key dimension tables for job_logs.
+
+Every job_logs row used to carry printer_addr, mode, user_name/login_name and
+computer_name only as strings, and reports grouped on those wide values.
+Each of them now also lives once in a small dimension table:
+
+    dim_printer (printer_addr)        -> job_logs.printer_id
+    dim_mode (mode)                   -> job_logs.mode_id
+    dim_user (user_name, login_name)  -> job_logs.user_id
+    dim_computer (computer_name)      -> job_logs.computer_id
+
+Ingest resolves ids through DimensionCache (INSERT IGNORE + SELECT on a
+miss, then an in-process dict), so steady-state ingest adds no round trips.
+The string columns stay on job_logs: filters, exports and the raw log view
+keep working unchanged; reports group on the integer ids and join the few
+resulting rows back to the dimension.
+
+Dimension keys compare with the column collation (the unique key lives in
+the DB), so ids group exactly like GROUP BY on the strings did. NULL and ''
+are kept apart by a *_null flag, as GROUP BY does.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+Key = Tuple[Optional[str], ...]
+READY_CACHE_TTL = 5.0
+BACKFILL_BATCH = 50000
+
+
+class Dimension(NamedTuple):
+    name: str
+    table: str
+    id_column: str
+    id_type: str
+    columns: Tuple[Tuple[str, int], ...]  # (column, VARCHAR length)
+
+
+DIMENSIONS: Dict[str, Dimension] = {
+    "printer": Dimension("printer", "dim_printer", "printer_id", "SMALLINT UNSIGNED", (("printer_addr", 100),)),
+    "mode": Dimension("mode", "dim_mode", "mode_id", "SMALLINT UNSIGNED", (("mode", 50),)),
+    "user": Dimension("user", "dim_user", "user_id", "INT UNSIGNED", (("user_name", 100), ("login_name", 100))),
+    "computer": Dimension("computer", "dim_computer", "computer_id", "INT UNSIGNED", (("computer_name", 100),)),
+}
+# Order of the id columns appended to job_logs inserts
+ID_COLUMNS = tuple(dim.id_column for dim in DIMENSIONS.values())
+
+JOB_LOGS_INDEXES = [
+    # Covering index for time-ranged reports (all printers or one printer)
+    "CREATE INDEX IF NOT EXISTS idx_dim_time ON job_logs (start_time, printer_id, user_id, total_pages)",
+    # Covering index for unranged per-printer reports; also answers ready()
+    "CREATE INDEX IF NOT EXISTS idx_dim_printer_user ON job_logs (printer_id, user_id, total_pages)",
+    # Detail rows of one report page
+    "CREATE INDEX IF NOT EXISTS idx_dim_user_time ON job_logs (user_id, start_time)",
+]
+
+_READY_CACHE: Dict[str, Any] = {"ready": False, "checked_at": 0.0}
+
+
+def _ddl(dim: Dimension) -> str:
+    cols = []
+    key_cols = []
+    for column, length in dim.columns:
+        cols.append(f"{column} VARCHAR({length}) NOT NULL DEFAULT ''")
+        cols.append(f"{column}_null TINYINT(1) NOT NULL DEFAULT 0")
+        key_cols.extend([column, f"{column}_null"])
+    return (
+        f"CREATE TABLE IF NOT EXISTS {dim.table} (\n"
+        f"    id {dim.id_type} AUTO_INCREMENT PRIMARY KEY,\n    "
+        + ",\n    ".join(cols)
+        + f",\n    UNIQUE KEY uniq_{dim.name} ({', '.join(key_cols)})\n)"
+    )
+
+
+def schema_statements() -> List[str]:
+    statements = [_ddl(dim) for dim in DIMENSIONS.values()]
+    statements += [
+        f"ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS {dim.id_column} {dim.id_type} NULL"
+        for dim in DIMENSIONS.values()
+    ]
+    return statements + JOB_LOGS_INDEXES
+
+
+def ensure_schema(cursor) -> None:
+    for sql in schema_statements():
+        try:
+            cursor.execute(sql)
+        except Exception as e:
+            print(f"Dimension schema error: {e}")
+
+
+def _key_params(key: Key) -> List[Any]:
+    params: List[Any] = []
+    for value in key:
+        params.extend(["" if value is None else value, 1 if value is None else 0])
+    return params
+
+
+def _key_condition(dim: Dimension) -> str:
+    return " AND ".join(f"{c} = %s AND {c}_null = %s" for c, _ in dim.columns)
+
+
+def _row_key(dim: Dimension, row: Dict[str, Any]) -> Key:
+    return tuple(None if row[f"{c}_null"] else row[c] for c, _ in dim.columns)
+
+
+def _fold(key: Key) -> Key:
+    return tuple(None if v is None else v.casefold().rstrip(" ") for v in key)
+
+
+class DimensionCache:
+    """Key -> surrogate id, filled from the DB on a miss (thread-safe)."""
+
+    def __init__(self, connect: Callable[[], Any]):
+        # connect must return an autocommit connection: ids handed out are
+        # cached, so they must never belong to a rolled-back transaction
+        self._connect = connect
+        self._ids: Dict[str, Dict[Key, int]] = {name: {} for name in DIMENSIONS}
+        self._lock = threading.Lock()
+
+    def ids(self, name: str, keys: Iterable[Key]) -> Dict[Key, int]:
+        cache = self._ids[name]
+        wanted = set(keys)
+        with self._lock:
+            missing = [k for k in wanted if k not in cache]
+        if missing:
+            resolved = self._resolve(DIMENSIONS[name], missing)
+            with self._lock:
+                cache.update(resolved)
+        with self._lock:
+            return {k: cache[k] for k in wanted}
+
+    def clear(self) -> None:
+        with self._lock:
+            for cache in self._ids.values():
+                cache.clear()
+
+    def _resolve(self, dim: Dimension, keys: List[Key]) -> Dict[Key, int]:
+        key_cols = []
+        for column, _ in dim.columns:
+            key_cols.extend([column, f"{column}_null"])
+        select_cols = ", ".join(["id"] + key_cols)
+        tuple_ph = "(" + ", ".join(["%s"] * len(key_cols)) + ")"
+        resolved: Dict[Key, int] = {}
+
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    cursor.executemany(
+                        f"INSERT IGNORE INTO {dim.table} ({', '.join(key_cols)}) VALUES {tuple_ph}",
+                        [_key_params(k) for k in chunk],
+                    )
+                    params: List[Any] = []
+                    for k in chunk:
+                        params.extend(_key_params(k))
+                    cursor.execute(
+                        f"SELECT {select_cols} FROM {dim.table} "
+                        f"WHERE ({', '.join(key_cols)}) IN ({', '.join([tuple_ph] * len(chunk))})",
+                        params,
+                    )
+                    rows = cursor.fetchall()
+                    exact = {_row_key(dim, r): r["id"] for r in rows}
+                    folded = {_fold(_row_key(dim, r)): r["id"] for r in rows}
+                    for k in chunk:
+                        found = exact.get(k) or folded.get(_fold(k))
+                        if found is None:
+                            # Collation equivalence Python can't mirror (accents etc.)
+                            cursor.execute(
+                                f"SELECT id FROM {dim.table} WHERE {_key_condition(dim)}", _key_params(k)
+                            )
+                            row = cursor.fetchone()
+                            found = row["id"] if row else None
+                        if found is not None:
+                            resolved[k] = found
+        finally:
+            conn.close()
+        return resolved
+
+
+def lookup_id(cursor, name: str, key: Key) -> Optional[int]:
+    """Read-only id lookup for query filters (None if the value never occurred)."""
+    dim = DIMENSIONS[name]
+    cursor.execute(f"SELECT id FROM {dim.table} WHERE {_key_condition(dim)}", _key_params(key))
+    row = cursor.fetchone()
+    return row["id"] if row else None
+
+
+def ready(cursor) -> bool:
+    """True once every job_logs row carries dimension ids (cached for READY_CACHE_TTL)."""
+    now = time.monotonic()
+    if cursor is None:
+        return False
+    if now - _READY_CACHE["checked_at"] < READY_CACHE_TTL:
+        return _READY_CACHE["ready"]
+    try:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM job_logs WHERE printer_id IS NULL) AS pending")
+        is_ready = not cursor.fetchone()["pending"]
+    except Exception:
+        is_ready = False
+    _READY_CACHE.update(ready=is_ready, checked_at=now)
+    return is_ready
+
+
+def invalidate_ready() -> None:
+    """Re-check readiness on the next ready() call."""
+    _READY_CACHE["checked_at"] = 0.0
+
+
+def backfill(conn, batch: int = BACKFILL_BATCH, progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Populate dimensions from existing job_logs and set the id columns on rows
+    that lack them, in id ranges so no statement locks the whole table.
+    """
+    updated = 0
+    with conn.cursor() as cursor:
+        for dim in DIMENSIONS.values():
+            key_cols = []
+            exprs = []
+            for column, _ in dim.columns:
+                key_cols.extend([column, f"{column}_null"])
+                exprs.extend([f"COALESCE({column}, '')", f"{column} IS NULL"])
+            cursor.execute(
+                f"INSERT IGNORE INTO {dim.table} ({', '.join(key_cols)}) "
+                f"SELECT DISTINCT {', '.join(exprs)} FROM job_logs WHERE {dim.id_column} IS NULL"
+            )
+
+        joins = []
+        sets = []
+        for alias, dim in enumerate(DIMENSIONS.values()):
+            cond = " AND ".join(
+                f"d{alias}.{c} = COALESCE(j.{c}, '') AND d{alias}.{c}_null = (j.{c} IS NULL)" for c, _ in dim.columns
+            )
+            joins.append(f"JOIN {dim.table} d{alias} ON {cond}")
+            sets.append(f"j.{dim.id_column} = d{alias}.id")
+
+        cursor.execute("SELECT MIN(id) AS lo, MAX(id) AS hi FROM job_logs WHERE printer_id IS NULL")
+        bounds = cursor.fetchone()
+        if not bounds or bounds["lo"] is None:
+            return 0
+        lo, hi = bounds["lo"], bounds["hi"]
+        while lo <= hi:
+            updated += cursor.execute(
+                f"UPDATE job_logs j {' '.join(joins)} SET {', '.join(sets)} "
+                f"WHERE j.id BETWEEN %s AND %s AND j.printer_id IS NULL",
+                (lo, lo + batch - 1),
+            )
+            if progress:
+                progress(updated, min(lo + batch - 1, hi))
+            lo += batch
+    invalidate_ready()
+    return updated
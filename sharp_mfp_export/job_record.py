@@ -0,0 +1,151 @@
+"""
+Compact record for one job log row.
+
+Reports used to carry every job as a 19-key dict, built once from the CSV
+(_joblog_entries_from_csv_raw) and again from the database
+(_convert_db_row), each time running normalize_name() and .lower() for the
+four display / key fields. JobRecord keeps the row in __slots__ (no
+per-instance __dict__), and computes user_display / user_key /
+login_display / login_key on first access. The normalisation itself is
+memoised per distinct name, because a few hundred users account for
+millions of rows.
+
+Existing callers index records like dicts (entry["pages"], entry.get(...));
+__getitem__ / get / __contains__ keep that working, and Jinja templates
+read the attributes directly.
+"""
+
+import functools
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+DISPLAY_CACHE_SIZE = 8192
+
+
+def normalize_name(value: Optional[str], fallback: str = "未知") -> str:
+    if value is None:
+        return fallback
+    cleaned = value.strip()
+    return cleaned or fallback
+
+
+@functools.lru_cache(maxsize=DISPLAY_CACHE_SIZE)
+def _display_and_key(value: Optional[str], fallback: str) -> Tuple[str, str]:
+    display = normalize_name(value, fallback)
+    return display, display.lower()
+
+
+class JobRecord:
+    """One job log row; derived user / login display fields are computed lazily."""
+
+    FIELDS = (
+        "job_id", "account_job_id", "mode", "computer", "user", "login", "start", "end",
+        "bw", "color", "pages", "printer", "file_name", "scan_type", "destination", "user_id",
+    )
+    DERIVED = ("user_display", "user_key", "login_display", "login_key")
+
+    __slots__ = FIELDS + ("_user", "_login")
+
+    def __init__(
+        self,
+        job_id: Optional[str] = None,
+        account_job_id: Optional[str] = None,
+        mode: Optional[str] = None,
+        computer: Optional[str] = None,
+        user: Optional[str] = None,
+        login: Optional[str] = None,
+        start: Any = None,
+        end: Any = None,
+        bw: int = 0,
+        color: int = 0,
+        pages: Optional[int] = None,
+        printer: Optional[str] = None,
+        file_name: Optional[str] = None,
+        scan_type: Optional[str] = None,
+        destination: Optional[str] = None,
+        user_id: Optional[int] = None,
+    ):
+        self.job_id = job_id
+        self.account_job_id = account_job_id
+        self.mode = mode
+        self.computer = computer
+        self.user = user
+        self.login = login
+        self.start = start
+        self.end = end
+        self.bw = bw
+        self.color = color
+        self.pages = bw + color if pages is None else pages
+        self.printer = printer
+        self.file_name = file_name
+        self.scan_type = scan_type
+        self.destination = destination
+        self.user_id = user_id
+        # (display, key) pairs, filled on first access
+        self._user = None
+        self._login = None
+
+    @property
+    def user_display(self) -> str:
+        if self._user is None:
+            self._user = _display_and_key(self.user, "未知")
+        return self._user[0]
+
+    @property
+    def user_key(self) -> str:
+        if self._user is None:
+            self._user = _display_and_key(self.user, "未知")
+        return self._user[1]
+
+    @property
+    def login_display(self) -> str:
+        if self._login is None:
+            self._login = _display_and_key(self.login, "N/A")
+        return self._login[0]
+
+    @property
+    def login_key(self) -> str:
+        if self._login is None:
+            self._login = _display_and_key(self.login, "N/A")
+        return self._login[1]
+
+    # ---------- dict-style access ----------
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS or key in self.DERIVED:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.FIELDS or key in self.DERIVED
+
+    def keys(self) -> Iterator[str]:
+        yield from self.FIELDS
+        yield from self.DERIVED
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: self[key] for key in self.keys()}
+
+    def __getstate__(self) -> Tuple[Any, ...]:
+        # Derived fields are recomputed after unpickling
+        return tuple(getattr(self, field) for field in self.FIELDS)
+
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:
+        for field, value in zip(self.FIELDS, state):
+            setattr(self, field, value)
+        self._user = None
+        self._login = None
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, JobRecord):
+            return NotImplemented
+        return self.__getstate__() == other.__getstate__()
+
+    __hash__ = None  # mutable
+
+    def __repr__(self) -> str:
+        return f"JobRecord(printer={self.printer!r}, job_id={self.job_id!r}, start={self.start!r}, user={self.user!r})"
@@ -5,23 +5,21 @@ This module provides functionality to query Microsoft Active Directory
 for user display names. It includes caching to minimize LDAP queries.
 """
 
+import importlib.util
 import os
 import logging
-from typing import Optional
+import time
+from typing import TYPE_CHECKING, Optional
 from functools import lru_cache
 
-try:
-    from ldap3 import Server, Connection, ALL, SUBTREE
-    from ldap3.core.exceptions import LDAPException
-    LDAP_AVAILABLE = True
-except ImportError:
-    LDAP_AVAILABLE = False
-    # Define dummy placeholders for type hints if library is missing
-    Server = object
-    Connection = object
-    ALL = None
-    SUBTREE = None
-    LDAPException = Exception
+import metrics
+
+# ldap3 itself is imported on the first lookup, not at module load: most
+# CLI commands and many requests never query the directory
+if TYPE_CHECKING:
+    import ldap3
+
+LDAP_AVAILABLE = importlib.util.find_spec("ldap3") is not None
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -34,7 +32,7 @@ LDAP_BASE_DN = os.getenv("LDAP_BASE_DN", "DC=esptals,DC=esp,DC=edu,DC=mo")
 LDAP_USER_SEARCH_FILTER = os.getenv("LDAP_USER_SEARCH_FILTER", "(samAccountName={0})")
 
 
-def _create_ldap_connection() -> Optional[Connection]:
+def _create_ldap_connection() -> Optional["ldap3.Connection"]:
     """
     Create and bind an LDAP connection to Active Directory.
     
@@ -44,7 +42,10 @@ def _create_ldap_connection() -> Optional[Connection]:
     if not LDAP_AVAILABLE:
         logger.warning("ldap3 library not available. Install with: pip install ldap3")
         return None
-    
+
+    from ldap3 import ALL, Connection, Server
+    from ldap3.core.exceptions import LDAPException
+
     try:
         server = Server(LDAP_URL, get_info=ALL)
         conn = Connection(
@@ -90,8 +91,12 @@ def get_user_display_name(username: str) -> str:
     # Quick return if LDAP is not available
     if not LDAP_AVAILABLE:
         return username
-    
+
+    from ldap3 import SUBTREE
+    from ldap3.core.exceptions import LDAPException
+
     conn = None
+    t0 = time.perf_counter()
     try:
         conn = _create_ldap_connection()
         if not conn:
@@ -127,6 +132,7 @@ def get_user_display_name(username: str) -> str:
         logger.error(f"Unexpected error querying LDAP for '{username}': {e}")
         return username
     finally:
+        metrics.LDAP_LOOKUP_DURATION.observe(time.perf_counter() - t0, op="display_name")
         if conn:
             try:
                 conn.unbind()
@@ -194,8 +200,12 @@ def search_usernames_by_display_name(display_name_query: str) -> tuple:
     # Quick return if LDAP is not available
     if not LDAP_AVAILABLE:
         return ()
-    
+
+    from ldap3 import SUBTREE
+    from ldap3.core.exceptions import LDAPException
+
     conn = None
+    t0 = time.perf_counter()
     try:
         conn = _create_ldap_connection()
         if not conn:
@@ -234,6 +244,7 @@ def search_usernames_by_display_name(display_name_query: str) -> tuple:
         logger.error(f"Unexpected error searching LDAP for '{display_name_query}': {e}")
         return ()
     finally:
+        metrics.LDAP_LOOKUP_DURATION.observe(time.perf_counter() - t0, op="search")
         if conn:
             try:
                 conn.unbind()
@@ -246,3 +257,10 @@ def clear_cache():
     get_user_display_name.cache_clear()
     search_usernames_by_display_name.cache_clear()
     logger.info("LDAP cache cleared")
+
+
+# Cache hit/miss counters for /metrics (read from lru_cache at scrape time)
+metrics.register_callback(lambda: metrics.lru_cache_families("ldap", {
+    "display_name": get_user_display_name,
+    "search": search_usernames_by_display_name,
+}))
@@ -0,0 +1,229 @@
+"""
+In-process performance metrics with Prometheus text exposition.
+
+A small dependency-free registry of counters and histograms, plus callbacks
+for values that already live elsewhere (lru_cache statistics, cache sizes).
+The webapp serves render() at /metrics; the collector records per-printer
+phase timings into the same registry. Scheduled collection runs in its own
+process (the download CronJob), so each run also stores its timings with its
+update_logs entry and the webapp exports the latest run from there.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+# Callback sample: (metric name, type, help, [(labels dict, value), ...])
+CallbackFamily = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: Iterable[Tuple[str, str]]) -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in key]
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[LabelKey, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def totals(self) -> Dict[LabelKey, Tuple[float, float]]:
+        """(sum, count) per label set, e.g. to diff around one collector run."""
+        with self._lock:
+            return {key: (data[-2], data[-1]) for key, data in self._values.items()}
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(data)) for key, data in self._values.items()]
+        lines = []
+        for key, data in items:
+            for i, bound in enumerate(self.buckets):
+                bucket_key = key + (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_key)} {_format_value(data[i])}")
+            inf_key = key + (("le", "+Inf"),)
+            lines.append(f"{self.name}_bucket{_format_labels(inf_key)} {_format_value(data[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(data[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {_format_value(data[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._callbacks: List[Callable[[], List[CallbackFamily]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Counter(name, help_text)
+            return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Histogram(name, help_text, buckets)
+            return metric
+
+    def register_callback(self, fn: Callable[[], List[CallbackFamily]]) -> None:
+        """fn is called at scrape time and returns metric families to expose."""
+        with self._lock:
+            self._callbacks.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            callbacks = list(self._callbacks)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for fn in callbacks:
+            try:
+                families = fn()
+            except Exception:
+                # A broken callback must not take the whole scrape down
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ---------- Metric families used across the app ----------
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "Flask request latency by endpoint, method and status"
+)
+VIEW_CACHE_REQUESTS = REGISTRY.counter(
+    "view_cache_requests_total", "Flask-Caching lookups on cached views by result (hit/miss)"
+)
+DB_QUERIES = REGISTRY.counter("db_queries_total", "SQL statements executed, by helper")
+DB_QUERY_DURATION = REGISTRY.histogram("db_query_duration_seconds", "SQL statement duration, by helper")
+DB_HELPER_DURATION = REGISTRY.histogram(
+    "db_helper_duration_seconds", "Wall time of DB helper functions (fetch_*, sync_*)"
+)
+LDAP_LOOKUP_DURATION = REGISTRY.histogram(
+    "ldap_lookup_duration_seconds", "LDAP round trip duration on cache misses, by operation"
+)
+FILE_CACHE_REQUESTS = REGISTRY.counter("file_cache_requests_total", "_FILE_CACHE lookups by result (hit/miss)")
+COLLECTOR_PHASE_DURATION = REGISTRY.histogram(
+    "collector_phase_duration_seconds", "Collector per-printer phase duration (download/parse/ingest)"
+)
+COLLECTOR_FAILURES = REGISTRY.counter("collector_failures_total", "Collector per-printer failures")
+PAGINATION_COUNTS = REGISTRY.counter(
+    "pagination_count_lookups_total", "Pagination totals by kind and source (hit/exact/approx)"
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - t0, **labels)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def register_callback(fn: Callable[[], List[CallbackFamily]]) -> None:
+    REGISTRY.register_callback(fn)
+
+
+def histogram_delta(
+    before: Dict[LabelKey, Tuple[float, float]], after: Dict[LabelKey, Tuple[float, float]]
+) -> Dict[LabelKey, Tuple[float, float]]:
+    """(sum, count) observed per label set between two Histogram.totals() snapshots."""
+    delta: Dict[LabelKey, Tuple[float, float]] = {}
+    for key, (total, count) in after.items():
+        prev_total, prev_count = before.get(key, (0.0, 0.0))
+        if count > prev_count:
+            delta[key] = (total - prev_total, count - prev_count)
+    return delta
+
+
+def lru_cache_families(prefix: str, caches: Dict[str, Optional[Callable]]) -> List[CallbackFamily]:
+    """Expose functools.lru_cache statistics: {label: cached_function}."""
+    hits: List[Tuple[Dict[str, str], float]] = []
+    misses: List[Tuple[Dict[str, str], float]] = []
+    size: List[Tuple[Dict[str, str], float]] = []
+    for label, fn in caches.items():
+        info = fn.cache_info()
+        hits.append(({"cache": label}, info.hits))
+        misses.append(({"cache": label}, info.misses))
+        size.append(({"cache": label}, info.currsize))
+    return [
+        (f"{prefix}_cache_hits_total", "counter", "lru_cache hits", hits),
+        (f"{prefix}_cache_misses_total", "counter", "lru_cache misses", misses),
+        (f"{prefix}_cache_size", "gauge", "lru_cache current entries", size),
+    ]
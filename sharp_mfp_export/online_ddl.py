@@ -0,0 +1,253 @@
+"""
+Online DDL for schema migrations on large tables.
+
+A plain ALTER TABLE / CREATE INDEX on a multi-million-row job_logs can block
+writers (and on some servers readers) for minutes. apply() runs each
+migration statement as cheaply as the server allows:
+
+1. Statements that are already satisfied (ADD COLUMN / ADD INDEX ... IF NOT
+   EXISTS on a column or index that exists) are skipped without DDL.
+2. ALTER TABLE and CREATE INDEX are rewritten as one ALTER TABLE with
+   ALGORITHM=INPLACE, LOCK=NONE, so the server either changes the table
+   without blocking reads and writes or refuses up front.
+3. If the server refuses (ER_ALTER_OPERATION_NOT_SUPPORTED*) and the table
+   has at least SHADOW_MIN_ROWS rows, the change is applied to an empty
+   shadow copy (_<table>_new), rows are copied over in primary-key chunks
+   while triggers mirror concurrent inserts / updates / deletes, and the two
+   tables are swapped with one atomic RENAME TABLE. Smaller tables just get
+   the plain statement.
+
+Every other statement (CREATE TABLE IF NOT EXISTS ...) runs unchanged.
+Progress lines, including rows copied and an ETA for shadow copies, go to
+the progress callback.
+
+The shadow copy needs a single-column integer primary key named id and the
+TRIGGER privilege. A copy that fails is cleaned up (triggers and shadow
+table dropped) and the original table is left untouched.
+"""
+
+import os
+import re
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+CHUNK_ROWS = int(os.getenv("ONLINE_DDL_CHUNK_ROWS", "10000"))
+# Pause between chunks so the copy leaves room for the collector and reports
+CHUNK_SLEEP = float(os.getenv("ONLINE_DDL_CHUNK_SLEEP", "0.05"))
+SHADOW_MIN_ROWS = int(os.getenv("ONLINE_DDL_SHADOW_MIN_ROWS", "100000"))
+# Keep _<table>_old after the swap instead of dropping it
+KEEP_OLD = os.getenv("ONLINE_DDL_KEEP_OLD", "0").lower() in ("1", "true", "yes")
+PROGRESS_INTERVAL = 5.0
+
+# ER_ALTER_OPERATION_NOT_SUPPORTED, ER_ALTER_OPERATION_NOT_SUPPORTED_REASON
+NOT_SUPPORTED_ERRORS = {1845, 1846}
+
+Progress = Callable[[str], None]
+
+_ALTER_RE = re.compile(r"^\s*ALTER\s+TABLE\s+`?(\w+)`?\s+(.*?)\s*;?\s*$", re.I | re.S)
+_CREATE_INDEX_RE = re.compile(
+    r"^\s*CREATE\s+(UNIQUE\s+|FULLTEXT\s+)?INDEX\s+(IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?\s+ON\s+`?(\w+)`?\s*(\(.*?\))\s*;?\s*$",
+    re.I | re.S,
+)
+_ADD_COLUMN_RE = re.compile(r"^ADD\s+COLUMN\s+IF\s+NOT\s+EXISTS\s+`?(\w+)`?", re.I)
+_ADD_INDEX_RE = re.compile(r"^ADD\s+(?:UNIQUE\s+|FULLTEXT\s+)?(?:INDEX|KEY)\s+IF\s+NOT\s+EXISTS\s+`?(\w+)`?", re.I)
+
+
+class Alter(NamedTuple):
+    table: str
+    clauses: str  # everything after ALTER TABLE <table>
+
+
+def parse_alter(sql: str) -> Optional[Alter]:
+    """ALTER TABLE / CREATE INDEX as (table, alter clauses); None for other statements."""
+    m = _CREATE_INDEX_RE.match(sql)
+    if m:
+        kind, if_not_exists, name, table, columns = m.groups()
+        kind = (kind or "").upper().strip()
+        prefix = f"{kind} " if kind else ""
+        return Alter(table, f"ADD {prefix}INDEX {'IF NOT EXISTS ' if if_not_exists else ''}{name} {columns}")
+    m = _ALTER_RE.match(sql)
+    if m:
+        return Alter(m.group(1), m.group(2))
+    return None
+
+
+def _notify(progress: Optional[Progress], message: str) -> None:
+    if progress:
+        progress(message)
+
+
+def _error_code(e: Exception) -> Optional[int]:
+    args = getattr(e, "args", ())
+    return args[0] if args and isinstance(args[0], int) else None
+
+
+def already_applied(cursor, alter: Alter) -> bool:
+    """True when an IF NOT EXISTS column / index is already there."""
+    m = _ADD_COLUMN_RE.match(alter.clauses)
+    if m:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
+            (alter.table, m.group(1)),
+        )
+        return cursor.fetchone() is not None
+    m = _ADD_INDEX_RE.match(alter.clauses)
+    if m:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s LIMIT 1",
+            (alter.table, m.group(1)),
+        )
+        return cursor.fetchone() is not None
+    return False
+
+
+def estimated_rows(cursor, table: str) -> int:
+    cursor.execute(
+        "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,),
+    )
+    row = cursor.fetchone()
+    return int(row["TABLE_ROWS"] or 0) if row else 0
+
+
+def apply(cursor, sql: str, progress: Optional[Progress] = None) -> str:
+    """Run one migration statement; returns how: skipped | plain | inplace | copy."""
+    alter = parse_alter(sql)
+    if alter is None:
+        cursor.execute(sql)
+        return "plain"
+    if already_applied(cursor, alter):
+        _notify(progress, f"  {alter.table}: already applied, skipped: {alter.clauses}")
+        return "skipped"
+
+    started = time.perf_counter()
+    try:
+        cursor.execute(f"ALTER TABLE {alter.table} {alter.clauses}, ALGORITHM=INPLACE, LOCK=NONE")
+        _notify(progress, f"  {alter.table}: online ({time.perf_counter() - started:.1f}s): {alter.clauses}")
+        return "inplace"
+    except Exception as e:
+        if _error_code(e) not in NOT_SUPPORTED_ERRORS:
+            raise
+        reason = e
+
+    rows = estimated_rows(cursor, alter.table)
+    if rows < SHADOW_MIN_ROWS:
+        _notify(progress, f"  {alter.table}: not online ({reason}); ~{rows} rows, plain ALTER")
+        cursor.execute(f"ALTER TABLE {alter.table} {alter.clauses}")
+        return "plain"
+    _notify(progress, f"  {alter.table}: not online ({reason}); shadow copy of ~{rows} rows")
+    ShadowCopy(cursor, alter, progress).run(rows)
+    return "copy"
+
+
+class ShadowCopy:
+    """Chunked copy into an altered shadow table with trigger catch-up and an atomic swap."""
+
+    def __init__(self, cursor, alter: Alter, progress: Optional[Progress] = None,
+                 chunk_rows: int = CHUNK_ROWS, chunk_sleep: float = CHUNK_SLEEP):
+        self.cursor = cursor
+        self.table = alter.table
+        self.clauses = alter.clauses
+        self.new = f"_{alter.table}_new"
+        self.old = f"_{alter.table}_old"
+        self.triggers = {event: f"_{alter.table}_osc_{event.lower()}" for event in ("INSERT", "UPDATE", "DELETE")}
+        self.progress = progress
+        self.chunk_rows = chunk_rows
+        self.chunk_sleep = chunk_sleep
+
+    def run(self, estimated: int = 0) -> int:
+        self._check_primary_key()
+        self._cleanup()  # leftovers of an interrupted run
+        try:
+            self.cursor.execute(f"CREATE TABLE {self.new} LIKE {self.table}")
+            self.cursor.execute(f"ALTER TABLE {self.new} {self.clauses}")
+            columns = self._common_columns()
+            self._create_triggers(columns)
+            copied = self._copy(columns, estimated)
+            self.cursor.execute(f"RENAME TABLE {self.table} TO {self.old}, {self.new} TO {self.table}")
+        except Exception:
+            self._cleanup()
+            raise
+        self._drop_triggers()
+        if not KEEP_OLD:
+            self.cursor.execute(f"DROP TABLE IF EXISTS {self.old}")
+        return copied
+
+    def _check_primary_key(self) -> None:
+        self.cursor.execute(f"SHOW KEYS FROM {self.table} WHERE Key_name = 'PRIMARY'")
+        keys = [row["Column_name"] for row in self.cursor.fetchall()]
+        if keys != ["id"]:
+            raise RuntimeError(f"Shadow copy of {self.table} needs a primary key on id (found {keys})")
+
+    def _columns(self, table: str) -> List[str]:
+        self.cursor.execute(f"SHOW COLUMNS FROM {table}")
+        return [row["Field"] for row in self.cursor.fetchall()]
+
+    def _common_columns(self) -> List[str]:
+        # Columns dropped by the change are not copied; added ones take their default
+        new_columns = set(self._columns(self.new))
+        return [c for c in self._columns(self.table) if c in new_columns]
+
+    def _create_triggers(self, columns: List[str]) -> None:
+        cols = ", ".join(f"`{c}`" for c in columns)
+        new_values = ", ".join(f"NEW.`{c}`" for c in columns)
+        upsert = f"REPLACE INTO {self.new} ({cols}) VALUES ({new_values})"
+        self.cursor.execute(
+            f"CREATE TRIGGER {self.triggers['INSERT']} AFTER INSERT ON {self.table} FOR EACH ROW {upsert}"
+        )
+        self.cursor.execute(
+            f"CREATE TRIGGER {self.triggers['UPDATE']} AFTER UPDATE ON {self.table} FOR EACH ROW {upsert}"
+        )
+        self.cursor.execute(
+            f"CREATE TRIGGER {self.triggers['DELETE']} AFTER DELETE ON {self.table} FOR EACH ROW "
+            f"DELETE IGNORE FROM {self.new} WHERE id = OLD.id"
+        )
+
+    def _copy(self, columns: List[str], estimated: int) -> int:
+        self.cursor.execute(f"SELECT MIN(id) AS lo, MAX(id) AS hi FROM {self.table}")
+        bounds = self.cursor.fetchone()
+        if not bounds or bounds["lo"] is None:
+            return 0
+        lo, hi = bounds["lo"], bounds["hi"]
+        span = hi - lo + 1
+        cols = ", ".join(f"`{c}`" for c in columns)
+        copied = 0
+        started = last_report = time.perf_counter()
+        # Rows inserted after MAX(id) was read reach the shadow through the
+        # triggers; INSERT IGNORE never overwrites a row a trigger already wrote
+        while lo <= hi:
+            copied += self.cursor.execute(
+                f"INSERT IGNORE INTO {self.new} ({cols}) SELECT {cols} FROM {self.table} "
+                f"WHERE id >= %s AND id < %s LOCK IN SHARE MODE",
+                (lo, lo + self.chunk_rows),
+            )
+            lo += self.chunk_rows
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL or lo > hi:
+                last_report = now
+                done = min(1.0, (span - max(hi - lo + 1, 0)) / span)
+                eta = (now - started) * (1 - done) / done if done else 0.0
+                total = f"/~{estimated}" if estimated else ""
+                _notify(self.progress, f"  {self.table}: copied {copied}{total} rows ({done:.0%}), ETA {eta:.0f}s")
+            if self.chunk_sleep:
+                time.sleep(self.chunk_sleep)
+        return copied
+
+    def _drop_triggers(self) -> None:
+        for name in self.triggers.values():
+            self.cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    def _cleanup(self) -> None:
+        self._drop_triggers()
+        self.cursor.execute(f"DROP TABLE IF EXISTS {self.new}")
+
+
+def describe(sql: str) -> str:
+    """Short label of a statement for migration listings."""
+    alter = parse_alter(sql)
+    if alter:
+        return f"ALTER {alter.table}: {alter.clauses}"
+    return " ".join(sql.split())[:100]
+
@@ -0,0 +1,361 @@
+"""
+Opt-in SQL query profiler.
+
+Enabled with QUERY_PROFILE=1. Every statement that goes through
+InstrumentedDictCursor is recorded by its normalised shape (literals and
+placeholders replaced by ?, IN lists collapsed) with parameters, duration
+and rows returned. Statements slower than QUERY_PROFILE_SLOW_MS get an
+EXPLAIN FORMAT=JSON captured on the same connection. SlowQueryWriter queues
+them and writes them to the slow_queries table in batches from a background
+thread, so the slow request does not also pay for a connection and an
+INSERT. `sharp_mfp_export.py profile-queries` and the /admin/queries page
+report on that table.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pymysql
+
+PROFILE_ENABLED = os.getenv("QUERY_PROFILE", "0").lower() in ("1", "true", "yes", "on")
+SLOW_QUERY_MS = float(os.getenv("QUERY_PROFILE_SLOW_MS", "200"))
+# Re-EXPLAIN a shape at most this often; plans rarely change between requests
+EXPLAIN_INTERVAL = float(os.getenv("QUERY_PROFILE_EXPLAIN_INTERVAL", "600"))
+MAX_SHAPES = 500
+MAX_PARAM_CHARS = 500
+MAX_SAMPLE_CHARS = 20000
+PERSIST_INTERVAL = float(os.getenv("QUERY_PROFILE_FLUSH_INTERVAL", "5"))
+MAX_PENDING = 1000
+
+SLOW_QUERIES_DDL = """
+CREATE TABLE IF NOT EXISTS slow_queries (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    shape_hash CHAR(32) NOT NULL,
+    shape TEXT NOT NULL,
+    sample_sql MEDIUMTEXT,
+    params TEXT,
+    helper VARCHAR(64),
+    duration_ms DOUBLE NOT NULL,
+    rows_returned INT,
+    explain_json MEDIUMTEXT,
+    captured_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_shape_hash (shape_hash),
+    INDEX idx_captured_at (captured_at)
+);
+"""
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%s|%\([^)]+\)s")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_RE = re.compile(r"\bVALUES\s*\(.*", re.IGNORECASE | re.DOTALL)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalise_sql(sql: str) -> str:
+    """Shape of a statement: literals and placeholders -> ?, IN (...) collapsed."""
+    if sql.lstrip()[:6].upper() in ("INSERT", "REPLAC"):
+        # executemany batches differ only in the number of VALUES tuples; cut
+        # before the literal-heavy tail so multi-MB batches stay cheap to shape
+        sql = _VALUES_RE.sub("VALUES (...)", sql, count=1)
+    shape = _STRING_RE.sub("?", sql)
+    shape = _PLACEHOLDER_RE.sub("?", shape)
+    shape = _NUMBER_RE.sub("?", shape)
+    shape = _IN_LIST_RE.sub("IN (...)", shape)
+    return _SPACE_RE.sub(" ", shape).strip()
+
+
+def shape_hash(shape: str) -> str:
+    return hashlib.md5(shape.encode("utf-8")).hexdigest()
+
+
+def _format_params(args: Any) -> str:
+    if args is None:
+        return ""
+    text = json.dumps(args, ensure_ascii=False, default=str)
+    return text if len(text) <= MAX_PARAM_CHARS else text[:MAX_PARAM_CHARS] + "..."
+
+
+def explain_summary(explain_json: Optional[str]) -> str:
+    """One-line digest of an EXPLAIN FORMAT=JSON plan: table/access/key/rows per table."""
+    if not explain_json:
+        return ""
+    try:
+        plan = json.loads(explain_json)
+    except ValueError:
+        return ""
+    parts: List[str] = []
+
+    def walk(node: Any) -> None:
+        if isinstance(node, dict):
+            if "table_name" in node and "access_type" in node:
+                key = node.get("key") or "-"
+                rows = node.get("rows", node.get("rows_examined_per_scan", "?"))
+                parts.append(f"{node['table_name']}:{node['access_type']}/{key}/{rows}")
+            if node.get("filesort") or node.get("using_filesort"):
+                parts.append("filesort")
+            if node.get("temporary_table") or node.get("using_temporary_table"):
+                parts.append("temporary")
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(plan)
+    return " ".join(dict.fromkeys(parts))
+
+
+class QueryProfiler:
+    """In-process aggregate per statement shape plus slow-query capture."""
+
+    def __init__(self, slow_ms: float = SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._shapes: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._persist: Optional[Callable[[Dict[str, Any]], None]] = None
+
+    def set_persist(self, fn: Optional[Callable[[Dict[str, Any]], None]]) -> None:
+        """fn(entry) stores a slow query; called on the request thread, so it must not block."""
+        self._persist = fn
+
+    def record(self, cursor, query: str, args: Any, duration: float, helper: str) -> None:
+        if getattr(self._local, "busy", False):
+            # Statements issued by the profiler itself (EXPLAIN, persistence)
+            return
+        self._local.busy = True
+        try:
+            self._record(cursor, query, args, duration, helper)
+        except Exception as e:
+            print(f"Query profiler error: {e}")
+        finally:
+            self._local.busy = False
+
+    def _record(self, cursor, query: str, args: Any, duration: float, helper: str) -> None:
+        shape = normalise_sql(query)
+        digest = shape_hash(shape)
+        duration_ms = duration * 1000
+        rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else 0
+        if isinstance(cursor, pymysql.cursors.SSCursor):
+            # Unbuffered: the row count is unknown until the result is read
+            rows = 0
+        params = _format_params(args)
+        now = time.time()
+
+        with self._lock:
+            stats = self._shapes.get(digest)
+            if stats is None:
+                if len(self._shapes) >= MAX_SHAPES:
+                    # Drop the cheapest shape to stay bounded
+                    cheapest = min(self._shapes, key=lambda k: self._shapes[k]["total_ms"])
+                    del self._shapes[cheapest]
+                stats = self._shapes[digest] = {
+                    "shape_hash": digest, "shape": shape, "helper": helper, "count": 0,
+                    "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "slow": 0,
+                    "last_params": "", "explain_json": None, "explained_at": 0.0,
+                }
+            stats["count"] += 1
+            stats["total_ms"] += duration_ms
+            stats["rows"] += rows
+            stats["last_params"] = params
+            if duration_ms > stats["max_ms"]:
+                stats["max_ms"] = duration_ms
+            is_slow = duration_ms >= self.slow_ms
+            need_explain = is_slow and now - stats["explained_at"] >= EXPLAIN_INTERVAL
+            if is_slow:
+                stats["slow"] += 1
+            if need_explain:
+                stats["explained_at"] = now
+
+        if not is_slow:
+            return
+
+        full_sql = self._mogrify(cursor, query, args)
+        explain_json = self._explain(cursor, full_sql) if need_explain else None
+        sample_sql = full_sql if len(full_sql) <= MAX_SAMPLE_CHARS else full_sql[:MAX_SAMPLE_CHARS] + " ..."
+        if explain_json:
+            with self._lock:
+                stats["explain_json"] = explain_json
+
+        if self._persist:
+            self._persist({
+                "shape_hash": digest, "shape": shape, "sample_sql": sample_sql,
+                "params": params, "helper": helper, "duration_ms": duration_ms,
+                "rows_returned": rows, "explain_json": explain_json,
+            })
+
+    @staticmethod
+    def _mogrify(cursor, query: str, args: Any) -> str:
+        try:
+            return cursor.mogrify(query, args)
+        except Exception:
+            return query
+
+    @staticmethod
+    def _explain(cursor, sql: str) -> Optional[str]:
+        if not sql.lstrip().upper().startswith(("SELECT", "(SELECT", "WITH")):
+            return None
+        if isinstance(cursor, pymysql.cursors.SSCursor):
+            # An unbuffered result is still pending on this connection
+            return None
+        try:
+            with cursor.connection.cursor(pymysql.cursors.Cursor) as plain:
+                plain.execute("EXPLAIN FORMAT=JSON " + sql)
+                row = plain.fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            return json.dumps({"error": str(e)})
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = [dict(s) for s in self._shapes.values()]
+        for entry in entries:
+            entry["avg_ms"] = entry["total_ms"] / entry["count"] if entry["count"] else 0.0
+            entry["explain_summary"] = explain_summary(entry["explain_json"])
+        entries.sort(key=lambda e: e.get(order_by, 0), reverse=True)
+        return entries[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._shapes.clear()
+
+
+PROFILER = QueryProfiler()
+
+
+def enabled() -> bool:
+    return PROFILE_ENABLED
+
+
+def enable(slow_ms: Optional[float] = None) -> None:
+    global PROFILE_ENABLED
+    PROFILE_ENABLED = True
+    if slow_ms is not None:
+        PROFILER.slow_ms = slow_ms
+
+
+def record(cursor, query: str, args: Any, duration: float, helper: str) -> None:
+    PROFILER.record(cursor, query, args, duration, helper)
+
+
+class SlowQueryWriter:
+    """Queues slow-query entries and writes them to slow_queries in batches, off the request thread."""
+
+    def __init__(
+        self, connect: Callable[[], Any], flush_interval: float = PERSIST_INTERVAL, max_pending: int = MAX_PENDING
+    ):
+        self._connect = connect
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flushing = False
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                # The writes are falling behind; drop rather than grow without bound
+                self.dropped += 1
+                return
+            self._pending.append(entry)
+            due = not self._flushing and time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self._flushing = True
+        if due:
+            # Off the request thread; one flush at a time
+            threading.Thread(target=self.flush, name="slow-query-flush", daemon=True).start()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        try:
+            if not pending:
+                return 0
+            rows = [
+                (
+                    entry["shape_hash"], entry["shape"], entry["sample_sql"], entry["params"],
+                    entry["helper"], entry["duration_ms"], entry["rows_returned"], entry["explain_json"],
+                )
+                for entry in pending
+            ]
+            conn = self._connect()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.executemany(
+                        """
+                        INSERT INTO slow_queries
+                            (shape_hash, shape, sample_sql, params, helper, duration_ms, rows_returned, explain_json)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        """,
+                        rows,
+                    )
+            finally:
+                conn.close()
+            return len(rows)
+        except Exception as e:
+            print(f"Failed to persist slow queries: {e}")
+            # Keep them for the next attempt, within the bound
+            with self._lock:
+                self._pending = (pending + self._pending)[:self.max_pending]
+            return 0
+        finally:
+            with self._lock:
+                self._flushing = False
+
+
+def fetch_slow_query_report(connect: Callable[[], Any], days: int = 7, limit: int = 20) -> List[Dict[str, Any]]:
+    """Top persisted slow shapes over the last `days`, by total time."""
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT shape_hash, MAX(shape) AS shape, MAX(helper) AS helper,
+                       COUNT(*) AS count, SUM(duration_ms) AS total_ms, AVG(duration_ms) AS avg_ms,
+                       MAX(duration_ms) AS max_ms, MAX(rows_returned) AS max_rows,
+                       MAX(captured_at) AS last_seen, MAX(id) AS last_id
+                FROM slow_queries
+                WHERE captured_at >= NOW() - INTERVAL %s DAY
+                GROUP BY shape_hash
+                ORDER BY total_ms DESC
+                LIMIT %s
+                """,
+                (days, limit),
+            )
+            report = list(cursor.fetchall())
+            for entry in report:
+                # Latest captured plan and sample for the shape
+                cursor.execute(
+                    """
+                    SELECT sample_sql, params, explain_json FROM slow_queries
+                    WHERE shape_hash = %s AND explain_json IS NOT NULL
+                    ORDER BY id DESC LIMIT 1
+                    """,
+                    (entry["shape_hash"],),
+                )
+                latest = cursor.fetchone() or {}
+                entry["sample_sql"] = latest.get("sample_sql", "")
+                entry["params"] = latest.get("params", "")
+                entry["explain_json"] = latest.get("explain_json")
+                entry["explain_summary"] = explain_summary(entry["explain_json"])
+            return report
+    finally:
+        conn.close()
+
+
+def clear_slow_queries(connect: Callable[[], Any]) -> None:
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("TRUNCATE TABLE slow_queries")
+    finally:
+        conn.close()
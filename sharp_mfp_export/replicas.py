@@ -0,0 +1,215 @@
+"""
+Read-replica routing for reporting queries.
+
+Configured with DB_REPLICA_HOSTS ("host[:port],host[:port]"); empty means
+every connection goes to the primary in DB_CONFIG as before. Helpers that
+only read ask get_db_connection(read_only=True) and are routed here; writers
+(ingestion, update_logs, schema) always use the primary.
+
+Each process sticks to one replica (picked at random on start, so workers
+spread out) and only moves to another when it fails or falls behind. Sticking
+matters because the view cache is keyed on the ingestion generation, which
+is read through the same route: a request never sees a generation from one
+replica and data from another.
+
+Lag is Seconds_Behind_Master from SHOW SLAVE STATUS (Seconds_Behind_Source
+from SHOW REPLICA STATUS on servers that dropped the old statement), checked
+at most every DB_REPLICA_CHECK_INTERVAL seconds per replica. Above
+DB_REPLICA_MAX_LAG the policy decides: "primary" (default) sends reads to
+the primary, "notice" keeps using the least-lagged replica and pages show a
+"data as of" notice. A replica whose replication is stopped (lag NULL) is
+never used.
+"""
+
+import contextvars
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+
+class Replica(NamedTuple):
+    host: str
+    port: int
+
+
+def parse_hosts(value: str, default_port: int = 3306) -> List[Replica]:
+    replicas = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        host, _, port = part.partition(":")
+        replicas.append(Replica(host, int(port) if port else default_port))
+    return replicas
+
+
+REPLICA_HOSTS = parse_hosts(os.getenv("DB_REPLICA_HOSTS", ""), int(os.getenv("DB_PORT", "3306")))
+REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "30"))
+REPLICA_LAG_POLICY = os.getenv("DB_REPLICA_LAG_POLICY", "primary")  # primary | notice
+CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "10"))
+# A replica that refused a connection is skipped this long
+FAILURE_BACKOFF = 30.0
+
+# Tried in order; MySQL 8.4 removed the first, MariaDB < 10.5 lacks the second
+STATUS_STATEMENTS = ("SHOW SLAVE STATUS", "SHOW REPLICA STATUS")
+
+# Largest lag (seconds) of the replicas that served the current request while
+# over REPLICA_MAX_LAG; None when everything read was fresh
+_SERVED_LAG: contextvars.ContextVar = contextvars.ContextVar("replica_served_lag", default=None)
+
+
+def read_lag(cursor) -> Optional[float]:
+    """
+    Seconds behind the primary from the replication status of the server the
+    cursor is connected to; None when replication is not running. Raises if
+    neither status statement works.
+    """
+    error: Optional[Exception] = None
+    answered = False
+    for statement in STATUS_STATEMENTS:
+        try:
+            cursor.execute(statement)
+            row = cursor.fetchone()
+        except Exception as e:
+            error = e
+            continue
+        answered = True
+        if row:
+            lag = row.get("Seconds_Behind_Master", row.get("Seconds_Behind_Source"))
+            return None if lag is None else float(lag)
+    if not answered and error is not None:
+        raise error
+    return None
+
+
+class ReplicaRouter:
+    """Picks the replica for read-only connections (thread-safe)."""
+
+    def __init__(
+        self,
+        replicas: List[Replica],
+        check_lag: Callable[[Replica], Optional[float]],
+        max_lag: float = REPLICA_MAX_LAG,
+        policy: str = REPLICA_LAG_POLICY,
+        check_interval: float = CHECK_INTERVAL,
+    ):
+        # check_lag(replica) returns seconds behind the primary, None if
+        # replication is not running; it may raise if the replica is down
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        self.policy = policy
+        self.check_interval = check_interval
+        self._check_lag = check_lag
+        self._preferred = random.randrange(len(self.replicas)) if self.replicas else 0
+        self._state: Dict[Replica, Dict[str, Any]] = {
+            r: {"lag": None, "checked_at": None, "failed_at": None, "error": ""} for r in self.replicas
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def route(self) -> Optional[Replica]:
+        """Replica to read from, or None for the primary."""
+        if not self.replicas:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            preferred = self._preferred
+        lagging: Optional[Replica] = None
+        for i in range(len(self.replicas)):
+            index = (preferred + i) % len(self.replicas)
+            replica = self.replicas[index]
+            lag = self._lag(replica, now)
+            if lag is None:
+                continue
+            if lag <= self.max_lag:
+                with self._lock:
+                    self._preferred = index
+                return replica
+            if lagging is None or lag < self._state[lagging]["lag"]:
+                lagging = replica
+        if lagging is not None and self.policy == "notice":
+            return lagging
+        return None
+
+    def lag(self, replica: Replica) -> Optional[float]:
+        return self._state[replica]["lag"]
+
+    def as_of_key(self) -> str:
+        """
+        Cache-key part for views rendered while reads go to a lagging replica:
+        its "data as of" time in CHECK_INTERVAL steps, so a cached page and its
+        notice follow the replica as it catches up. Empty when reads are fresh.
+        """
+        replica = self.route()
+        lag = self.lag(replica) if replica is not None else None
+        if lag is None or lag <= self.max_lag:
+            return ""
+        return f"asof-{int((time.time() - lag) // max(self.check_interval, 1.0))}"
+
+    def mark_failed(self, replica: Replica, error: Exception) -> None:
+        with self._lock:
+            state = self._state[replica]
+            state.update(failed_at=time.monotonic(), lag=None, error=str(error))
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {"host": r.host, "port": r.port, "lag": s["lag"], "healthy": s["failed_at"] is None and s["lag"] is not None,
+                 "error": s["error"]}
+                for r, s in self._state.items()
+            ]
+
+    def _lag(self, replica: Replica, now: float) -> Optional[float]:
+        with self._lock:
+            state = self._state[replica]
+            if state["failed_at"] is not None and now - state["failed_at"] < FAILURE_BACKOFF:
+                return None
+            if state["checked_at"] is not None and now - state["checked_at"] < self.check_interval:
+                return state["lag"]
+            # Claim the check so concurrent requests use the previous value meanwhile
+            state["checked_at"] = now
+        try:
+            lag = self._check_lag(replica)
+            error = "" if lag is not None else "replication not running"
+            failed_at = None
+        except Exception as e:
+            lag, error, failed_at = None, str(e), now
+        with self._lock:
+            state.update(lag=lag, error=error, failed_at=failed_at)
+        return lag
+
+
+def note_served(lag: Optional[float]) -> None:
+    """Remember that the current request read from a replica this far behind."""
+    if lag is None or lag <= REPLICA_MAX_LAG:
+        return
+    current = _SERVED_LAG.get()
+    if current is None or lag > current:
+        _SERVED_LAG.set(lag)
+
+
+def reset_served() -> None:
+    _SERVED_LAG.set(None)
+
+
+def data_as_of() -> Optional[datetime]:
+    """Point in time the current request's data reflects, when it came from a lagging replica."""
+    lag = _SERVED_LAG.get()
+    if lag is None:
+        return None
+    return datetime.now() - timedelta(seconds=lag)
+
+
+def replica_families(router: ReplicaRouter) -> List[Any]:
+    """metrics.register_callback families for the replica lag."""
+    samples = [
+        ({"replica": f"{s['host']}:{s['port']}"}, s["lag"] if s["lag"] is not None else -1)
+        for s in router.status()
+    ]
+    return [("db_replica_lag_seconds", "gauge", "Replica lag behind the primary (-1: unavailable)", samples)]
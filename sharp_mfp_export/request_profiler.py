@@ -0,0 +1,166 @@
+"""
+Per-request sampling profiler.
+
+A background thread samples the request thread's stack every
+PROFILE_INTERVAL_MS and folds the samples into collapsed stacks
+("frame;frame;frame count"), the format flamegraph.pl and speedscope
+import directly. Each sample is also attributed to a category by the
+innermost recognised frame: SQL (pymysql), LDAP (ldap3 / ldap_service),
+template rendering (jinja2), Excel export (openpyxl), or plain Python
+(aggregation and everything else).
+
+webapp.py turns it on for ?__profile=1 (admin token required) and for a
+PROFILE_SAMPLE_RATE fraction of live traffic; profiles land in PROFILE_DIR.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(Path(__file__).resolve().parent / "profiles")))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+# (category, module name prefixes); first match from the innermost frame wins
+CATEGORY_RULES = (
+    ("sql", ("pymysql",)),
+    ("ldap", ("ldap3", "ldap_service")),
+    ("template", ("jinja2",)),
+    ("openpyxl", ("openpyxl",)),
+)
+CATEGORIES = tuple(name for name, _ in CATEGORY_RULES) + ("python",)
+
+_UNSAFE_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def _frame_label(frame) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def _frame_category(frame) -> Optional[str]:
+    module = frame.f_globals.get("__name__", "")
+    for category, prefixes in CATEGORY_RULES:
+        if module.startswith(prefixes):
+            return category
+    return None
+
+
+class StackSampler:
+    """Samples one thread's stack from a daemon thread until stop()."""
+
+    def __init__(self, thread_id: Optional[int] = None, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval_ms / 1000.0
+        self.stacks: Counter = Counter()
+        self.categories: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "StackSampler":
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.elapsed = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self._sample(frame)
+
+    def _sample(self, frame) -> None:
+        labels: List[str] = []
+        category = None
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            if category is None:
+                category = _frame_category(frame)
+            frame = frame.f_back
+        labels.reverse()
+        self.stacks[";".join(labels)] += 1
+        self.categories[category or "python"] += 1
+        self.samples += 1
+
+    def category_ms(self) -> Dict[str, float]:
+        """Wall time per category, apportioned by sample share."""
+        total = self.samples or 1
+        wall_ms = self.elapsed * 1000
+        return {name: wall_ms * self.categories.get(name, 0) / total for name in CATEGORIES}
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def save_profile(sampler: StackSampler, meta: Dict[str, Any], directory: Path = PROFILE_DIR) -> str:
+    """Write <name>.collapsed and <name>.json; returns the profile name."""
+    directory.mkdir(parents=True, exist_ok=True)
+    endpoint = _UNSAFE_RE.sub("_", str(meta.get("endpoint") or "request"))
+    name = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{endpoint}_{int(sampler.elapsed * 1000)}ms"
+    (directory / f"{name}.collapsed").write_text(sampler.collapsed(), encoding="utf-8")
+    summary = {
+        **meta,
+        "name": name,
+        "duration_ms": sampler.elapsed * 1000,
+        "samples": sampler.samples,
+        "interval_ms": sampler.interval * 1000,
+        "categories_ms": sampler.category_ms(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    (directory / f"{name}.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    _prune(directory)
+    return name
+
+
+def _prune(directory: Path) -> None:
+    summaries = sorted(directory.glob("*.json"))
+    for old in summaries[: max(len(summaries) - PROFILE_MAX_FILES, 0)]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".collapsed").unlink(missing_ok=True)
+
+
+def list_profiles(directory: Path = PROFILE_DIR, limit: int = 100) -> List[Dict[str, Any]]:
+    """Saved profile summaries, newest first."""
+    if not directory.exists():
+        return []
+    profiles = []
+    for path in sorted(directory.glob("*.json"), reverse=True)[:limit]:
+        try:
+            profiles.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(name: str, directory: Path = PROFILE_DIR) -> Optional[Path]:
+    """Path of a saved .collapsed profile, or None for unknown/unsafe names."""
+    if _UNSAFE_RE.search(name):
+        return None
+    path = directory / f"{name}.collapsed"
+    return path if path.exists() else None
+
+
+def server_timing(sampler: StackSampler) -> str:
+    """Server-Timing header value so the split shows up in browser devtools."""
+    parts = [f"{name};dur={ms:.1f}" for name, ms in sampler.category_ms().items() if ms]
+    parts.append(f"total;dur={sampler.elapsed * 1000:.1f}")
+    return ", ".join(parts)
@@ -0,0 +1,352 @@
+"""
+Versioned schema migrations.
+
+init_db() used to issue every CREATE TABLE / ALTER TABLE ... IF NOT EXISTS on
+each CLI start, taking metadata locks on job_logs even when nothing changed.
+The schema is now a numbered list of migrations (MIGRATIONS); the highest
+applied number is kept in the schema_version table. Startup costs one
+version check, and DDL only runs when the database is behind CURRENT_VERSION.
+
+Every statement is idempotent (IF NOT EXISTS) and runs through online_ddl,
+which skips satisfied ones and changes large tables without locking them.
+A database created before schema_version existed therefore just replays all
+migrations once and is recorded as current. Migrations run under a named lock, so two processes starting at the
+same time apply them once. A failing migration stops the run and is retried
+on the next start; the versions before it stay recorded.
+
+To change the schema, append a Migration with the next number. Never edit
+or renumber one that has shipped; statements are therefore written out in
+MIGRATIONS, not borrowed from the modules that own the tables.
+"""
+
+import threading
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence
+
+import online_ddl
+
+SCHEMA_LOCK = "sharp_mfp_schema"
+LOCK_TIMEOUT = 60
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    statements: Sequence[str]
+
+
+# unique key: printer + job_id + start_time
+# job_id may be recycled by the printer, start_time tells the runs apart
+JOB_LOGS_DDL = """
+CREATE TABLE IF NOT EXISTS job_logs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    printer_addr VARCHAR(100) NOT NULL,
+    job_id VARCHAR(50),
+    account_job_id VARCHAR(50),
+    mode VARCHAR(50),
+    user_name VARCHAR(100),
+    login_name VARCHAR(100),
+    computer_name VARCHAR(100),
+    start_time DATETIME,
+    end_time DATETIME,
+    bw_pages INT DEFAULT 0,
+    color_pages INT DEFAULT 0,
+    total_pages INT DEFAULT 0,
+    file_name VARCHAR(255),
+    scan_type VARCHAR(100),
+    destination VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_job (printer_addr, job_id, start_time)
+);
+"""
+
+USER_COUNTS_DDL = """
+CREATE TABLE IF NOT EXISTS user_counts (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    printer_addr VARCHAR(100) NOT NULL,
+    user_name VARCHAR(100),
+    print_bw INT DEFAULT 0,
+    print_color INT DEFAULT 0,
+    copy_bw INT DEFAULT 0,
+    copy_color INT DEFAULT 0,
+    other_usage INT DEFAULT 0,
+    total_pages INT DEFAULT 0,
+    snapshot_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_printer_latest (printer_addr, snapshot_time)
+);
+"""
+
+UPDATE_LOGS_DDL = """
+CREATE TABLE IF NOT EXISTS update_logs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    trigger_source VARCHAR(20) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    start_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    end_time DATETIME,
+    message TEXT,
+    INDEX idx_start_time (start_time)
+);
+"""
+
+# Migrations are frozen: every statement is written out here rather than
+# taken from the module that owns the table, so a later edit to such a
+# constant (query_profiler.SLOW_QUERIES_DDL, search_index.SCHEMA_SQL, ...)
+# can never rewrite a shipped step. Schema changes get a new migration.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "base_tables", [
+        JOB_LOGS_DDL,
+        # Columns added after the first deployments (formerly migrate_db.py)
+        "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS file_name VARCHAR(255)",
+        "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS scan_type VARCHAR(100)",
+        "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS destination VARCHAR(255)",
+        USER_COUNTS_DDL,
+        UPDATE_LOGS_DDL,
+    ]),
+    # Formerly add_indices.py
+    Migration(2, "job_logs_lookup_indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_start_time ON job_logs (start_time)",
+        "CREATE INDEX IF NOT EXISTS idx_user_name ON job_logs (user_name)",
+        "CREATE INDEX IF NOT EXISTS idx_login_name ON job_logs (login_name)",
+    ]),
+    # Slow query capture (query_profiler.py, opt-in via QUERY_PROFILE)
+    Migration(3, "slow_queries", [
+        """
+        CREATE TABLE IF NOT EXISTS slow_queries (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            shape_hash CHAR(32) NOT NULL,
+            shape TEXT NOT NULL,
+            sample_sql MEDIUMTEXT,
+            params TEXT,
+            helper VARCHAR(64),
+            duration_ms DOUBLE NOT NULL,
+            rows_returned INT,
+            explain_json MEDIUMTEXT,
+            captured_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_shape_hash (shape_hash),
+            INDEX idx_captured_at (captured_at)
+        )
+        """,
+    ]),
+    # Keyword search index (search_index.py)
+    Migration(4, "search_index", [
+        """
+        CREATE TABLE IF NOT EXISTS search_values (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            field VARCHAR(16) NOT NULL,
+            value_hash CHAR(32) NOT NULL,
+            value VARCHAR(255) NOT NULL,
+            UNIQUE KEY uniq_field_value (field, value_hash)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS search_postings (
+            field VARCHAR(16) NOT NULL,
+            term VARCHAR(2) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+            value_id INT NOT NULL,
+            PRIMARY KEY (field, term, value_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS search_index_state (
+            name VARCHAR(32) PRIMARY KEY,
+            last_id INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_file_name ON job_logs (file_name(191))",
+        "CREATE INDEX IF NOT EXISTS idx_scan_type ON job_logs (scan_type)",
+        "CREATE INDEX IF NOT EXISTS idx_destination ON job_logs (destination(191))",
+        "CREATE INDEX IF NOT EXISTS idx_user_name ON job_logs (user_name)",
+        "CREATE INDEX IF NOT EXISTS idx_login_name ON job_logs (login_name)",
+    ]),
+    # Dimension tables + job_logs id columns (dimensions.py)
+    Migration(5, "dimensions", [
+        """
+        CREATE TABLE IF NOT EXISTS dim_printer (
+            id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            printer_addr VARCHAR(100) NOT NULL DEFAULT '',
+            printer_addr_null TINYINT(1) NOT NULL DEFAULT 0,
+            UNIQUE KEY uniq_printer (printer_addr, printer_addr_null)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS dim_mode (
+            id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            mode VARCHAR(50) NOT NULL DEFAULT '',
+            mode_null TINYINT(1) NOT NULL DEFAULT 0,
+            UNIQUE KEY uniq_mode (mode, mode_null)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS dim_user (
+            id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            user_name VARCHAR(100) NOT NULL DEFAULT '',
+            user_name_null TINYINT(1) NOT NULL DEFAULT 0,
+            login_name VARCHAR(100) NOT NULL DEFAULT '',
+            login_name_null TINYINT(1) NOT NULL DEFAULT 0,
+            UNIQUE KEY uniq_user (user_name, user_name_null, login_name, login_name_null)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS dim_computer (
+            id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+            computer_name VARCHAR(100) NOT NULL DEFAULT '',
+            computer_name_null TINYINT(1) NOT NULL DEFAULT 0,
+            UNIQUE KEY uniq_computer (computer_name, computer_name_null)
+        )
+        """,
+        "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS printer_id SMALLINT UNSIGNED NULL",
+        "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS mode_id SMALLINT UNSIGNED NULL",
+        "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS user_id INT UNSIGNED NULL",
+        "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS computer_id INT UNSIGNED NULL",
+        "CREATE INDEX IF NOT EXISTS idx_dim_time ON job_logs (start_time, printer_id, user_id, total_pages)",
+        "CREATE INDEX IF NOT EXISTS idx_dim_printer_user ON job_logs (printer_id, user_id, total_pages)",
+        "CREATE INDEX IF NOT EXISTS idx_dim_user_time ON job_logs (user_id, start_time)",
+    ]),
+    # determine_mode_kind() stored at ingest; NULL until backfilled
+    Migration(6, "mode_kind", [
+        "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS mode_kind ENUM('print', 'copy', 'other') NULL",
+        "CREATE INDEX IF NOT EXISTS idx_mode_kind ON job_logs (mode_kind, start_time)",
+    ]),
+    # Request popularity for post-ingest cache warm-up (view_popularity.py)
+    Migration(7, "view_requests", [
+        """
+        CREATE TABLE IF NOT EXISTS view_requests (
+            day DATE NOT NULL,
+            path VARCHAR(64) NOT NULL,
+            signature_hash CHAR(32) NOT NULL,
+            signature TEXT NOT NULL,
+            hits INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, path, signature_hash),
+            INDEX idx_path_hash (path, signature_hash)
+        )
+        """,
+    ]),
+    # Newest job per printer (start of a date-bounded export)
+    Migration(8, "idx_printer_start", [
+        "CREATE INDEX IF NOT EXISTS idx_printer_start ON job_logs (printer_addr, start_time)",
+    ]),
+    # Per-day / printer job counts and distinct-user sketches (count_store.py)
+    Migration(9, "count_sketches", [
+        """
+        CREATE TABLE IF NOT EXISTS count_sketches (
+            day DATE NOT NULL,
+            printer_addr VARCHAR(100) NOT NULL,
+            jobs INT NOT NULL DEFAULT 0,
+            users BLOB NOT NULL,
+            built_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (day, printer_addr)
+        )
+        """,
+    ]),
+    # Values written by in-place upserts before search_index.index_written
+    # existed may be missing: re-read every row on the next index update
+    Migration(10, "search_index_rescan", [
+        "UPDATE search_index_state SET last_id = 0 WHERE name = 'job_logs'",
+    ]),
+    # Days count_sketches covers; without a row no window is answered from them
+    Migration(11, "count_sketch_state", [
+        """
+        CREATE TABLE IF NOT EXISTS count_sketch_state (
+            name VARCHAR(32) PRIMARY KEY,
+            covered_from DATE NULL,
+            refreshed_on DATE NOT NULL
+        )
+        """,
+    ]),
+    # Per-printer phase timings of each collector run, exported by the webapp's /metrics
+    Migration(12, "collector_phase_timings", [
+        """
+        CREATE TABLE IF NOT EXISTS collector_phase_timings (
+            log_id INT NOT NULL,
+            printer_addr VARCHAR(100) NOT NULL,
+            phase VARCHAR(32) NOT NULL,
+            seconds DOUBLE NOT NULL,
+            calls INT NOT NULL DEFAULT 1,
+            failed TINYINT(1) NOT NULL DEFAULT 0,
+            PRIMARY KEY (log_id, printer_addr, phase)
+        )
+        """,
+    ]),
+]
+CURRENT_VERSION = MIGRATIONS[-1].version
+
+# Version last seen by this process; once current, later checks are free
+_KNOWN = {"version": None}
+_KNOWN_LOCK = threading.Lock()
+
+
+def current_version(cursor) -> int:
+    """Highest applied migration (0 for a database without schema_version)."""
+    cursor.execute("SHOW TABLES LIKE 'schema_version'")
+    if not cursor.fetchone():
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")
+    return int(cursor.fetchone()["version"])
+
+
+def pending(version: int) -> List[Migration]:
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def migrate(cursor, progress: Optional[Callable[[str], None]] = None) -> int:
+    """
+    Apply pending migrations in order under the schema lock; returns the new
+    version. Statements go through online_ddl.apply(), so ALTERs on large
+    tables do not block reads and writes; progress receives status lines.
+    """
+    cursor.execute("SELECT GET_LOCK(%s, %s) AS got", (SCHEMA_LOCK, LOCK_TIMEOUT))
+    if not cursor.fetchone()["got"]:
+        raise RuntimeError(f"Timed out waiting for schema lock {SCHEMA_LOCK}")
+    try:
+        cursor.execute(SCHEMA_VERSION_DDL)
+        # Another process may have migrated while we waited for the lock
+        version = current_version(cursor)
+        for migration in pending(version):
+            if progress:
+                progress(f"Schema migration {migration.version}: {migration.name}")
+            for sql in migration.statements:
+                online_ddl.apply(cursor, sql, progress)
+            cursor.execute(
+                "INSERT IGNORE INTO schema_version (version, name) VALUES (%s, %s)",
+                (migration.version, migration.name),
+            )
+            version = migration.version
+        return version
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (SCHEMA_LOCK,))
+        cursor.fetchall()
+
+
+def ensure_current(connect: Callable[[], Any], apply: bool = True, force: bool = False) -> int:
+    """
+    Check the schema version once per process and, with apply=True, bring the
+    database up to CURRENT_VERSION. force=True re-checks (e.g. after the
+    tables were dropped). Errors are printed, not raised, as init_db always did.
+    """
+    with _KNOWN_LOCK:
+        if not force and _KNOWN["version"] == CURRENT_VERSION:
+            return CURRENT_VERSION
+        try:
+            conn = connect()
+            try:
+                with conn.cursor() as cursor:
+                    version = current_version(cursor)
+                    if version < CURRENT_VERSION and apply:
+                        version = migrate(cursor, progress=print)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Schema update error: {e}")
+            return _KNOWN["version"] or 0
+        if version < CURRENT_VERSION and not apply:
+            print(f"資料庫結構版本 {version} 落後於 {CURRENT_VERSION}，請執行 sharp_mfp_export.py migrate 更新")
+        _KNOWN["version"] = version
+        return version
@@ -0,0 +1,368 @@
+"""
+Keyword search index for job_logs.
+
+Keyword filters used to become leading-wildcard LIKEs (a full scan of
+job_logs per search). Two backends replace them, chosen by SEARCH_BACKEND:
+
+local (default)
+    An inverted index over the *distinct values* of the searchable columns.
+    search_values holds each (field, value) once; search_postings maps every
+    character unigram/bigram of the lower-cased value to it. A keyword is
+    resolved to the matching values through the postings of its rarest
+    bigram (bounded probes count each term's postings up to
+    SEARCH_MAX_CANDIDATES; if every term is more common than that, e.g.
+    "pdf", the keyword goes to LIKE without touching the rest of the index),
+    the LIKE is checked on those candidate values only, and job_logs is
+    filtered with `col IN (...)` on indexed columns.
+    Maintained by an id watermark (search_index_state), so only new rows are
+    read. The JOBLOG upsert can also change file_name / scan_type /
+    destination of existing rows in place; the ingest therefore indexes the
+    values it writes (index_written) before the rows reach job_logs. Works on
+    MariaDB and MySQL.
+
+fulltext
+    MySQL FULLTEXT indexes WITH PARSER ngram (needed for Chinese), created by
+    `sharp_mfp_export.py reindex-search --backend fulltext`. Not available on
+    MariaDB.
+
+like
+    The original LIKE '%kw%' filters.
+
+Any keyword the index cannot answer exactly or cheaply (wildcard
+characters, only whitespace, only common terms, too many matching values,
+index behind the table) falls back to LIKE, so results never differ from
+the unindexed query.
+"""
+
+import hashlib
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "local").lower()
+# Above this many matching values an IN list stops paying off; use LIKE
+SEARCH_MAX_VALUES = int(os.getenv("SEARCH_MAX_VALUES", "2000"))
+# Postings of the rarest query term read to find those values; more means LIKE
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "20000"))
+INDEX_BATCH = 5000
+READY_CACHE_TTL = 5.0
+
+FILENAME_FIELDS = ("file_name", "scan_type", "destination")
+USER_FIELDS = ("user_name", "login_name")
+SEARCH_FIELDS = FILENAME_FIELDS + USER_FIELDS
+
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS search_values (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        field VARCHAR(16) NOT NULL,
+        value_hash CHAR(32) NOT NULL,
+        value VARCHAR(255) NOT NULL,
+        UNIQUE KEY uniq_field_value (field, value_hash)
+    );
+    """,
+    # utf8mb4_bin: terms are already lower-cased and must not collide under
+    # accent/case folding, or the HAVING COUNT(*) check would under-count
+    """
+    CREATE TABLE IF NOT EXISTS search_postings (
+        field VARCHAR(16) NOT NULL,
+        term VARCHAR(2) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+        value_id INT NOT NULL,
+        PRIMARY KEY (field, term, value_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS search_index_state (
+        name VARCHAR(32) PRIMARY KEY,
+        last_id INT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    );
+    """,
+    # IN lookups on the searched columns (user_name / login_name are indexed by add_indices.py)
+    "CREATE INDEX IF NOT EXISTS idx_file_name ON job_logs (file_name(191))",
+    "CREATE INDEX IF NOT EXISTS idx_scan_type ON job_logs (scan_type)",
+    "CREATE INDEX IF NOT EXISTS idx_destination ON job_logs (destination(191))",
+    "CREATE INDEX IF NOT EXISTS idx_user_name ON job_logs (user_name)",
+    "CREATE INDEX IF NOT EXISTS idx_login_name ON job_logs (login_name)",
+]
+
+FULLTEXT_SQL = [
+    "ALTER TABLE job_logs ADD FULLTEXT INDEX ft_job_logs_file (file_name, scan_type, destination) WITH PARSER ngram",
+    "ALTER TABLE job_logs ADD FULLTEXT INDEX ft_job_logs_user (user_name, login_name) WITH PARSER ngram",
+]
+
+_READY_CACHE: Dict[str, Any] = {"ready": False, "checked_at": 0.0}
+
+
+def ensure_schema(cursor) -> None:
+    for sql in SCHEMA_SQL:
+        try:
+            cursor.execute(sql)
+        except Exception as e:
+            print(f"Search index schema error: {e}")
+
+
+def _value_hash(value: str) -> str:
+    return hashlib.md5(value.encode("utf-8")).hexdigest()
+
+
+def _usable(term: str) -> bool:
+    # Whitespace would collide under PAD SPACE comparison ("a " = "a")
+    return bool(term) and not any(ch.isspace() for ch in term)
+
+
+def index_terms(value: str) -> Set[str]:
+    """Unigrams and bigrams of the lower-cased value (unigrams serve 1-char searches)."""
+    text = value.lower()
+    terms = {ch for ch in text}
+    terms.update(text[i:i + 2] for i in range(len(text) - 1))
+    return {t for t in terms if _usable(t)}
+
+
+def query_terms(keyword: str) -> Set[str]:
+    text = keyword.lower()
+    if len(text) == 1:
+        return {text} if _usable(text) else set()
+    return {t for t in (text[i:i + 2] for i in range(len(text) - 1)) if _usable(t)}
+
+
+# ---------- maintenance ----------
+
+def _get_watermark(cursor) -> int:
+    cursor.execute("SELECT last_id FROM search_index_state WHERE name = 'job_logs'")
+    row = cursor.fetchone()
+    return row["last_id"] if row else 0
+
+
+def _set_watermark(cursor, last_id: int) -> None:
+    cursor.execute(
+        "INSERT INTO search_index_state (name, last_id) VALUES ('job_logs', %s) "
+        "ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)",
+        (last_id,),
+    )
+
+
+def _index_values(cursor, pairs: Set[Tuple[str, str]]) -> int:
+    """Add unseen (field, value) pairs and their postings. Returns new value count."""
+    by_hash = {(field, _value_hash(value)): value for field, value in pairs}
+    hashes = sorted({h for _, h in by_hash})
+    existing: Set[Tuple[str, str]] = set()
+    for i in range(0, len(hashes), 1000):
+        chunk = hashes[i:i + 1000]
+        cursor.execute(
+            f"SELECT field, value_hash FROM search_values WHERE value_hash IN ({', '.join(['%s'] * len(chunk))})",
+            chunk,
+        )
+        existing.update((r["field"], r["value_hash"]) for r in cursor.fetchall())
+
+    new = [(field, h, by_hash[(field, h)]) for field, h in by_hash if (field, h) not in existing]
+    if not new:
+        return 0
+    cursor.executemany("INSERT IGNORE INTO search_values (field, value_hash, value) VALUES (%s, %s, %s)", new)
+
+    new_hashes = sorted({h for _, h, _ in new})
+    postings: List[Tuple[str, str, int]] = []
+    for i in range(0, len(new_hashes), 1000):
+        chunk = new_hashes[i:i + 1000]
+        cursor.execute(
+            f"SELECT id, field, value FROM search_values WHERE value_hash IN ({', '.join(['%s'] * len(chunk))})",
+            chunk,
+        )
+        for r in cursor.fetchall():
+            postings.extend((r["field"], term, r["id"]) for term in index_terms(r["value"]))
+    for i in range(0, len(postings), 5000):
+        cursor.executemany(
+            "INSERT IGNORE INTO search_postings (field, term, value_id) VALUES (%s, %s, %s)",
+            postings[i:i + 5000],
+        )
+    return len(new)
+
+
+def index_written(cursor, pairs: Set[Tuple[str, str]]) -> int:
+    """
+    Index (field, value) pairs an upsert is about to write, so rows updated in
+    place (below the watermark) never hold a value the index does not know.
+    Values of rows replaced later stay indexed; they only add IN candidates
+    without rows. If indexing fails, the watermark is reset: searches fall
+    back to LIKE until the next update_index pass has re-read every row.
+    """
+    pairs = {(field, value[:255]) for field, value in pairs if value}
+    if not pairs:
+        return 0
+    try:
+        return _index_values(cursor, pairs)
+    except Exception as e:
+        print(f"Search index update at ingest failed, index marked stale: {e}")
+        _set_watermark(cursor, 0)
+        invalidate_ready()
+        return 0
+
+
+def update_index(conn, rebuild: bool = False, progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
+    """
+    Index job_logs rows added since the watermark (all rows with rebuild=True).
+    Values written to existing rows by the upsert are indexed at ingest
+    (index_written).
+    """
+    stats = {"rows": 0, "values": 0}
+    with conn.cursor() as cursor:
+        if rebuild:
+            cursor.execute("TRUNCATE TABLE search_postings")
+            cursor.execute("TRUNCATE TABLE search_values")
+            _set_watermark(cursor, 0)
+        last_id = _get_watermark(cursor)
+        columns = ", ".join(SEARCH_FIELDS)
+        while True:
+            cursor.execute(
+                f"SELECT id, {columns} FROM job_logs WHERE id > %s ORDER BY id LIMIT %s",
+                (last_id, INDEX_BATCH),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            pairs = {(f, r[f][:255]) for r in rows for f in SEARCH_FIELDS if r[f]}
+            stats["values"] += _index_values(cursor, pairs)
+            stats["rows"] += len(rows)
+            last_id = rows[-1]["id"]
+            _set_watermark(cursor, last_id)
+            if progress:
+                progress(stats["rows"], last_id)
+    invalidate_ready()
+    return stats
+
+
+def create_fulltext_indexes(cursor) -> None:
+    for sql in FULLTEXT_SQL:
+        cursor.execute(sql)
+
+
+# ---------- query side ----------
+
+def _index_ready(cursor) -> bool:
+    """True when every job_logs row is indexed (checked at most every READY_CACHE_TTL)."""
+    now = time.monotonic()
+    if now - _READY_CACHE["checked_at"] < READY_CACHE_TTL:
+        return _READY_CACHE["ready"]
+    try:
+        cursor.execute(
+            "SELECT (SELECT last_id FROM search_index_state WHERE name = 'job_logs') AS indexed, "
+            "(SELECT MAX(id) FROM job_logs) AS latest"
+        )
+        row = cursor.fetchone() or {}
+        ready = row.get("indexed") is not None and (row.get("indexed") or 0) >= (row.get("latest") or 0)
+    except Exception:
+        ready = False
+    _READY_CACHE.update(ready=ready, checked_at=now)
+    return ready
+
+
+def invalidate_ready() -> None:
+    """Re-check the watermark on the next search."""
+    _READY_CACHE["checked_at"] = 0.0
+
+
+def _rarest_term(cursor, terms: Sequence[str], fields: Sequence[str]) -> Optional[str]:
+    """
+    Query term with the fewest postings in `fields`, or None when every term
+    has more than SEARCH_MAX_CANDIDATES. Each probe stops at the best count so
+    far, so a common term costs at most that many index entries.
+    """
+    field_ph = ", ".join(["%s"] * len(fields))
+    best, limit = None, SEARCH_MAX_CANDIDATES + 1
+    for term in terms:
+        cursor.execute(
+            f"SELECT COUNT(*) AS n FROM ("
+            f"SELECT 1 FROM search_postings WHERE field IN ({field_ph}) AND term = %s LIMIT %s) p",
+            list(fields) + [term, limit],
+        )
+        count = int(cursor.fetchone()["n"])
+        if count < limit:
+            best, limit = term, count
+            if count == 0:
+                break
+    return best
+
+
+def resolve_values(cursor, keyword: str, fields: Sequence[str]) -> Optional[Dict[str, List[str]]]:
+    """
+    {field: [values containing keyword]} from the local index, or None when
+    the keyword has to go through LIKE instead.
+    """
+    if "%" in keyword or "_" in keyword or "\\" in keyword:
+        return None
+    terms = sorted(query_terms(keyword))
+    if not terms or not _index_ready(cursor):
+        return None
+    term = _rarest_term(cursor, terms, fields)
+    if term is None:
+        return None
+
+    field_ph = ", ".join(["%s"] * len(fields))
+    cursor.execute(
+        f"""
+        SELECT v.field, v.value
+        FROM search_postings p
+        JOIN search_values v ON v.id = p.value_id
+        WHERE p.field IN ({field_ph}) AND p.term = %s AND v.value LIKE %s
+        LIMIT %s
+        """,
+        list(fields) + [term, f"%{keyword}%", SEARCH_MAX_VALUES + 1],
+    )
+    rows = cursor.fetchall()
+    if len(rows) > SEARCH_MAX_VALUES:
+        return None
+    matches: Dict[str, List[str]] = {f: [] for f in fields}
+    for r in rows:
+        matches.setdefault(r["field"], []).append(r["value"])
+    return matches
+
+
+def _in_clauses(fields: Iterable[str], values_by_field: Dict[str, List[str]]) -> Tuple[List[str], List[Any]]:
+    clauses: List[str] = []
+    params: List[Any] = []
+    for field in fields:
+        values = values_by_field.get(field) or []
+        if values:
+            clauses.append(f"{field} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+    return clauses, params
+
+
+def keyword_filter(
+    cursor,
+    keyword: str,
+    fields: Sequence[str],
+    extra_values: Sequence[str] = (),
+) -> Tuple[str, List[Any]]:
+    """
+    SQL condition "(...)" matching rows where any of `fields` contains
+    keyword, or equals one of extra_values (e.g. LDAP display name matches).
+    """
+    extra = list(extra_values)
+    like = f"%{keyword}%"
+
+    if SEARCH_BACKEND == "local" and cursor is not None:
+        matches = resolve_values(cursor, keyword, fields)
+        if matches is not None:
+            if extra:
+                matches = {f: list(dict.fromkeys(matches[f] + extra)) for f in fields}
+            clauses, params = _in_clauses(fields, matches)
+            if not clauses:
+                return "(1=0)", []
+            return "(" + " OR ".join(clauses) + ")", params
+
+    if SEARCH_BACKEND == "fulltext" and len(keyword.strip()) >= 2 and not extra:
+        # ngram FULLTEXT narrows the rows, the LIKE keeps exact substring semantics
+        phrase = '"' + keyword.replace('"', " ") + '"'
+        likes = " OR ".join(f"{f} LIKE %s" for f in fields)
+        sql = f"(MATCH({', '.join(fields)}) AGAINST (%s IN BOOLEAN MODE) AND ({likes}))"
+        return sql, [phrase] + [like] * len(fields)
+
+    clauses = [f"{f} LIKE %s" for f in fields]
+    params: List[Any] = [like] * len(fields)
+    if extra:
+        placeholders = ", ".join(["%s"] * len(extra))
+        for f in fields:
+            clauses.append(f"{f} IN ({placeholders})")
+            params.extend(extra)
+    return "(" + " OR ".join(clauses) + ")", params
@@ -2,23 +2,94 @@
 # Python 3.9+ recommended
 
 import argparse
+import atexit
+import codecs
+import contextvars
 import csv
+import functools
+import glob
+import hashlib
+import itertools
+import json
 import os
+import queue
 import re
 import sys
+import tempfile
+import threading
 import time
 from collections import defaultdict
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from urllib.parse import urlparse
 
-import requests
-
+# requests is imported where the printers / webapp are contacted, so report
+# commands start without it (benchmarks/bench_import_time.py)
+if TYPE_CHECKING:
+    import requests
 
 import pymysql
 import pymysql.cursors
 
+import metrics
+import count_store
+import dimensions
+import online_ddl
+from job_record import JobRecord, normalize_name
+import query_profiler
+import replicas
+import schema
+import search_index
+
+# Name of the DB helper (fetch_* / sync_*) currently running, used as metrics label
+_DB_HELPER: contextvars.ContextVar = contextvars.ContextVar("db_helper", default="other")
+
+
+class _InstrumentedCursorMixin:
+    """Records per-helper statement counts and durations."""
+
+    def execute(self, query, args=None):
+        t0 = time.perf_counter()
+        completed = False
+        try:
+            result = super().execute(query, args)
+            completed = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - t0
+            helper = _DB_HELPER.get()
+            metrics.DB_QUERIES.inc(helper=helper)
+            metrics.DB_QUERY_DURATION.observe(elapsed, helper=helper)
+            if completed and query_profiler.PROFILE_ENABLED:
+                query_profiler.record(self, query, args, elapsed, helper)
+
+
+class InstrumentedDictCursor(_InstrumentedCursorMixin, pymysql.cursors.DictCursor):
+    pass
+
+
+class InstrumentedSSDictCursor(_InstrumentedCursorMixin, pymysql.cursors.SSDictCursor):
+    """Unbuffered: rows are read from the socket as they are fetched (duration = time to first row)."""
+
+
+def db_helper(fn):
+    """Label the statements issued inside fn with its name and time the whole call."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _DB_HELPER.set(name)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics.DB_HELPER_DURATION.observe(time.perf_counter() - t0, helper=name)
+            _DB_HELPER.reset(token)
+
+    return wrapper
+
 # ========= 配置區（改這裡就好） =========
 # 優先讀取環境變數 SHARP_PRINTERS (逗號分隔)
 env_printers = os.getenv("SHARP_PRINTERS")
@@ -44,178 +115,399 @@ PRINTER_ALIASES = {
 # 數據庫配置
 DB_CONFIG = {
     'host': os.getenv("DB_HOST", "10.32.65.22"),
+    'port': int(os.getenv("DB_PORT", "3306")),
     'user': os.getenv("DB_USER", "printer"),
     'password': os.getenv("DB_PASS", "HDtAHFahLsdkNazm"),
     'database': os.getenv("DB_NAME", "printer"),
     'charset': 'utf8mb4',
-    'cursorclass': pymysql.cursors.DictCursor,
+    'cursorclass': InstrumentedDictCursor,
     'connect_timeout': 5,
     'autocommit': True
 }
 # =====================================
 
-def get_db_connection():
-    return pymysql.connect(**DB_CONFIG)
+def get_db_connection(read_only: bool = False, **overrides):
+    # overrides: per-call connection options, e.g. local_infile=True for bulk loads
+    # read_only: reporting reads may be served by a replica (replicas.py)
+    if read_only and REPLICA_ROUTER.enabled:
+        replica = REPLICA_ROUTER.route()
+        if replica is not None:
+            try:
+                conn = pymysql.connect(**{**DB_CONFIG, "host": replica.host, "port": replica.port, **overrides})
+                replicas.note_served(REPLICA_ROUTER.lag(replica))
+                return conn
+            except pymysql.MySQLError as e:
+                print(f"Replica {replica.host}:{replica.port} unavailable, using primary: {e}")
+                REPLICA_ROUTER.mark_failed(replica, e)
+    return pymysql.connect(**{**DB_CONFIG, **overrides})
+
+
+def _replica_lag(replica: "replicas.Replica") -> Optional[float]:
+    conn = pymysql.connect(**{
+        **DB_CONFIG, "host": replica.host, "port": replica.port,
+        "cursorclass": pymysql.cursors.DictCursor, "connect_timeout": 2,
+    })
+    try:
+        with conn.cursor() as cursor:
+            return replicas.read_lag(cursor)
+    finally:
+        conn.close()
+
+
+REPLICA_ROUTER = replicas.ReplicaRouter(replicas.REPLICA_HOSTS, _replica_lag)
+if REPLICA_ROUTER.enabled:
+    metrics.register_callback(lambda: replicas.replica_families(REPLICA_ROUTER))
+
 
+def get_profiler_connection():
+    # Plain DictCursor: the profiler's own writes are not profiled
+    return get_db_connection(cursorclass=pymysql.cursors.DictCursor)
+
+
+SLOW_QUERY_WRITER = query_profiler.SlowQueryWriter(get_profiler_connection)
+query_profiler.PROFILER.set_persist(SLOW_QUERY_WRITER.add)
+# CLI runs (download, import) exit before the next periodic flush
+atexit.register(SLOW_QUERY_WRITER.flush)
+
+# Surrogate ids for printer / mode / user / computer (dimensions.py), shared by all ingests
+DIMENSION_CACHE = dimensions.DimensionCache(get_db_connection)
+
+
+
+
+@db_helper
+def init_db(apply: bool = True, force: bool = False) -> int:
+    """
+    Bring the schema up to date (schema.py). Costs one version check per
+    process once current; apply=False only checks and warns, for read-only
+    commands that must not take DDL locks.
+    """
+    return schema.ensure_current(get_db_connection, apply=apply, force=force)
 
+@db_helper
+def sync_csv_to_db(path: Path, printer_addr: str, bulk: bool = False) -> int:
+    """Read CSV path, parse it, and upsert into DB (bulk=True: LOAD DATA staging path)."""
+    if bulk:
+        return bulk_sync_csv_to_db(path, printer_addr)
 
+    with metrics.timed(metrics.COLLECTOR_PHASE_DURATION, printer=printer_addr, phase="parse_joblog"):
+        records = _joblog_records_from_csv(path)
+    if not records:
+        return 0
 
-def init_db():
     conn = get_db_connection()
     try:
         with conn.cursor() as cursor:
-            # unique key: printer + job_id + start_time
-            # start_time is critical to distinguish same job id recycled or from different days?
-            # job_id itself might repeat after 9999 or similar?
-            # User said "data has duplicates", "incremental logs".
-            # We trust that (printer, job_id, start_time) is unique enough.
-            # If Job ID is strictly unique per printer forever, (printer, job_id) is enough.
-            # But safer to include time.
-            sql = """
-            CREATE TABLE IF NOT EXISTS job_logs (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                printer_addr VARCHAR(100) NOT NULL,
-                job_id VARCHAR(50),
-                account_job_id VARCHAR(50),
-                mode VARCHAR(50),
-                user_name VARCHAR(100),
-                login_name VARCHAR(100),
-                computer_name VARCHAR(100),
-                start_time DATETIME,
-                end_time DATETIME,
-                bw_pages INT DEFAULT 0,
-                color_pages INT DEFAULT 0,
-                total_pages INT DEFAULT 0,
-                file_name VARCHAR(255),
-                scan_type VARCHAR(100),
-                destination VARCHAR(255),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE KEY unique_job (printer_addr, job_id, start_time) 
-            );
-            """
-            cursor.execute(sql)
-
-            # Attempt to add new columns if they don't exist (Migration)
-            alter_sqls = [
-                "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS file_name VARCHAR(255)",
-                "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS scan_type VARCHAR(100)",
-                "ALTER TABLE job_logs ADD COLUMN IF NOT EXISTS destination VARCHAR(255)"
-            ]
-            for asql in alter_sqls:
-                try:
-                    cursor.execute(asql)
-                except Exception:
-                    # Ignore if column exists
-                    pass
-            
-            # Explicitly check and add columns if missing (Robust check)
-            cursor.execute("SHOW COLUMNS FROM job_logs")
-            existing_cols = {row['Field'] for row in cursor.fetchall()}
-            
-            robust_adds = []
-            if 'file_name' not in existing_cols: robust_adds.append("ADD COLUMN file_name VARCHAR(255)")
-            if 'scan_type' not in existing_cols: robust_adds.append("ADD COLUMN scan_type VARCHAR(100)")
-            if 'destination' not in existing_cols: robust_adds.append("ADD COLUMN destination VARCHAR(255)")
-            
-            for stmt in robust_adds:
-                try:
-                    cursor.execute(f"ALTER TABLE job_logs {stmt}")
-                except Exception as e:
-                    print(f"Schema update error: {e}")
-            
-            # User Count Table
-            # User Count Table
-            sql_uc = """
-            CREATE TABLE IF NOT EXISTS user_counts (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                printer_addr VARCHAR(100) NOT NULL,
-                user_name VARCHAR(100),
-                print_bw INT DEFAULT 0,
-                print_color INT DEFAULT 0,
-                copy_bw INT DEFAULT 0,
-                copy_color INT DEFAULT 0,
-                other_usage INT DEFAULT 0,
-                total_pages INT DEFAULT 0,
-                snapshot_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-                INDEX idx_printer_latest (printer_addr, snapshot_time)
-            );
-            """
-            cursor.execute(sql_uc)
-            
-            # Update Logs Table
-            sql_log = """
-            CREATE TABLE IF NOT EXISTS update_logs (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                trigger_source VARCHAR(20) NOT NULL,
-                status VARCHAR(20) NOT NULL,
-                start_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-                end_time DATETIME,
-                message TEXT,
-                INDEX idx_start_time (start_time)
-            );
-            """
-            cursor.execute(sql_log)
+            return _upsert_joblog_records(cursor, printer_addr, records)
     finally:
         conn.close()
 
-def sync_csv_to_db(path: Path, printer_addr: str) -> int:
-    """Read CSV path, parse it, and upsert into DB."""
-    entries = _joblog_entries_from_csv_raw(path)
-    if not entries:
+
+JOBLOG_UPSERT_SQL = """
+INSERT INTO job_logs (
+    printer_addr, job_id, account_job_id, mode, 
+    user_name, login_name, computer_name, 
+    start_time, end_time, bw_pages, color_pages, total_pages,
+    file_name, scan_type, destination,
+    printer_id, mode_id, user_id, computer_id, mode_kind
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    file_name = VALUES(file_name),
+    scan_type = VALUES(scan_type),
+    destination = VALUES(destination),
+    bw_pages = VALUES(bw_pages),
+    color_pages = VALUES(color_pages),
+    total_pages = VALUES(total_pages),
+    printer_id = VALUES(printer_id),
+    mode_id = VALUES(mode_id),
+    user_id = VALUES(user_id),
+    computer_id = VALUES(computer_id),
+    mode_kind = VALUES(mode_kind)
+"""
+
+
+def _upsert_joblog_records(cursor, printer_addr: str, records: List[Tuple[Any, ...]]) -> int:
+    # Records are already in INSERT column order; ids and mode_kind are appended
+    records = [rec for rec in records if rec[JOBLOG_START_INDEX]]
+    if not records:
         return 0
+    derived = _joblog_derived_columns(printer_addr, records)
+    values = [(printer_addr,) + rec + extra for rec, extra in zip(records, derived)]
+    # Before the write: an update below the search index watermark must not
+    # leave a row with an unindexed value
+    search_index.index_written(cursor, _written_search_values(values))
+    return cursor.executemany(JOBLOG_UPSERT_SQL, values)
+
+
+# Streaming ingest (STREAM_INGEST=0: download the whole file, then sync_csv_to_db)
+STREAM_INGEST = os.getenv("STREAM_INGEST", "1").lower() in ("1", "true", "yes", "on")
+# Rows per DB batch, and batches parsed ahead of the writer
+STREAM_BATCH_ROWS = int(os.getenv("STREAM_BATCH_ROWS", "5000"))
+STREAM_QUEUE_BATCHES = 4
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _decoded_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Bytes chunks -> newline-terminated text lines for csv.reader, decoded incrementally."""
+    decoder = codecs.getincrementaldecoder(CSV_ENCODING)(errors=CSV_ERRORS)
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        # Split on LF only: csv.reader handles CRLF and quoted line breaks itself
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+@db_helper
+def stream_joblog_to_db(chunks: Iterable[bytes], archive_path: Path, printer_addr: str) -> int:
+    """
+    Ingest a job log while it downloads. Every chunk is written to
+    archive_path (via a .part file, renamed once complete) and decoded into
+    CSV rows; each STREAM_BATCH_ROWS rows are parsed and handed to a writer
+    thread that upserts them on its own connection. At most
+    STREAM_QUEUE_BATCHES batches wait for the writer, so memory stays flat
+    however large the export is. Upserts are idempotent, so a download that
+    fails half way can simply be retried. Returns the affected row count.
+    """
+    batches: "queue.Queue[Optional[List[Tuple[Any, ...]]]]" = queue.Queue(maxsize=STREAM_QUEUE_BATCHES)
+    result = {"affected": 0, "error": None}
+    helper = _DB_HELPER.get()
 
-    conn = get_db_connection()
-    inserted = 0
+    def writer() -> None:
+        _DB_HELPER.set(helper)
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                while True:
+                    records = batches.get()
+                    if records is None:
+                        return
+                    result["affected"] += _upsert_joblog_records(cursor, printer_addr, records)
+        except Exception as e:
+            result["error"] = e
+            # Keep draining so the producer never blocks on a dead writer
+            while batches.get() is not None:
+                pass
+        finally:
+            if conn is not None:
+                conn.close()
+
+    thread = threading.Thread(target=writer, name="joblog-stream-writer", daemon=True)
+    thread.start()
+
+    part_path = archive_path.with_name(archive_path.name + ".part")
+    completed = False
     try:
-        with conn.cursor() as cursor:
-            sql = """
-            INSERT INTO job_logs (
-                printer_addr, job_id, account_job_id, mode, 
-                user_name, login_name, computer_name, 
-                start_time, end_time, bw_pages, color_pages, total_pages,
-                file_name, scan_type, destination
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE
-                file_name = VALUES(file_name),
-                scan_type = VALUES(scan_type),
-                destination = VALUES(destination),
-                bw_pages = VALUES(bw_pages),
-                color_pages = VALUES(color_pages),
-                total_pages = VALUES(total_pages)
-            """
-            
-            # Prepare batch
-            values = []
-            for e in entries:
-                if not e.get("start"):
-                    continue
+        with open(part_path, "wb") as archive:
+
+            def teed() -> Iterator[bytes]:
+                for chunk in chunks:
+                    archive.write(chunk)
+                    yield chunk
+
+            reader = csv.reader(_decoded_lines(teed()))
+            header = next(reader, None)
+            if header:
+                columns = _resolve_joblog_columns(header)
+                parsers = (TimestampParser(), TimestampParser())
+                rows: List[List[str]] = []
+                for row in reader:
+                    if row:
+                        rows.append(row)
+                    if len(rows) >= STREAM_BATCH_ROWS:
+                        batches.put(_joblog_records_from_rows(columns, rows, parsers))
+                        rows = []
+                    if result["error"] is not None:
+                        break
+                if rows and result["error"] is None:
+                    batches.put(_joblog_records_from_rows(columns, rows, parsers))
+        completed = True
+    finally:
+        batches.put(None)
+        thread.join()
+        if completed and result["error"] is None:
+            part_path.replace(archive_path)
+        else:
+            part_path.unlink(missing_ok=True)
 
-                values.append((
-                    printer_addr,
-                    e.get("job_id"),
-                    e.get("account_job_id"),
-                    e.get("mode"),
-                    e.get("user"),
-                    e.get("login"),
-                    e.get("computer"),
-                    e.get("start"),
-                    e.get("end"),
-                    e.get("bw", 0),
-                    e.get("color", 0),
-                    e.get("pages", 0),
-                    e.get("file_name"),
-                    e.get("scan_type"),
-                    e.get("destination")
-                ))
-            
-            if values:
-                inserted = cursor.executemany(sql, values)
+    if result["error"] is not None:
+        raise result["error"]
+    return result["affected"]
+
+
+JOBLOG_INSERT_COLUMNS = (
+    "printer_addr", "job_id", "account_job_id", "mode",
+    "user_name", "login_name", "computer_name",
+    "start_time", "end_time", "bw_pages", "color_pages", "total_pages",
+    "file_name", "scan_type", "destination",
+) + dimensions.ID_COLUMNS + ("mode_kind",)
+BULK_PROGRESS_EVERY = 100000
+# Columns the upsert may change in place that the keyword search index covers
+JOBLOG_SEARCH_COLUMNS = tuple((field, JOBLOG_INSERT_COLUMNS.index(field)) for field in search_index.FILENAME_FIELDS)
+
+
+def _written_search_values(rows: Iterable[Tuple[Any, ...]]) -> Set[Tuple[str, str]]:
+    """(field, value) pairs of the searchable columns in rows laid out as JOBLOG_INSERT_COLUMNS."""
+    return {(field, row[i]) for row in rows for field, i in JOBLOG_SEARCH_COLUMNS if row[i]}
+
+
+def _tsv_field(value: Any) -> str:
+    """Encode one value for LOAD DATA (default FIELDS ESCAPED BY '\\')."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    text = str(value)
+    if "\\" in text or "\t" in text or "\n" in text or "\r" in text:
+        text = (
+            text.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+    return text
+
+
+@db_helper
+def bulk_sync_csv_to_db(
+    path: Path,
+    printer_addr: str,
+    progress: Optional[Callable[[str], None]] = None,
+) -> int:
+    """
+    Bulk ingest for initial imports / historical backfills.
+
+    1) parse and normalise rows into a temporary TSV
+    2) LOAD DATA LOCAL INFILE into a per-connection TEMPORARY staging table
+    3) merge into job_logs with one INSERT ... SELECT ... ON DUPLICATE KEY UPDATE
+
+    Requires local_infile enabled on the server. Returns the number of staged rows.
+    """
+    report = progress or print
+    t0 = time.monotonic()
+    with metrics.timed(metrics.COLLECTOR_PHASE_DURATION, printer=printer_addr, phase="parse_joblog"):
+        records = _joblog_records_from_csv(path)
+    if not records:
+        return 0
+    report(f"[bulk] {path.name}: 解析 {len(records)} 筆 ({time.monotonic() - t0:.1f}s)")
+
+    records = [rec for rec in records if rec[JOBLOG_START_INDEX]]
+    derived = _joblog_derived_columns(printer_addr, records)
+
+    fd, tsv_name = tempfile.mkstemp(prefix="joblog_stage_", suffix=".tsv")
+    staged = 0
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as fh:
+            for rec, extra in zip(records, derived):
+                fh.write(_tsv_field(printer_addr))
+                for value in rec + extra:
+                    fh.write("\t")
+                    fh.write(_tsv_field(value))
+                fh.write("\n")
+                staged += 1
+                if staged % BULK_PROGRESS_EVERY == 0:
+                    report(f"[bulk] 已寫入暫存檔 {staged} 筆")
+        if staged == 0:
+            return 0
+
+        columns = ", ".join(JOBLOG_INSERT_COLUMNS)
+        conn = get_db_connection(local_infile=True, autocommit=False)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    CREATE TEMPORARY TABLE job_logs_stage (
+                        printer_addr VARCHAR(100) NOT NULL,
+                        job_id VARCHAR(50),
+                        account_job_id VARCHAR(50),
+                        mode VARCHAR(50),
+                        user_name VARCHAR(100),
+                        login_name VARCHAR(100),
+                        computer_name VARCHAR(100),
+                        start_time DATETIME,
+                        end_time DATETIME,
+                        bw_pages INT DEFAULT 0,
+                        color_pages INT DEFAULT 0,
+                        total_pages INT DEFAULT 0,
+                        file_name VARCHAR(255),
+                        scan_type VARCHAR(100),
+                        destination VARCHAR(255),
+                        printer_id SMALLINT UNSIGNED,
+                        mode_id SMALLINT UNSIGNED,
+                        user_id INT UNSIGNED,
+                        computer_id INT UNSIGNED,
+                        mode_kind VARCHAR(8)
+                    )
+                    """
+                )
+                t1 = time.monotonic()
+                loaded = cursor.execute(
+                    "LOAD DATA LOCAL INFILE %s INTO TABLE job_logs_stage "
+                    "CHARACTER SET utf8mb4 "
+                    "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' "
+                    f"({columns})",
+                    (tsv_name,),
+                )
+                report(f"[bulk] LOAD DATA: {loaded} 筆進入暫存表 ({time.monotonic() - t1:.1f}s)")
+
+                cursor.execute(
+                    """
+                    SELECT COUNT(*) AS cnt FROM job_logs_stage s
+                    JOIN job_logs j
+                      ON j.printer_addr = s.printer_addr
+                     AND j.job_id = s.job_id
+                     AND j.start_time = s.start_time
+                    """
+                )
+                existing = cursor.fetchone()['cnt']
+
+                # Same transaction as the merge (see _upsert_joblog_records)
+                search_index.index_written(cursor, _written_search_values((printer_addr,) + rec for rec in records))
+
+                t2 = time.monotonic()
+                cursor.execute(
+                    f"""
+                    INSERT INTO job_logs ({columns})
+                    SELECT {columns} FROM job_logs_stage s
+                    ON DUPLICATE KEY UPDATE
+                        file_name = s.file_name,
+                        scan_type = s.scan_type,
+                        destination = s.destination,
+                        bw_pages = s.bw_pages,
+                        color_pages = s.color_pages,
+                        total_pages = s.total_pages,
+                        printer_id = s.printer_id,
+                        mode_id = s.mode_id,
+                        user_id = s.user_id,
+                        computer_id = s.computer_id,
+                        mode_kind = s.mode_kind
+                    """
+                )
+                conn.commit()
+                report(
+                    f"[bulk] 合併完成: 新增約 {max(loaded - existing, 0)} 筆 / 已存在 {existing} 筆 "
+                    f"({time.monotonic() - t2:.1f}s，總計 {time.monotonic() - t0:.1f}s)"
+                )
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
     finally:
-        conn.close()
-    
-    return inserted
+        try:
+            os.unlink(tsv_name)
+        except OSError:
+            pass
 
+    return staged
 
+
+@db_helper
 def sync_usercount_to_db(path: Path, printer_addr: str) -> int:
     """Parse usercount CSV and insert snapshot."""
     rows = _read_csv_rows_raw(path)
@@ -236,6 +528,15 @@ def sync_usercount_to_db(path: Path, printer_addr: str) -> int:
 
     try:
         with conn.cursor() as cursor:
+            # A snapshot already ingested (by the collector or an earlier
+            # import) would otherwise be inserted again and double every user
+            cursor.execute(
+                "SELECT 1 FROM user_counts WHERE printer_addr = %s AND snapshot_time = %s LIMIT 1",
+                (printer_addr, timestamp),
+            )
+            if cursor.fetchone():
+                return 0
+
             sql = """
             INSERT INTO user_counts (
                 printer_addr, user_name, 
@@ -279,6 +580,7 @@ def sync_usercount_to_db(path: Path, printer_addr: str) -> int:
     return inserted
 
 
+@db_helper
 def fetch_latest_user_counts(
     printer_addr: str,
     user_filter: Optional[str] = None,
@@ -290,7 +592,7 @@ def fetch_latest_user_counts(
     Fetch the latest snapshot for a printer.
     Returns (results, total_count).
     """
-    conn = get_db_connection()
+    conn = get_db_connection(read_only=True)
     results = []
     total = 0
     try:
@@ -328,33 +630,33 @@ def fetch_latest_user_counts(
                 sql += " LIMIT %s OFFSET %s"
                 params.extend([limit, offset])
             
-            cursor.execute(sql, params)
-            rows = cursor.fetchall()
-            
-            for r in rows:
-                # Reconstruct usage dict for webapp compatibility
-                # "usage_list" format: [{"label": "...", "pages": 123}, ...]
-                # USAGE_CATEGORY_CONFIG labels: "印表機:黑白" etc.
+            # Unbuffered: rows are converted as they arrive, not after fetchall()
+            with conn.cursor(InstrumentedSSDictCursor) as stream:
+                stream.execute(sql, params)
+                for r in stream:
+                    # Reconstruct usage dict for webapp compatibility
+                    # "usage_list" format: [{"label": "...", "pages": 123}, ...]
+                    # USAGE_CATEGORY_CONFIG labels: "印表機:黑白" etc.
                 
-                usage_list = []
-                if r['print_bw'] > 0: usage_list.append({"label": "印表機:黑白", "pages": r['print_bw']})
-                if r['print_color'] > 0: usage_list.append({"label": "印表機:全彩", "pages": r['print_color']})
-                if r['copy_bw'] > 0: usage_list.append({"label": "影印:黑白", "pages": r['copy_bw']})
-                if r['copy_color'] > 0: usage_list.append({"label": "影印:全彩", "pages": r['copy_color']})
-                if r['other_usage'] > 0: usage_list.append({"label": "其他", "pages": r['other_usage']})
-
-                # Need "usage": {"印表機:黑白": 123} map too?
-                # webapp uses `usage_list` for display and `usage` dict for sorting/export sometimes.
-                # Let's provide both.
-                usage_dict = {item["label"]: item["pages"] for item in usage_list}
+                    usage_list = []
+                    if r['print_bw'] > 0: usage_list.append({"label": "印表機:黑白", "pages": r['print_bw']})
+                    if r['print_color'] > 0: usage_list.append({"label": "印表機:全彩", "pages": r['print_color']})
+                    if r['copy_bw'] > 0: usage_list.append({"label": "影印:黑白", "pages": r['copy_bw']})
+                    if r['copy_color'] > 0: usage_list.append({"label": "影印:全彩", "pages": r['copy_color']})
+                    if r['other_usage'] > 0: usage_list.append({"label": "其他", "pages": r['other_usage']})
+
+                    # Need "usage": {"印表機:黑白": 123} map too?
+                    # webapp uses `usage_list` for display and `usage` dict for sorting/export sometimes.
+                    # Let's provide both.
+                    usage_dict = {item["label"]: item["pages"] for item in usage_list}
                 
-                results.append({
-                    "name": r['user_name'],
-                    "total": r['total_pages'],
-                    "usage": usage_dict,
-                    "usage_list": usage_list,
-                    "snapshot_time": r['snapshot_time']
-                })
+                    results.append({
+                        "name": r['user_name'],
+                        "total": r['total_pages'],
+                        "usage": usage_dict,
+                        "usage_list": usage_list,
+                        "snapshot_time": r['snapshot_time']
+                    })
     finally:
         conn.close()
     return results, total
@@ -367,14 +669,23 @@ def _build_job_logs_where_clause(
     computer_kw: Optional[str] = None,
     start_dt: Optional[datetime] = None,
     end_dt: Optional[datetime] = None,
-    filename_kw: Optional[str] = None
+    filename_kw: Optional[str] = None,
+    cursor=None
 ) -> Tuple[str, List[Any]]:
+    # cursor: lets user / filename keywords resolve through the search index
+    # (search_index.py) and printer / mode / computer filters use the compact
+    # dimension ids (dimensions.py); without it everything is string matching
     sql = " WHERE 1=1"
     params = []
+    use_dims = dimensions.ready(cursor)
     
     if printer_addr and printer_addr != 'all':
-        sql += " AND printer_addr = %s"
-        params.append(printer_addr)
+        if use_dims:
+            sql += " AND printer_id = %s"
+            params.append(dimensions.lookup_id(cursor, "printer", (printer_addr,)) or 0)
+        else:
+            sql += " AND printer_addr = %s"
+            params.append(printer_addr)
     
     if user_kw:
         # Enhanced user search: search by username OR LDAP display name
@@ -383,30 +694,31 @@ def _build_job_logs_where_clause(
         # Get usernames matching display name query
         ldap_matches = search_usernames_by_display_name(user_kw)
         
-        if ldap_matches:
-            # Search by: (username LIKE query) OR (username IN ldap_matches)
-            placeholders = ", ".join(["%s"] * len(ldap_matches))
-            sql += f" AND (user_name LIKE %s OR login_name LIKE %s OR user_name IN ({placeholders}) OR login_name IN ({placeholders}))"
-            kw = f"%{user_kw}%"
-            params.extend([kw, kw] + list(ldap_matches) + list(ldap_matches))
-        else:
-            # No LDAP matches, just use keyword search
-            sql += " AND (user_name LIKE %s OR login_name LIKE %s)"
-            kw = f"%{user_kw}%"
-            params.extend([kw, kw])
+        # (username contains query) OR (username IN ldap_matches)
+        clause, clause_params = search_index.keyword_filter(
+            cursor, user_kw, search_index.USER_FIELDS, extra_values=ldap_matches or ()
+        )
+        sql += f" AND {clause}"
+        params.extend(clause_params)
         
     if mode_kw:
-        sql += " AND mode LIKE %s"
+        if use_dims:
+            sql += " AND mode_id IN (SELECT id FROM dim_mode WHERE mode LIKE %s)"
+        else:
+            sql += " AND mode LIKE %s"
         params.append(f"%{mode_kw}%")
         
     if computer_kw:
-        sql += " AND computer_name LIKE %s"
+        if use_dims:
+            sql += " AND computer_id IN (SELECT id FROM dim_computer WHERE computer_name LIKE %s)"
+        else:
+            sql += " AND computer_name LIKE %s"
         params.append(f"%{computer_kw}%")
     
     if filename_kw:
-        sql += " AND (file_name LIKE %s OR scan_type LIKE %s OR destination LIKE %s)"
-        kw = f"%{filename_kw}%"
-        params.extend([kw, kw, kw])
+        clause, clause_params = search_index.keyword_filter(cursor, filename_kw, search_index.FILENAME_FIELDS)
+        sql += f" AND {clause}"
+        params.extend(clause_params)
         
     if start_dt:
         sql += " AND start_time >= %s"
@@ -419,6 +731,7 @@ def _build_job_logs_where_clause(
     return sql, params
 
 
+@db_helper
 def fetch_aggregated_users_paginated(
     page: int,
     per_page: int,
@@ -435,17 +748,19 @@ def fetch_aggregated_users_paginated(
     user_list is [{"user": "...", "login": "..."}, ...]
     Ordered by total_pages DESC (top users first).
     """
-    conn = get_db_connection()
+    conn = get_db_connection(read_only=True)
     try:
         with conn.cursor() as cursor:
             where_sql, params = _build_job_logs_where_clause(
-                printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt, filename_kw
+                printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt, filename_kw, cursor
             )
+            filters = _count_filters(printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt, filename_kw)
+            if dimensions.ready(cursor):
+                return _fetch_aggregated_users_by_id(cursor, where_sql, params, page, per_page, filters)
             
-            # Count total unique users
+            # Count total unique users (cached per filter and generation)
             count_sql = f"SELECT COUNT(DISTINCT user_name, login_name) as cnt FROM job_logs {where_sql}"
-            cursor.execute(count_sql, params)
-            total = cursor.fetchone()['cnt']
+            total = COUNT_STORE.count("users", filters, lambda: _scalar_count(cursor, count_sql, params))
             
             if total == 0:
                 return [], 0
@@ -481,6 +796,38 @@ def fetch_aggregated_users_paginated(
         conn.close()
 
 
+def _fetch_aggregated_users_by_id(
+    cursor, where_sql: str, params: List[Any], page: int, per_page: int, filters: Dict[str, Any]
+) -> Tuple[List[Dict[str, Any]], int]:
+    """fetch_aggregated_users_paginated on user_id: group on the integer, join names for one page."""
+    count_sql = f"SELECT COUNT(DISTINCT user_id) as cnt FROM job_logs {where_sql}"
+    total = COUNT_STORE.count("users", filters, lambda: _scalar_count(cursor, count_sql, params))
+    if total == 0:
+        return [], 0
+
+    inner = f"SELECT user_id, SUM(total_pages) as page_sum FROM job_logs {where_sql} GROUP BY user_id ORDER BY page_sum DESC"
+    query_params = list(params)
+    if per_page > 0:
+        inner += " LIMIT %s OFFSET %s"
+        query_params.extend([per_page, (page - 1) * per_page])
+
+    cursor.execute(
+        f"""
+        SELECT t.user_id, d.user_name, d.login_name, t.page_sum
+        FROM ({inner}) t
+        JOIN dim_user d ON d.id = t.user_id
+        ORDER BY t.page_sum DESC
+        """,
+        query_params,
+    )
+    users = [
+        {"user": r['user_name'], "login": r['login_name'], "user_id": r['user_id']}
+        for r in cursor.fetchall()
+    ]
+    return users, total
+
+
+@db_helper
 def fetch_total_user_printer_pairs(
     printer_addr: Optional[str] = None,
     user_kw: Optional[str] = None,
@@ -494,23 +841,31 @@ def fetch_total_user_printer_pairs(
     Count total unique (user, login, printer) tuples.
     This corresponds to the total number of rows in 'All Printers' Counts view 
     (where one user can appear multiple times if they use multiple printers).
+    Cached per filter and ingestion generation (COUNT_STORE).
     """
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cursor:
-            where_sql, params = _build_job_logs_where_clause(
-                printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt, filename_kw
-            )
-            
-            # Count distinct (user, login, printer)
-            # MySQL supports COUNT(DISTINCT expr1, expr2, ...)
-            sql = f"SELECT COUNT(DISTINCT user_name, login_name, printer_addr) as cnt FROM job_logs {where_sql}"
-            cursor.execute(sql, params)
-            return cursor.fetchone()['cnt']
-    finally:
-        conn.close()
-
-
+    def exact() -> int:
+        conn = get_db_connection(read_only=True)
+        try:
+            with conn.cursor() as cursor:
+                where_sql, params = _build_job_logs_where_clause(
+                    printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt, filename_kw, cursor
+                )
+
+                # Count distinct (user, login, printer)
+                # MySQL supports COUNT(DISTINCT expr1, expr2, ...)
+                if dimensions.ready(cursor):
+                    sql = f"SELECT COUNT(DISTINCT user_id, printer_id) as cnt FROM job_logs {where_sql}"
+                else:
+                    sql = f"SELECT COUNT(DISTINCT user_name, login_name, printer_addr) as cnt FROM job_logs {where_sql}"
+                return _scalar_count(cursor, sql, params)
+        finally:
+            conn.close()
+
+    filters = _count_filters(printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt, filename_kw)
+    return COUNT_STORE.count("pairs", filters, exact)
+
+
+@db_helper
 def fetch_total_jobs_count(
     printer_addr: Optional[str] = None,
     user_kw: Optional[str] = None,
@@ -522,21 +877,119 @@ def fetch_total_jobs_count(
 ) -> int:
     """
     Count total job logs matching the filter.
+    Cached per filter and ingestion generation (COUNT_STORE).
+    """
+    def exact() -> int:
+        conn = get_db_connection(read_only=True)
+        try:
+            with conn.cursor() as cursor:
+                where_sql, params = _build_job_logs_where_clause(
+                    printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt, filename_kw, cursor
+                )
+                return _scalar_count(cursor, f"SELECT COUNT(*) as cnt FROM job_logs {where_sql}", params)
+        finally:
+            conn.close()
+
+    filters = _count_filters(printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt, filename_kw)
+    return COUNT_STORE.count("jobs", filters, exact)
+
+
+def _count_filters(
+    printer_addr: Optional[str],
+    user_kw: Optional[str],
+    mode_kw: Optional[str],
+    computer_kw: Optional[str],
+    start_dt: Optional[datetime],
+    end_dt: Optional[datetime],
+    filename_kw: Optional[str],
+) -> Dict[str, Any]:
+    """Filter arguments of the count helpers, as keyed by COUNT_STORE."""
+    return {
+        "printer": printer_addr, "user": user_kw, "mode": mode_kw, "computer": computer_kw,
+        "start": start_dt, "end": end_dt, "filename": filename_kw,
+    }
+
+
+def _scalar_count(cursor, sql: str, params: List[Any]) -> int:
+    cursor.execute(sql, params)
+    return cursor.fetchone()['cnt']
+
+
+def _estimate_count(kind: str, filters: Dict[str, Any]) -> Optional[int]:
+    """Approximate count from count_sketches; None when the filters need an exact COUNT."""
+    window = count_store.sketch_window(filters)
+    if window is None:
+        return None
+    first, last, printer = window
+    sql = "SELECT printer_addr, jobs, users FROM count_sketches WHERE 1=1"
+    params: List[Any] = []
+    if first is not None:
+        sql += " AND day >= %s"
+        params.append(first)
+    if last is not None:
+        sql += " AND day <= %s"
+        params.append(last)
+    if printer:
+        sql += " AND printer_addr = %s"
+        params.append(printer)
+    conn = get_db_connection(read_only=True)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT covered_from, refreshed_on FROM count_sketch_state WHERE name = 'job_logs'")
+            if not count_store.sketches_cover(cursor.fetchone(), first, last):
+                # Some days of the window were never sketched: count exactly
+                return None
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+    finally:
+        conn.close()
+    # No sketches for the window (never built): count exactly
+    return count_store.estimate(kind, rows)
+
+
+@db_helper
+def refresh_count_sketches(days: Optional[int] = count_store.SKETCH_REFRESH_DAYS) -> int:
+    """
+    Rebuild count_sketches for the last `days` days (None: all of job_logs) and
+    record the days they now cover in count_sketch_state; returns rows written.
     """
+    today = date.today()
+    since = count_store.refresh_since(days, today)
+    sql = (
+        "SELECT DATE(start_time) AS day, printer_addr, user_name, login_name, COUNT(*) AS jobs "
+        "FROM job_logs WHERE start_time IS NOT NULL"
+    )
+    params: List[Any] = []
+    if since is not None:
+        sql += " AND start_time >= %s"
+        params.append(since)
+    sql += " GROUP BY day, printer_addr, user_name, login_name"
+
     conn = get_db_connection()
     try:
+        with conn.cursor(InstrumentedSSDictCursor) as stream:
+            stream.execute(sql, params)
+            sketches = count_store.build_sketches(stream)
+        rows = [(day, printer, jobs, sketch.to_bytes()) for (day, printer), (jobs, sketch) in sketches.items()]
         with conn.cursor() as cursor:
-            where_sql, params = _build_job_logs_where_clause(
-                printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt, filename_kw
+            for i in range(0, len(rows), 500):
+                cursor.executemany(
+                    "REPLACE INTO count_sketches (day, printer_addr, jobs, users) VALUES (%s, %s, %s, %s)",
+                    rows[i:i + 500],
+                )
+            cursor.execute("SELECT covered_from, refreshed_on FROM count_sketch_state WHERE name = 'job_logs'")
+            covered_from = count_store.coverage_after_refresh(cursor.fetchone(), since)
+            cursor.execute(
+                "REPLACE INTO count_sketch_state (name, covered_from, refreshed_on) VALUES ('job_logs', %s, %s)",
+                (covered_from, today),
             )
-            
-            sql = f"SELECT COUNT(*) as cnt FROM job_logs {where_sql}"
-            cursor.execute(sql, params)
-            return cursor.fetchone()['cnt']
+        conn.commit()
+        return len(rows)
     finally:
         conn.close()
 
 
+@db_helper
 def fetch_job_logs_by_users(
     users: List[Dict[str, str]],
     printer_addr: Optional[str] = None,
@@ -545,65 +998,125 @@ def fetch_job_logs_by_users(
     start_dt: Optional[datetime] = None,
     end_dt: Optional[datetime] = None,
     filename_kw: Optional[str] = None
-) -> List[Dict[str, Any]]:
+) -> List[JobRecord]:
     """Fetch all logs for specific users (for the current page view)."""
+    return list(iter_job_logs_by_users(users, printer_addr, mode_kw, computer_kw, start_dt, end_dt, filename_kw))
+
+
+def iter_job_logs_by_users(
+    users: List[Dict[str, str]],
+    printer_addr: Optional[str] = None,
+    mode_kw: Optional[str] = None,
+    computer_kw: Optional[str] = None,
+    start_dt: Optional[datetime] = None,
+    end_dt: Optional[datetime] = None,
+    filename_kw: Optional[str] = None
+) -> Iterator[JobRecord]:
+    """fetch_job_logs_by_users as a stream of converted records (newest first)."""
     if not users:
-        return []
-        
+        return iter(())
+
+    def build(cursor) -> Tuple[str, List[Any]]:
+        # Base WHERE from filters (skipping user_kw as we filter by specific users)
+        where_sql, params = _build_job_logs_where_clause(
+            printer_addr, None, mode_kw, computer_kw, start_dt, end_dt, filename_kw, cursor
+        )
+        users_sql, users_params = _users_filter_sql(users)
+        return f"SELECT * FROM job_logs {where_sql}{users_sql} ORDER BY start_time DESC", params + users_params
+
+    return _stream_job_logs(_open_job_log_stream(build, "fetch_job_logs_by_users"))
+
+
+def _users_filter_sql(users: List[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """AND-condition restricting job_logs to the users of one report page."""
+    user_ids = [u.get('user_id') for u in users]
+    if all(user_ids):
+        # Users from the id-based aggregation: one indexed IN on user_id
+        return f" AND user_id IN ({', '.join(['%s'] * len(user_ids))})", list(user_ids)
+
+    # (user_name = u1 AND login_name = l1) OR ...
+    params: List[Any] = []
+    user_conditions = []
+    for u in users:
+        user_conditions.append("(user_name <=> %s AND login_name <=> %s)")
+        params.extend([u['user'], u['login']])
+    return " AND (" + " OR ".join(user_conditions) + ")", params
+
+
+@db_helper
+def update_search_index(rebuild: bool = False, progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, int]:
+    """Bring the keyword search index up to date with job_logs (see search_index.py)."""
     conn = get_db_connection()
     try:
-        with conn.cursor() as cursor:
-            # Build base WHERE from filters (skipping user_kw as we filter by specific users)
-            where_sql, params = _build_job_logs_where_clause(
-                printer_addr, None, mode_kw, computer_kw, start_dt, end_dt, filename_kw
-            )
-            
-            # Add user list filter
-            # (user_name = u1 AND login_name = l1) OR ...
-            user_conditions = []
-            for u in users:
-                user_conditions.append("(user_name <=> %s AND login_name <=> %s)")
-                params.extend([u['user'], u['login']])
-            
-            if user_conditions:
-                where_sql += " AND (" + " OR ".join(user_conditions) + ")"
-            
-            sql = f"SELECT * FROM job_logs {where_sql} ORDER BY start_time DESC"
-            cursor.execute(sql, params)
-            rows = cursor.fetchall()
+        return search_index.update_index(conn, rebuild=rebuild, progress=progress)
     finally:
         conn.close()
-        
-    return _convert_db_rows_to_api(rows)
 
 
-def _convert_db_rows_to_api(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    results = []
-    for r in rows:
-        user_name = r['user_name'] or ""
-        login_name = r['login_name'] or "N/A"
-        results.append({
-            "job_id": r['job_id'],
-            "account_job_id": r['account_job_id'],
-            "mode": r['mode'],
-            "computer": r['computer_name'],
-            "user": user_name,
-            "login": login_name,
-            "start": r['start_time'],
-            "end": r['end_time'],
-            "bw": r['bw_pages'],
-            "color": r['color_pages'],
-            "pages": r['total_pages'],
-            "user_display": normalize_name(user_name, "未知"),
-            "user_key": normalize_name(user_name, "未知").lower(),
-            "login_display": normalize_name(login_name, "N/A"),
-            "login_key": normalize_name(login_name, "N/A").lower(),
-            "printer": r['printer_addr'],
-            "file_name": r.get('file_name'),
-            "scan_type": r.get('scan_type'),
-            "destination": r.get('destination')
-        })
-    return results
+# Rows pulled from the server per round trip by the streaming readers
+STREAM_FETCH_ROWS = 2000
+
+
+def _open_job_log_stream(build: Callable[[Any], Tuple[str, List[Any]]], helper: str):
+    """
+    Run the SELECT from build(cursor) on an unbuffered (server-side) cursor of
+    its own connection; returns (conn, cursor) for _stream_job_logs. build
+    gets a buffered cursor on the same connection for filter lookups, which
+    must finish before the streaming query starts.
+    """
+    token = _DB_HELPER.set(helper)
+    conn = get_db_connection(read_only=True)
+    try:
+        with conn.cursor() as lookup:
+            sql, params = build(lookup)
+        cursor = conn.cursor(InstrumentedSSDictCursor)
+        cursor.execute(sql, params)
+        return conn, cursor
+    except Exception:
+        conn.close()
+        raise
+    finally:
+        _DB_HELPER.reset(token)
+
+
+def _stream_job_logs(opened) -> Iterator[JobRecord]:
+    """Yield converted records from an open stream; closes the connection when done or abandoned."""
+    conn, cursor = opened
+    try:
+        while True:
+            rows = cursor.fetchmany(STREAM_FETCH_ROWS)
+            if not rows:
+                break
+            for r in rows:
+                yield _convert_db_row(r)
+    finally:
+        # Closing the connection discards any unread rows server-side
+        conn.close()
+
+
+def _convert_db_rows_to_api(rows: Iterable[Dict[str, Any]]) -> List[JobRecord]:
+    return [_convert_db_row(r) for r in rows]
+
+
+def _convert_db_row(r: Dict[str, Any]) -> JobRecord:
+    return JobRecord(
+        job_id=r['job_id'],
+        account_job_id=r['account_job_id'],
+        mode=r['mode'],
+        computer=r['computer_name'],
+        user=r['user_name'] or "",
+        login=r['login_name'] or "N/A",
+        start=r['start_time'],
+        end=r['end_time'],
+        bw=r['bw_pages'],
+        color=r['color_pages'],
+        pages=r['total_pages'],
+        printer=r['printer_addr'],
+        file_name=r.get('file_name'),
+        scan_type=r.get('scan_type'),
+        destination=r.get('destination'),
+        user_id=r.get('user_id'),
+    )
 
 
 # 建議用環境變數放帳密，不要硬寫在檔案裡
@@ -630,6 +1143,10 @@ PASSWORD = os.getenv("SHARP_PASS", "admin")
 USERNUM = 85
 USERCOUNT_DELETE_AFTER_SAVE = 0  # 0=不刪
 
+# Drain mode: after a job log export is ingested and verified in job_logs, a
+# second export with delAfterSave=1 clears the printer's log (see drain_joblog)
+JOBLOG_DRAIN = os.getenv("JOBLOG_DRAIN", "0").lower() in ("1", "true", "yes", "on")
+
 # Job Log 下載參數（照你抓包）
 JOBLOG_DOWNLOAD_PARAMS = {
     "format": "0",
@@ -639,6 +1156,25 @@ JOBLOG_DOWNLOAD_PARAMS = {
     "delAfterSave": "0",
 }
 
+# Date-bounded exports (opt-in): only jobs since the newest start_time already
+# in job_logs for the printer, minus an overlap window for clock skew and
+# jobs that finish late. JOBLOG_RANGE_PARAMS replaces "date" in the download
+# parameters; values are str.format templates with {start} / {end} dates and
+# can be overridden as JSON to match the firmware's date-range form.
+JOBLOG_RANGE_EXPORT = os.getenv("JOBLOG_RANGE_EXPORT", "0").lower() in ("1", "true", "yes", "on")
+JOBLOG_RANGE_OVERLAP_HOURS = float(os.getenv("JOBLOG_RANGE_OVERLAP_HOURS", "24"))
+JOBLOG_RANGE_PARAMS: Dict[str, str] = json.loads(os.getenv("JOBLOG_RANGE_PARAMS", "null")) or {
+    "date": "1",
+    "startYear": "{start:%Y}",
+    "startMonth": "{start:%m}",
+    "startDay": "{start:%d}",
+    "endYear": "{end:%Y}",
+    "endMonth": "{end:%m}",
+    "endDay": "{end:%d}",
+}
+# Printers whose firmware rejected the range parameters (full export from then on)
+_RANGE_UNSUPPORTED: set = set()
+
 # Job Log Save：你抓包那堆 checkbox，我用「清單」方式維護
 JOBLOG_CHECKBOX_ON = [
     1, 62, 3, 4, 5, 6, 63, 64, 65, 66,
@@ -659,13 +1195,20 @@ SLEEP_BETWEEN_PRINTERS = 0.5
 CSV_ENCODING = "big5"
 
 
-def warmup_webapp() -> None:
-    """Check environment for URLs to warm up (e.g. after auto-update)."""
+def warmup_webapp() -> Optional[str]:
+    """
+    Check environment for URLs to warm up (e.g. after auto-update).
+    Returns the webapp's warm-up summary for update_logs, if it reported one.
+    """
     # Environment variable format:
     # WARMUP_URLS="http://webapp:5000/counts,http://webapp:5000/jobs"
-    # Or base URL: WEBAPP_URL="http://webapp:5000" (will append /counts, /jobs, /leaders)
+    # Or base URL: WEBAPP_URL="http://webapp:5000" (the webapp warms its most
+    # requested views itself, see view_popularity.py)
     
+    import requests
+
     urls = []
+    summary = None
     
     # Method 1: Explicit full URLs
     raw_urls = os.getenv("WARMUP_URLS")
@@ -675,13 +1218,20 @@ def warmup_webapp() -> None:
     # Method 2: Base URL (more convenient for K8s/Docker)
     base_url = os.getenv("WEBAPP_URL")
     if base_url:
-        base_url = base_url.rstrip("/")
-        urls.append(f"{base_url}/counts")
-        urls.append(f"{base_url}/jobs")
-        urls.append(f"{base_url}/leaders")
+        url = f"{base_url.rstrip('/')}/admin/warmup"
+        print(f"Triggering popularity warm-up at {url} ... ", end="", flush=True)
+        try:
+            resp = requests.post(
+                url, headers={"X-Admin-Token": os.getenv("ADMIN_TOKEN", "2851@9364")}, timeout=300
+            )
+            resp.raise_for_status()
+            summary = resp.json().get("message")
+            print(summary)
+        except Exception as e:
+            print(f"FAIL: {e}")
         
     if not urls:
-        return
+        return summary
 
     print(f"Triggering cache warmup for {len(urls)} endpoints...")
     timeout = 10 # short timeout for warmup
@@ -692,6 +1242,7 @@ def warmup_webapp() -> None:
             print("OK")
         except Exception as e:
             print(f"FAIL: {e}")
+    return summary
 
 
 CSV_ERRORS = "replace"
@@ -748,32 +1299,49 @@ def safe_int(value: Optional[str]) -> int:
             return 0
 
 
-def normalize_name(value: Optional[str], fallback: str = "未知") -> str:
-    if value is None:
-        return fallback
-    cleaned = value.strip()
-    return cleaned or fallback
-
-
 def normalize_key(value: Optional[str], fallback: str = "未知") -> str:
     return normalize_name(value, fallback).lower()
 
 
-def parse_time_value(value: Optional[str]) -> Optional[datetime]:
-    if not value:
+TIME_FORMATS = (
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M",
+    "%Y-%m-%d %H:%M",
+    "%Y/%m/%d %H:%M",
+    "%Y-%m-%d",
+)
+
+
+def _parse_fixed_width_time(cleaned: str) -> Optional[datetime]:
+    """
+    Fast path for the common 19-char shape `YYYY/MM/DD HH:MM:SS`
+    (also `YYYY-MM-DD HH:MM:SS` / `YYYY-MM-DDTHH:MM:SS`).
+    Returns None if the shape does not match.
+    """
+    if (
+        len(cleaned) != 19
+        or cleaned[4] not in "/-"
+        or cleaned[7] != cleaned[4]
+        or cleaned[10] not in (" T" if cleaned[4] == "-" else " ")
+        or cleaned[13] != ":"
+        or cleaned[16] != ":"
+    ):
         return None
-    cleaned = value.strip()
-    if not cleaned or cleaned.upper() == "N/A":
+    fields = (cleaned[0:4], cleaned[5:7], cleaned[8:10], cleaned[11:13], cleaned[14:16], cleaned[17:19])
+    # int() would also take " 1" or "+1", which strptime rejects
+    if not all(f.isascii() and f.isdigit() for f in fields):
         return None
-    for fmt in (
-        "%Y-%m-%dT%H:%M:%S",
-        "%Y-%m-%d %H:%M:%S",
-        "%Y/%m/%d %H:%M:%S",
-        "%Y-%m-%dT%H:%M",
-        "%Y-%m-%d %H:%M",
-        "%Y/%m/%d %H:%M",
-        "%Y-%m-%d",
-    ):
+    try:
+        return datetime(*map(int, fields))
+    except ValueError:
+        return None
+
+
+def _parse_time_value_slow(cleaned: str) -> Optional[datetime]:
+    """Try every known format in order (the original parse_time_value loop)."""
+    for fmt in TIME_FORMATS:
         try:
             return datetime.strptime(cleaned, fmt)
         except ValueError:
@@ -781,19 +1349,87 @@ def parse_time_value(value: Optional[str]) -> Optional[datetime]:
     return None
 
 
-def format_dt(value: Optional[datetime]) -> str:
-    return value.strftime("%Y-%m-%d %H:%M:%S") if value else "未知"
+def parse_time_value(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    cleaned = value.strip()
+    if not cleaned or cleaned.upper() == "N/A":
+        return None
+    return _parse_fixed_width_time(cleaned) or _parse_time_value_slow(cleaned)
 
 
-def resolve_printers(spec: Optional[str]) -> List[str]:
-    if not spec or spec.lower() == "all":
-        return PRINTERS
-    printers: List[str] = []
-    for part in spec.split(","):
-        part = part.strip()
-        if not part:
-            continue
-        if not part.startswith("http"):
+_MISSING = object()
+
+
+class TimestampParser:
+    """
+    Timestamp parser for a single source (one file / column / printer).
+
+    A given MFP firmware always emits the same format, so the format is learned
+    from the first non-empty value and reused; the fixed-width fast path handles
+    `YYYY/MM/DD HH:MM:SS`, and anything unexpected falls back to the full
+    TIME_FORMATS list. Repeated values are served from a bounded cache.
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self.fmt: Optional[str] = None
+        self.cache_size = cache_size
+        self._cache: Dict[str, Optional[datetime]] = {}
+
+    def _learn(self, cleaned: str) -> Optional[datetime]:
+        for fmt in TIME_FORMATS:
+            try:
+                parsed = datetime.strptime(cleaned, fmt)
+            except ValueError:
+                continue
+            self.fmt = fmt
+            return parsed
+        return None
+
+    def _parse_uncached(self, value: str) -> Optional[datetime]:
+        cleaned = value.strip()
+        if not cleaned or cleaned.upper() == "N/A":
+            return None
+        parsed = _parse_fixed_width_time(cleaned)
+        if parsed is not None:
+            return parsed
+        if self.fmt is None:
+            return self._learn(cleaned)
+        try:
+            return datetime.strptime(cleaned, self.fmt)
+        except ValueError:
+            return _parse_time_value_slow(cleaned)
+
+    def parse(self, value: Optional[str]) -> Optional[datetime]:
+        if not value:
+            return None
+        cached = self._cache.get(value, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        parsed = self._parse_uncached(value)
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[value] = parsed
+        return parsed
+
+    def parse_many(self, values: List[Optional[str]]) -> List[Optional[datetime]]:
+        parse = self.parse
+        return [parse(value) for value in values]
+
+
+def format_dt(value: Optional[datetime]) -> str:
+    return value.strftime("%Y-%m-%d %H:%M:%S") if value else "未知"
+
+
+def resolve_printers(spec: Optional[str]) -> List[str]:
+    if not spec or spec.lower() == "all":
+        return PRINTERS
+    printers: List[str] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.startswith("http"):
             part = f"http://{part}"
         printers.append(part.rstrip("/"))
     return printers or PRINTERS
@@ -805,6 +1441,9 @@ def resolve_printers(spec: Optional[str]) -> List[str]:
 
 # In-memory cache: key -> (mtime, data)
 _FILE_CACHE: Dict[str, Tuple[float, Any]] = {}
+metrics.register_callback(lambda: [
+    ("file_cache_entries", "gauge", "_FILE_CACHE current entries", [({}, len(_FILE_CACHE))]),
+])
 
 def _smart_load(path: Path, loader_func, cache_key_prefix: str = "") -> Any:
     key = f"{cache_key_prefix}:{path.absolute()}"
@@ -823,9 +1462,11 @@ def _smart_load(path: Path, loader_func, cache_key_prefix: str = "") -> Any:
     if cached:
         c_mtime, c_size, c_data = cached
         if c_mtime == mtime and c_size == size:
+            metrics.FILE_CACHE_REQUESTS.inc(result="hit")
             return c_data
 
     # Load and cache
+    metrics.FILE_CACHE_REQUESTS.inc(result="miss")
     data = loader_func(path)
     _FILE_CACHE[key] = (mtime, size, data)
     return data
@@ -845,6 +1486,8 @@ class SharpMFP:
         self.base = base.rstrip("/")
         self.username = username
         self.password = password
+        import requests
+
         self.s = requests.Session()
         self.s.headers.update({"User-Agent": "Mozilla/5.0"})
 
@@ -912,23 +1555,75 @@ class SharpMFP:
             params={"usernum": str(USERNUM), "del": str(USERCOUNT_DELETE_AFTER_SAVE)},
             timeout=TIMEOUT,
             allow_redirects=True,
+            stream=True,
         )
         r.raise_for_status()
 
         fn = out_dir / f"uc_{host_tag(self.base)}_{now_ts()}.csv"
-        fn.write_bytes(r.content)
+        save_stream(r, fn)
         return fn
 
     # ---------- Job Log ----------
-    def export_joblog(self, out_dir: Path) -> Path:
+    def export_joblog(self, out_dir: Path, since: Optional[datetime] = None) -> Path:
+        """since: only jobs from that date on (JOBLOG_RANGE_PARAMS), else the full log."""
+        ensure_dir(out_dir)
+        r, chunks = self._open_joblog_download(since=since)
+        fn = out_dir / f"joblog_{host_tag(self.base)}_{now_ts()}.csv"
+        save_stream(r, fn, chunks=chunks)
+        return fn
+
+    def stream_joblog(self, out_dir: Path, since: Optional[datetime] = None) -> Tuple[Path, int]:
+        """Download the job log straight into the DB (stream_joblog_to_db); returns (archive, rows)."""
+        ensure_dir(out_dir)
+        r, chunks = self._open_joblog_download(since=since)
+        fn = out_dir / f"joblog_{host_tag(self.base)}_{now_ts()}.csv"
+        with r:
+            count = stream_joblog_to_db(chunks, fn, self.base)
+        return fn, count
+
+    def drain_joblog(self, out_dir: Path) -> Path:
+        """
+        Export the job log with delAfterSave=1: the printer clears its log once
+        it has served this file. Only call after the previous export has been
+        verified in job_logs. The file is fsynced before returning, so the
+        jobs it holds exist on disk even if the ingest that follows fails.
+        """
+        ensure_dir(out_dir)
+        # Always the full log: it is what the printer deletes
+        r, chunks = self._open_joblog_download(delete_after_save=True)
+        # Same-second name as the preceding export must not overwrite it
+        fn = out_dir / f"joblog_{host_tag(self.base)}_{now_ts()}-drain.csv"
+        save_stream(r, fn, durable=True, chunks=chunks)
+        return fn
+
+    def _open_joblog_download(
+        self, delete_after_save: bool = False, since: Optional[datetime] = None
+    ) -> Tuple["requests.Response", Iterator[bytes]]:
+        """
+        Streamed job log download; returns (response, body chunks).
+        With `since`, asks for a date range first and falls back to the full
+        log when the firmware answers with anything but a job log CSV.
+        """
+        params = {**JOBLOG_DOWNLOAD_PARAMS, "delAfterSave": "1" if delete_after_save else "0"}
+        if since is not None and self.base not in _RANGE_UNSUPPORTED:
+            ranged = {k: v.format(start=since, end=datetime.now()) for k, v in JOBLOG_RANGE_PARAMS.items()}
+            r = self._request_joblog({**params, **ranged})
+            chunks = _joblog_csv_chunks(r)
+            if chunks is not None:
+                return r, chunks
+            r.close()
+            _RANGE_UNSUPPORTED.add(self.base)
+            print(f"{self.base}: 日期範圍匯出不被支援，改為完整匯出")
+        r = self._request_joblog(params)
+        return r, r.iter_content(STREAM_CHUNK_BYTES)
+
+    def _request_joblog(self, params: Dict[str, str]) -> "requests.Response":
         """
         Flow:
           GET  /sysmgt_joblog_save.html -> token1/token2
           POST /sysmgt_joblog_save.html action=jobsavebtn + checkbox options
-          GET  /joblog_download.html?...
+          GET  /joblog_download.html?...   (streamed, body not read yet)
         """
-        ensure_dir(out_dir)
-
         page = f"{self.base}/sysmgt_joblog_save.html"
         r = self.s.get(page, timeout=TIMEOUT, allow_redirects=True)
         r.raise_for_status()
@@ -952,12 +1647,94 @@ class SharpMFP:
         r = self.s.post(page, data=data, timeout=TIMEOUT, allow_redirects=True)
         r.raise_for_status()
         dl = f"{self.base}/joblog_download.html"
-        r = self.s.get(dl, params=JOBLOG_DOWNLOAD_PARAMS, timeout=TIMEOUT, allow_redirects=True)
+        r = self.s.get(dl, params=params, timeout=TIMEOUT, allow_redirects=True, stream=True)
         r.raise_for_status()
+        return r
 
-        fn = out_dir / f"joblog_{host_tag(self.base)}_{now_ts()}.csv"
-        fn.write_bytes(r.content)
-        return fn
+
+def _joblog_csv_chunks(resp: "requests.Response") -> Optional[Iterator[bytes]]:
+    """
+    Body chunks of a ranged export, or None if the firmware rejected it (error
+    status, an HTML page or a body without a job log header). The chunks read
+    to decide are replayed in front of the rest of the body.
+    """
+    if resp.status_code >= 400 or "html" in resp.headers.get("Content-Type", "").lower():
+        return None
+    body = resp.iter_content(STREAM_CHUNK_BYTES)
+    head = b""
+    for chunk in body:
+        head += chunk
+        if b"\n" in head or len(head) > STREAM_CHUNK_BYTES:
+            break
+    first_line = head.split(b"\n", 1)[0].decode(CSV_ENCODING, errors=CSV_ERRORS)
+    header = next(csv.reader([first_line]), [])
+    if all(i is None for i in _resolve_joblog_columns(header)["start"]):
+        return None
+    return itertools.chain([head], body)
+
+
+@db_helper
+def joblog_export_since(printer_addr: str) -> Optional[datetime]:
+    """Start of the next date-bounded export: newest ingested start_time minus the overlap (None: full export)."""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT MAX(start_time) AS latest FROM job_logs WHERE printer_addr = %s", (printer_addr,))
+            row = cursor.fetchone()
+    finally:
+        conn.close()
+    if not row or row["latest"] is None:
+        return None
+    return row["latest"] - timedelta(hours=JOBLOG_RANGE_OVERLAP_HOURS)
+
+
+def save_stream(
+    resp: "requests.Response", path: Path, durable: bool = False, chunks: Optional[Iterable[bytes]] = None
+) -> None:
+    """
+    Write a streamed response to path chunk by chunk (via .part, renamed when
+    complete). durable=True fsyncs the file and directory before returning.
+    chunks: the body when part of it was already read (default: resp.iter_content).
+    """
+    part_path = path.with_name(path.name + ".part")
+    try:
+        with resp, open(part_path, "wb") as fh:
+            for chunk in chunks if chunks is not None else resp.iter_content(STREAM_CHUNK_BYTES):
+                fh.write(chunk)
+            if durable:
+                fh.flush()
+                os.fsync(fh.fileno())
+        part_path.replace(path)
+        if durable and hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(path.parent, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+
+# 匯出檔名前綴 -> 類別 (uc_<tag>_<timestamp>.csv / joblog_<tag>_<timestamp>.csv)
+EXPORT_FILE_PREFIXES = {"uc": "usercount", "joblog": "joblog"}
+
+
+def split_export_filename(path: Path) -> Optional[Tuple[str, str, str]]:
+    """prefix_tag_timestamp.csv -> (prefix, tag, timestamp); None if the name has no tag."""
+    parts = path.stem.split("_")
+    if len(parts) < 3:
+        return None
+    # prefix is parts[0], timestamp is parts[-1], middle is tag
+    return parts[0], "_".join(parts[1:-1]), parts[-1]
+
+
+def printer_from_tag(tag: str) -> str:
+    """Reverse host_tag(): prefer a configured printer, else rebuild http://host[:port]."""
+    for base in list(PRINTERS) + list(PRINTER_ALIASES):
+        if host_tag(base) == tag:
+            return base
+    return f"http://{tag.replace('_', ':')}"
 
 
 def cleanup_old_exports() -> None:
@@ -976,12 +1753,10 @@ def cleanup_old_exports() -> None:
             if not p.is_file():
                 continue
             # extract tag: uc_<THIS_PART>_timestamp.csv
-            parts = p.stem.split("_")
-            if len(parts) < 3:
+            name_parts = split_export_filename(p)
+            if not name_parts:
                 continue
-            # prefix is parts[0], timestamp is parts[-1], middle is tag
-            tag = "_".join(parts[1:-1])
-            files_by_tag[tag].append(p)
+            files_by_tag[name_parts[1]].append(p)
 
         for tag, files in files_by_tag.items():
             # Sort by name (timestamp) desc
@@ -998,7 +1773,105 @@ def cleanup_old_exports() -> None:
                     except OSError as e:
                         print(f"  [ERR] {f.name}: {e}")
 
-def run_download_process(printers: Optional[List[str]] = None, trigger_source: str = "manual"):
+# Drained exports whose ingest could not be verified; retried on every run
+# and never touched by cleanup_old_exports (the printer no longer has them)
+DRAIN_PENDING_DIR = OUT_DIR / "joblog_pending"
+VERIFY_BATCH = 500
+
+
+@db_helper
+def verify_joblog_ingested(path: Path, printer_addr: str) -> int:
+    """
+    Number of the file's job log rows that are not in job_logs, matched on
+    the unique key (printer_addr, job_id, start_time). Rows without a start
+    time are never ingested and are not counted.
+    """
+    keys = {
+        (rec[0], rec[JOBLOG_START_INDEX])
+        for rec in _joblog_records_from_csv(path)
+        if rec[JOBLOG_START_INDEX]
+    }
+    if not keys:
+        return 0
+    keys_list = sorted(keys, key=lambda k: (k[1], k[0] or ""))
+    found = set()
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            for i in range(0, len(keys_list), VERIFY_BATCH):
+                chunk = keys_list[i:i + VERIFY_BATCH]
+                # <=> so rows with an empty job id still match
+                cond = " OR ".join(["(job_id <=> %s AND start_time = %s)"] * len(chunk))
+                params: List[Any] = [printer_addr]
+                for job_id, start in chunk:
+                    params.extend([job_id, start])
+                cursor.execute(
+                    f"SELECT job_id, start_time FROM job_logs WHERE printer_addr = %s AND ({cond})",
+                    params,
+                )
+                found.update((r["job_id"], r["start_time"]) for r in cursor.fetchall())
+    finally:
+        conn.close()
+    return len(keys - found)
+
+
+def _ingest_drained(path: Path, printer_addr: str) -> Tuple[int, int]:
+    """Ingest a drained export and verify it; (rows, missing)."""
+    count = sync_csv_to_db(path, printer_addr)
+    return count, verify_joblog_ingested(path, printer_addr)
+
+
+def _retry_pending_drains(jl_dir: Path):
+    """Re-ingest drained exports left over from runs whose verification failed."""
+    if not DRAIN_PENDING_DIR.exists():
+        return
+    for path in sorted(DRAIN_PENDING_DIR.glob("*.csv")):
+        parts = split_export_filename(path)
+        if not parts:
+            continue
+        printer_addr = printer_from_tag(parts[1])
+        try:
+            count, missing = _ingest_drained(path, printer_addr)
+        except Exception as e:
+            yield f"DRAIN    : 待補匯入 {path.name} 仍失敗: {e}"
+            continue
+        if missing:
+            yield f"DRAIN    : 待補匯入 {path.name} 仍有 {missing} 筆未確認"
+            continue
+        path.replace(jl_dir / path.name)
+        yield f"DRAIN    : 已補匯入 {path.name} ({count} rows)"
+
+
+def _drain_printer_joblog(client: "SharpMFP", jl: Path, base: str, jl_dir: Path):
+    """
+    Second phase of drain mode, after `jl` was ingested: confirm every row
+    of it is in job_logs, then export with delete-after-save and ingest that
+    final file too (it also carries the jobs printed in between).
+    """
+    missing = verify_joblog_ingested(jl, base)
+    if missing:
+        yield f"DRAIN    : 略過清除，{missing} 筆尚未確認寫入資料庫"
+        return
+    # No retry here: a retry after the printer already cleared its log
+    # would only return an empty file
+    drained = client.drain_joblog(jl_dir)
+    yield f"DRAIN    : 列印機紀錄已清除，最後匯出 {drained}"
+    try:
+        count, missing = _ingest_drained(drained, base)
+    except Exception as e:
+        count, missing = 0, -1
+        yield f"DRAIN    : 匯入失敗: {e}"
+    if missing:
+        ensure_dir(DRAIN_PENDING_DIR)
+        pending = drained.replace(DRAIN_PENDING_DIR / drained.name)
+        yield f"DRAIN    : 已保留 {pending}，下次更新時重新匯入"
+    else:
+        yield f"DRAIN    : Inserted/Ignored {count} rows (verified)"
+
+
+def run_download_process(
+    printers: Optional[List[str]] = None, trigger_source: str = "manual", drain: Optional[bool] = None, log_id: int = 0
+):
     # Ensure DB table exists
     init_db()
 
@@ -1009,39 +1882,87 @@ def run_download_process(printers: Optional[List[str]] = None, trigger_source: s
 
     selected = printers or PRINTERS
     errors = []
+    drain = JOBLOG_DRAIN if drain is None else drain
+    failed: Set[str] = set()
+    phase_totals = metrics.COLLECTOR_PHASE_DURATION.totals()
+    yield from _retry_pending_drains(jl_dir)
     for base in selected:
         yield f"== {base} =="
         client = SharpMFP(base, USERNAME, PASSWORD)
 
+        phase = functools.partial(metrics.timed, metrics.COLLECTOR_PHASE_DURATION, printer=base)
         try:
-            request_with_retry(client.login)
-            uc = request_with_retry(client.export_user_count, uc_dir)
+            with phase(phase="login"):
+                request_with_retry(client.login)
+            with phase(phase="download_usercount"):
+                uc = request_with_retry(client.export_user_count, uc_dir)
             yield f"OK UC    : {uc}"
             
             # Sync User Count to DB
             if uc:
-                uc_count = sync_usercount_to_db(uc, base)
+                with phase(phase="ingest_usercount"):
+                    uc_count = sync_usercount_to_db(uc, base)
                 yield f"DB Sync UC: Inserted {uc_count} rows"
 
-            jl = request_with_retry(client.export_joblog, jl_dir)
-            yield f"OK JOBLOG: {jl}"
-            
-            # Sync to DB
-            if jl:
-                count = sync_csv_to_db(jl, base)
+            since = joblog_export_since(base) if JOBLOG_RANGE_EXPORT else None
+            if since is not None:
+                yield f"JOBLOG   : 匯出 {format_dt(since)} 起的紀錄"
+            if STREAM_INGEST:
+                # Download and ingest overlap; the CSV is archived as it arrives
+                with phase(phase="stream_joblog"):
+                    jl, count = request_with_retry(client.stream_joblog, jl_dir, since)
+                yield f"OK JOBLOG: {jl}"
                 yield f"DB Sync  : Inserted/Ignored {count} rows"
+            else:
+                with phase(phase="download_joblog"):
+                    jl = request_with_retry(client.export_joblog, jl_dir, since)
+                yield f"OK JOBLOG: {jl}"
+
+                # Sync to DB
+                if jl:
+                    with phase(phase="ingest_joblog"):
+                        count = sync_csv_to_db(jl, base)
+                    yield f"DB Sync  : Inserted/Ignored {count} rows"
+
+            if drain and jl:
+                with phase(phase="drain_joblog"):
+                    yield from _drain_printer_joblog(client, jl, base, jl_dir)
 
         except Exception as e:
+            metrics.COLLECTOR_FAILURES.inc(printer=base)
+            failed.add(base)
             err_msg = f"{base}: {e}"
             errors.append(err_msg)
             yield f"FAIL: {e}"
 
         time.sleep(SLEEP_BETWEEN_PRINTERS)
-    
-    
+
+    if log_id:
+        # The CronJob's registry is gone when it exits; the webapp's /metrics
+        # exports the latest run's timings from the database instead
+        timings = metrics.histogram_delta(phase_totals, metrics.COLLECTOR_PHASE_DURATION.totals())
+        try:
+            save_collector_timings(log_id, timings, failed)
+        except Exception as e:
+            yield f"Collector timings not saved: {e}"
+
     # Run cleanup after all downloads
     cleanup_old_exports()
 
+    # New rows are only searchable through the index once it catches up;
+    # until then keyword filters fall back to LIKE
+    try:
+        indexed = update_search_index()
+        yield f"Search index: {indexed['rows']} rows / {indexed['values']} new values"
+    except Exception as e:
+        yield f"Search index update failed: {e}"
+
+    if count_store.COUNT_SKETCHES:
+        try:
+            yield f"Count sketches: {refresh_count_sketches()} day/printer rows"
+        except Exception as e:
+            yield f"Count sketch refresh failed: {e}"
+
     # Log overall result
     if errors:
         msg = "部分更新失敗: " + "; ".join(errors)
@@ -1051,23 +1972,268 @@ def run_download_process(printers: Optional[List[str]] = None, trigger_source: s
         # success_msg = "自動更新成功" if trigger_source == "auto" else "手動更新成功"
         # log_update(True, success_msg, trigger_source)
         yield "LOG: 更新記錄已寫入資料庫"
-        
-        # Trigger external warmup if configured (for K8s CronJob)
-        # We assume run_download_process is a generator, so we just perform the action
-        # wrapping it in a trivial yield or just run it (it prints to stdout usually)
-        # But wait, we are inside a generator. Printing goes to stdout? 
-        # Yes. If called by CLI, it prints. If called by Web, it might be lost or captured?
-        # Webapp consumes generator. If we print, it goes to server console.
-        # Ideally we should yield a log message about it.
-        warmup_webapp()
-        yield "LOG: 執行緩存預熱 (若有配置)"
-
-
-def download_exports(printers: Optional[List[str]] = None, trigger_source: str = "manual") -> None:
-    for msg in run_download_process(printers, trigger_source):
+        # External warmup (K8s CronJob) is triggered by cmd_download once the
+        # update log is closed; warming before that would cache the old generation.
+
+
+def download_exports(
+    printers: Optional[List[str]] = None, trigger_source: str = "manual", drain: Optional[bool] = None, log_id: int = 0
+) -> None:
+    for msg in run_download_process(printers, trigger_source, drain, log_id):
         print(msg)
 
 
+@db_helper
+def save_collector_timings(log_id: int, timings: Dict[metrics.LabelKey, Tuple[float, float]], failed: Set[str]) -> int:
+    """Store one run's per-printer phase timings ({(printer, phase) labels: (seconds, calls)}) under its update log."""
+    rows = []
+    for key, (seconds, calls) in timings.items():
+        labels = dict(key)
+        rows.append((log_id, labels["printer"], labels["phase"], seconds, int(calls), int(labels["printer"] in failed)))
+    if not rows:
+        return 0
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.executemany(
+                "REPLACE INTO collector_phase_timings (log_id, printer_addr, phase, seconds, calls, failed) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                rows,
+            )
+        return len(rows)
+    finally:
+        conn.close()
+
+
+@db_helper
+def fetch_latest_collector_timings() -> List[Dict[str, Any]]:
+    """Phase timings of the latest run that saved any, with its trigger source and end time."""
+    conn = get_db_connection(read_only=True)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT t.printer_addr, t.phase, t.seconds, t.failed, l.trigger_source,
+                       UNIX_TIMESTAMP(COALESCE(l.end_time, l.start_time)) AS run_ts
+                FROM collector_phase_timings t
+                JOIN update_logs l ON l.id = t.log_id
+                WHERE t.log_id = (SELECT MAX(log_id) FROM collector_phase_timings)
+                """
+            )
+            return list(cursor.fetchall())
+    finally:
+        conn.close()
+
+
+def collector_run_families(rows: List[Dict[str, Any]]) -> List[metrics.CallbackFamily]:
+    """Metric families for fetch_latest_collector_timings() rows."""
+    if not rows:
+        return []
+    phases = [({"printer": r["printer_addr"], "phase": r["phase"]}, float(r["seconds"])) for r in rows]
+    failed = {r["printer_addr"]: float(r["failed"]) for r in rows}
+    return [
+        (
+            "collector_last_run_phase_seconds", "gauge",
+            "Per-printer phase duration of the latest collector run (scheduled or manual)", phases,
+        ),
+        (
+            "collector_last_run_failed", "gauge", "1 if the printer failed in the latest collector run",
+            [({"printer": printer}, value) for printer, value in failed.items()],
+        ),
+        (
+            "collector_last_run_timestamp_seconds", "gauge", "End time of the latest collector run",
+            [({"source": rows[0]["trigger_source"]}, float(rows[0]["run_ts"] or 0))],
+        ),
+    ]
+
+
+# Refetched once per ingestion generation: a run's timings land just before its log closes
+_COLLECTOR_RUN_CACHE: Dict[str, Any] = {"generation": None, "families": []}
+
+
+def _latest_collector_run_families() -> List[metrics.CallbackFamily]:
+    generation, _ = get_ingestion_generation()
+    if generation and _COLLECTOR_RUN_CACHE["generation"] == generation:
+        return _COLLECTOR_RUN_CACHE["families"]
+    families = collector_run_families(fetch_latest_collector_timings())
+    _COLLECTOR_RUN_CACHE["generation"] = generation or None
+    _COLLECTOR_RUN_CACHE["families"] = families
+    return families
+
+
+metrics.register_callback(_latest_collector_run_families)
+
+
+IMPORT_STATE_FILE = OUT_DIR / ".import_state.json"
+
+
+def _expand_import_sources(sources: List[str]) -> List[Path]:
+    """Directories (recursive *.csv), glob patterns or plain files -> unique CSV paths."""
+    found: Dict[str, Path] = {}
+    for src in sources:
+        p = Path(src)
+        if p.is_dir():
+            candidates = list(p.rglob("*.csv"))
+        elif glob.has_magic(src):
+            candidates = [Path(x) for x in glob.glob(src, recursive=True)]
+        else:
+            candidates = [p]
+        for c in candidates:
+            if c.is_file():
+                found.setdefault(str(c.resolve()), c)
+    return sorted(found.values(), key=lambda x: x.name)
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _classify_export(path: Path, kind: Optional[str], printer: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Infer (kind, printer) from the filename / parent directory, CLI values win."""
+    name_parts = split_export_filename(path)
+    if not kind:
+        if name_parts and name_parts[0] in EXPORT_FILE_PREFIXES:
+            kind = EXPORT_FILE_PREFIXES[name_parts[0]]
+        elif path.parent.name in EXPORT_FILE_PREFIXES.values():
+            kind = path.parent.name
+    if not printer and name_parts and name_parts[0] in EXPORT_FILE_PREFIXES:
+        printer = printer_from_tag(name_parts[1])
+    return kind, printer
+
+
+def _load_import_state(state_path: Path) -> Dict[str, Any]:
+    try:
+        with open(state_path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_import_state(state_path: Path, state: Dict[str, Any]) -> None:
+    ensure_dir(state_path.parent)
+    tmp = state_path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh, ensure_ascii=False, indent=1)
+    os.replace(tmp, state_path)
+
+
+def import_exports(
+    sources: List[str],
+    kind: Optional[str] = None,
+    printer: Optional[str] = None,
+    workers: int = 4,
+    bulk: bool = False,
+    state_path: Optional[Path] = None,
+    restart: bool = False,
+) -> Dict[str, int]:
+    """
+    Import historical export CSVs (job log / user count) into the DB.
+
+    - printer is inferred from the host_tag part of the filename
+    - files with identical content are imported once; user count snapshots
+      are unique per (printer, timestamp), also against user_counts;
+      overlapping job log rows are merged by the upsert
+    - files run on a bounded worker pool; job logs of one printer are
+      written one at a time to avoid upsert lock contention
+    - finished files are recorded in a state file so an interrupted run resumes
+    """
+    state_path = state_path or IMPORT_STATE_FILE
+    state = {} if restart else _load_import_state(state_path)
+    done: Dict[str, Any] = state.setdefault("done", {})
+
+    stats = {"files": 0, "imported": 0, "rows": 0, "skipped": 0, "duplicate": 0, "failed": 0}
+    tasks: List[Tuple[Path, str, str, str]] = []
+    seen_digests = set()
+    seen_snapshots = set()
+
+    for path in _expand_import_sources(sources):
+        stats["files"] += 1
+        file_kind, file_printer = _classify_export(path, kind, printer)
+        if file_kind not in ("joblog", "usercount") or not file_printer:
+            print(f"[SKIP] {path}: 無法判斷類別或列印機 (請用 --kind / --printer 指定)")
+            stats["skipped"] += 1
+            continue
+
+        digest = _file_digest(path)
+        if digest in done:
+            stats["skipped"] += 1
+            continue
+        if digest in seen_digests:
+            print(f"[DUP ] {path.name}: 內容與其他檔案相同")
+            stats["duplicate"] += 1
+            continue
+        if file_kind == "usercount":
+            snapshot = (file_printer, path.stem.split("_")[-1])
+            if snapshot in seen_snapshots:
+                print(f"[DUP ] {path.name}: 同一快照時間已匯入")
+                stats["duplicate"] += 1
+                continue
+            seen_snapshots.add(snapshot)
+        seen_digests.add(digest)
+        tasks.append((path, file_kind, file_printer, digest))
+
+    total = len(tasks)
+    print(f"待匯入 {total} 個檔案 (已完成/略過 {stats['skipped']}，重複 {stats['duplicate']})")
+    if not total:
+        return stats
+
+    state_lock = threading.Lock()
+    printer_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+    def run(task: Tuple[Path, str, str, str]) -> int:
+        path, file_kind, file_printer, _ = task
+        if file_kind == "usercount":
+            return sync_usercount_to_db(path, file_printer)
+        with printer_locks[file_printer]:
+            return sync_csv_to_db(path, file_printer, bulk=bulk)
+
+    finished = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(run, task): task for task in tasks}
+        for future in as_completed(futures):
+            path, file_kind, file_printer, digest = futures[future]
+            finished += 1
+            try:
+                rows = future.result()
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"[{finished}/{total}] FAIL {file_kind} {path.name}: {e}")
+                continue
+
+            stats["imported"] += 1
+            stats["rows"] += rows or 0
+            print(f"[{finished}/{total}] OK   {file_kind} {host_tag(file_printer)} {path.name}: {rows} rows")
+            with state_lock:
+                done[digest] = {
+                    "path": str(path),
+                    "kind": file_kind,
+                    "printer": file_printer,
+                    "rows": rows,
+                    "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                }
+                _save_import_state(state_path, state)
+
+    if stats["imported"]:
+        try:
+            indexed = update_search_index()
+            print(f"搜尋索引已更新: {indexed['rows']} 筆，新增 {indexed['values']} 個關鍵值")
+        except Exception as e:
+            print(f"搜尋索引更新失敗 (可稍後執行 reindex-search): {e}")
+        if count_store.COUNT_SKETCHES:
+            # Imported history can land on any day
+            try:
+                print(f"計數草圖已重建: {refresh_count_sketches(None)} 筆")
+            except Exception as e:
+                print(f"計數草圖更新失敗 (可稍後執行 sketch-counts --all): {e}")
+
+    return stats
+
+
+@db_helper
 def fetch_job_logs(
     printer_addr: Optional[str] = None,
     user_kw: Optional[str] = None,
@@ -1075,75 +2241,55 @@ def fetch_job_logs(
     computer_kw: Optional[str] = None,
     start_dt: Optional[datetime] = None,
     end_dt: Optional[datetime] = None
-) -> List[Dict[str, Any]]:
+) -> List[JobRecord]:
     """Query job logs from MySQL"""
-    conn = get_db_connection()
-    rows = []
-    try:
-        with conn.cursor() as cursor:
-            sql = "SELECT * FROM job_logs WHERE 1=1"
-            params = []
-            
-            if printer_addr and printer_addr != 'all':
-                sql += " AND printer_addr = %s"
-                params.append(printer_addr)
-            
-            if user_kw:
-                # user_name OR login_name
-                sql += " AND (user_name LIKE %s OR login_name LIKE %s)"
-                kw = f"%{user_kw}%"
-                params.extend([kw, kw])
-                
-            if mode_kw:
-                sql += " AND mode LIKE %s"
-                params.append(f"%{mode_kw}%")
-                
-            if computer_kw:
-                sql += " AND computer_name LIKE %s"
-                params.append(f"%{computer_kw}%")
-                
-            if start_dt:
-                sql += " AND start_time >= %s"
-                params.append(start_dt)
-            
-            if end_dt:
-                sql += " AND start_time <= %s"
-                params.append(end_dt)
-            
-            # Order by start_time DESC
-            sql += " ORDER BY start_time DESC"
-            
-            cursor.execute(sql, params)
-            rows = cursor.fetchall()
-    finally:
-        conn.close()
-        
-    # Convert to format expected by webapp (shim)
-    results = []
-    for r in rows:
-        user_name = r['user_name'] or ""
-        login_name = r['login_name'] or "N/A"
-        results.append({
-            "job_id": r['job_id'],
-            "account_job_id": r['account_job_id'],
-            "mode": r['mode'],
-            "computer": r['computer_name'],
-            "user": user_name,
-            "login": login_name,
-            "start": r['start_time'],
-            "end": r['end_time'],
-            "bw": r['bw_pages'],
-            "color": r['color_pages'],
-            # calculated fields
-            "pages": r['total_pages'],
-            "user_display": normalize_name(user_name, "未知"),
-            "user_key": normalize_name(user_name, "未知").lower(),
-            "login_display": normalize_name(login_name, "N/A"),
-            "login_key": normalize_name(login_name, "N/A").lower(),
-            # for grouping if needed
-            "printer": r['printer_addr']
-        })
-    return results
+    return list(iter_job_logs(printer_addr, user_kw, mode_kw, computer_kw, start_dt, end_dt))
+
+
+def iter_job_logs(
+    printer_addr: Optional[str] = None,
+    user_kw: Optional[str] = None,
+    mode_kw: Optional[str] = None,
+    computer_kw: Optional[str] = None,
+    start_dt: Optional[datetime] = None,
+    end_dt: Optional[datetime] = None
+) -> Iterator[JobRecord]:
+    """
+    Matching job logs, newest first, streamed from a server-side cursor and
+    converted one row at a time: memory stays flat however wide the window.
+    """
+    sql = "SELECT * FROM job_logs WHERE 1=1"
+    params: List[Any] = []
+
+    if printer_addr and printer_addr != 'all':
+        sql += " AND printer_addr = %s"
+        params.append(printer_addr)
+
+    if user_kw:
+        # user_name OR login_name
+        sql += " AND (user_name LIKE %s OR login_name LIKE %s)"
+        kw = f"%{user_kw}%"
+        params.extend([kw, kw])
+
+    if mode_kw:
+        sql += " AND mode LIKE %s"
+        params.append(f"%{mode_kw}%")
+
+    if computer_kw:
+        sql += " AND computer_name LIKE %s"
+        params.append(f"%{computer_kw}%")
+
+    if start_dt:
+        sql += " AND start_time >= %s"
+        params.append(start_dt)
+
+    if end_dt:
+        sql += " AND start_time <= %s"
+        params.append(end_dt)
+
+    # Order by start_time DESC
+    sql += " ORDER BY start_time DESC"
+    return _stream_job_logs(_open_job_log_stream(lambda cursor: (sql, params), "fetch_job_logs"))
 
 
 def parse_cli_time(value: Optional[str]) -> Optional[datetime]:
@@ -1254,37 +2400,169 @@ def cmd_counts(args: argparse.Namespace) -> None:
 
 
 
-def _joblog_entries_from_csv_raw(path: Path) -> List[Dict[str, Any]]:
-    entries: List[Dict[str, Any]] = []
+# Job log CSV 欄位對應：每個欄位的候選標題 (中文優先，英文備用)
+JOBLOG_COLUMN_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "job_id": ("工作ID", "Job ID"),
+    "account_job_id": ("帳戶工作ID", "Account Job ID"),
+    "mode": ("工作模式", "Job Mode", "Mode"),
+    "computer": ("電腦名稱", "Computer Name"),
+    "user": ("用戶名稱", "User Name"),
+    "login": ("登入名稱", "Login Name"),
+    "start": ("開始日期", "Start Date"),
+    "end": ("完成日期", "Completion Date"),
+    "bw": ("黑白總張數",),
+    "color": ("全彩總張數",),
+    "file_name": ("檔案名稱",),
+    "scan_type": ("傳送類型",),
+    "destination": ("直接位址",),
+}
+
+# Field order of the compact records (matches the job_logs INSERT column order)
+JOBLOG_RECORD_FIELDS = (
+    "job_id", "account_job_id", "mode", "user", "login", "computer",
+    "start", "end", "bw", "color", "pages", "file_name", "scan_type", "destination",
+)
+JOBLOG_START_INDEX = JOBLOG_RECORD_FIELDS.index("start")
+
+
+def _resolve_joblog_columns(header: List[str]) -> Dict[str, List[Optional[int]]]:
+    """
+    Map each job log field to the header index of each of its aliases, in alias
+    order, None where the header lacks that alias (resolved once per file).
+    """
+    # Duplicate header names: the last one wins, same as csv.DictReader
+    positions = {name: i for i, name in enumerate(header)}
+    return {field: [positions.get(alias) for alias in aliases] for field, aliases in JOBLOG_COLUMN_ALIASES.items()}
+
+
+def _extract_column(rows: List[List[str]], indices: List[Optional[int]], coalesce: bool) -> List[Optional[str]]:
+    """
+    Pull one logical column out of the raw rows.
+    coalesce=True mimics `row.get(a) or row.get(b)`: the first non-empty cell,
+    else whatever the last alias holds ("" or None, None if the header lacks it).
+    """
+    present = [i for i in indices if i is not None]
+    if not present:
+        return [None] * len(rows)
+    columns = [[row[i] if i < len(row) else None for row in rows] for i in present]
+    if not coalesce:
+        return columns[0]
+    last_present = indices[-1] is not None
+    if len(columns) == 1:
+        return columns[0] if last_present else [value or None for value in columns[0]]
+    if last_present:
+        return [next((value for value in values if value), values[-1]) for values in zip(*columns)]
+    return [next((value for value in values if value), None) for values in zip(*columns)]
+
+
+def _int_column(values: List[Optional[str]]) -> List[int]:
+    converted: List[int] = []
+    append = converted.append
+    for value in values:
+        try:
+            append(int(value))
+        except (TypeError, ValueError):
+            # "1,234", "N/A", "", None ... 交給 safe_int 處理
+            append(safe_int(value))
+    return converted
+
+
+def _joblog_derived_columns(printer_addr: str, records: List[tuple]) -> List[Tuple[Any, ...]]:
+    """
+    Values computed at ingest, appended to each record:
+    (printer_id, mode_id, user_id, computer_id, mode_kind).
+    """
+    mode_i, user_i, login_i, computer_i = (
+        JOBLOG_RECORD_FIELDS.index(f) for f in ("mode", "user", "login", "computer")
+    )
+    printer_id = DIMENSION_CACHE.ids("printer", [(printer_addr,)])[(printer_addr,)]
+    modes = DIMENSION_CACHE.ids("mode", {(r[mode_i],) for r in records})
+    users = DIMENSION_CACHE.ids("user", {(r[user_i], r[login_i]) for r in records})
+    computers = DIMENSION_CACHE.ids("computer", {(r[computer_i],) for r in records})
+    # A log only has a handful of distinct mode strings
+    kinds = {mode: determine_mode_kind(mode) for (mode,) in modes}
+    return [
+        (
+            printer_id, modes[(r[mode_i],)], users[(r[user_i], r[login_i])], computers[(r[computer_i],)],
+            kinds[r[mode_i]],
+        )
+        for r in records
+    ]
+
+
+def _joblog_records_from_csv(path: Path) -> List[Tuple[Any, ...]]:
+    """
+    Columnar job log parser.
+    Resolves the header mapping once per file, learns each timestamp column's format
+    once (TimestampParser), converts the page/time columns in bulk and returns
+    compact tuples ordered as JOBLOG_RECORD_FIELDS.
+    """
+    with open(path, encoding=CSV_ENCODING, errors=CSV_ERRORS, newline="") as fh:
+        reader = csv.reader(fh)
+        header = next(reader, None)
+        if not header:
+            return []
+        rows = [row for row in reader if row]
+
+    if not rows:
+        return []
+    return _joblog_records_from_rows(_resolve_joblog_columns(header), rows)
+
+
+def _joblog_records_from_rows(
+    columns: Dict[str, List[Optional[int]]],
+    rows: List[List[str]],
+    time_parsers: Optional[Tuple["TimestampParser", "TimestampParser"]] = None,
+) -> List[Tuple[Any, ...]]:
+    # time_parsers: (start, end) kept across the batches of one streamed file,
+    # so each column's format is still learned only once
+    start_parser, end_parser = time_parsers or (TimestampParser(), TimestampParser())
+    bw = _int_column(_extract_column(rows, columns["bw"], coalesce=False))
+    color = _int_column(_extract_column(rows, columns["color"], coalesce=False))
+    pages = [b + c for b, c in zip(bw, color)]
+
+    return list(zip(
+        _extract_column(rows, columns["job_id"], coalesce=True),
+        _extract_column(rows, columns["account_job_id"], coalesce=True),
+        _extract_column(rows, columns["mode"], coalesce=True),
+        _extract_column(rows, columns["user"], coalesce=True),
+        _extract_column(rows, columns["login"], coalesce=True),
+        _extract_column(rows, columns["computer"], coalesce=True),
+        start_parser.parse_many(_extract_column(rows, columns["start"], coalesce=True)),
+        end_parser.parse_many(_extract_column(rows, columns["end"], coalesce=True)),
+        bw,
+        color,
+        pages,
+        _extract_column(rows, columns["file_name"], coalesce=False),
+        _extract_column(rows, columns["scan_type"], coalesce=False),
+        _extract_column(rows, columns["destination"], coalesce=False),
+    ))
+
+
+def _joblog_entries_from_csv_raw(path: Path) -> List[JobRecord]:
+    entries: List[JobRecord] = []
+    start_parser = TimestampParser()
+    end_parser = TimestampParser()
     for row in read_csv_rows(path):
-        user_display = normalize_name(row.get("用戶名稱"), "未知")
-        login_display = normalize_name(row.get("登入名稱"), "N/A")
-        entry = {
-            "job_id": row.get("工作ID") or row.get("Job ID"),
-            "account_job_id": row.get("帳戶工作ID") or row.get("Account Job ID"),
-            "mode": row.get("工作模式") or row.get("Job Mode") or row.get("Mode"),
-            "computer": row.get("電腦名稱") or row.get("Computer Name"),
-            "user": row.get("用戶名稱") or row.get("User Name"),
-            "login": row.get("登入名稱") or row.get("Login Name"),
-            "start": parse_time_value(row.get("開始日期") or row.get("Start Date")),
-            "end": parse_time_value(row.get("完成日期") or row.get("Completion Date")),
-            "bw": safe_int(row.get("黑白總張數")),
-            "color": safe_int(row.get("全彩總張數")),
-            "file_name": row.get("檔案名稱"),
-            "scan_type": row.get("傳送類型"),
-            "destination": row.get("直接位址"),
-        }
-        entry["pages"] = entry["bw"] + entry["color"]
-        entry["user_display"] = user_display
-        entry["user_key"] = user_display.lower()
-        entry["login_display"] = login_display
-        entry["login_key"] = login_display.lower()
-        entries.append(entry)
+        entries.append(JobRecord(
+            job_id=row.get("工作ID") or row.get("Job ID"),
+            account_job_id=row.get("帳戶工作ID") or row.get("Account Job ID"),
+            mode=row.get("工作模式") or row.get("Job Mode") or row.get("Mode"),
+            computer=row.get("電腦名稱") or row.get("Computer Name"),
+            user=row.get("用戶名稱") or row.get("User Name"),
+            login=row.get("登入名稱") or row.get("Login Name"),
+            start=start_parser.parse(row.get("開始日期") or row.get("Start Date")),
+            end=end_parser.parse(row.get("完成日期") or row.get("Completion Date")),
+            bw=safe_int(row.get("黑白總張數")),
+            color=safe_int(row.get("全彩總張數")),
+            file_name=row.get("檔案名稱"),
+            scan_type=row.get("傳送類型"),
+            destination=row.get("直接位址"),
+        ))
     return entries
 
 
 
-
 def aggregate_joblog_reports(reports: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
     if not reports:
         return None
@@ -1299,6 +2577,16 @@ def aggregate_joblog_reports(reports: List[Dict[str, Any]]) -> Optional[Dict[str
         totals["color"] += rt.get("color", 0)
         totals["pages"] += rt.get("pages", 0)
 
+        if "user_stats" in report:
+            # Per-user totals from _aggregate_entries_to_report (entries may not be kept)
+            for key, data in report["user_stats"].items():
+                merged = user_stats[key]
+                for field in ("jobs", "bw", "color", "pages"):
+                    merged[field] += data[field]
+                merged["user"] = data["user"]
+                merged["login"] = data["login"]
+            continue
+
         for entry in report.get("entries", []):
             key = (entry.get("user_key"), entry.get("login_key"))
             user_stats[key]["jobs"] += 1
@@ -1323,21 +2611,39 @@ def aggregate_joblog_reports(reports: List[Dict[str, Any]]) -> Optional[Dict[str
     return {"totals": totals, "users": users}
 
 
-def _aggregate_entries_to_report(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
-    total_jobs = len(entries)
-    total_bw = sum(entry["bw"] for entry in entries)
-    total_color = sum(entry["color"] for entry in entries)
-    total_pages = sum(entry["pages"] for entry in entries)
+def _aggregate_entries_to_report(
+    entries: Iterable[JobRecord],
+    keep_entries: bool = True,
+    recent_limit: Optional[int] = None,
+    rescan: Optional[Iterable[JobRecord]] = None,
+) -> Dict[str, Any]:
+    """
+    One pass over entries, a list or a stream ordered by start_time DESC.
+
+    keep_entries=False holds only the per-user totals and the first
+    recent_limit rows, so a stream of any size aggregates in bounded memory.
+    "recent" is then those rows, or `rescan` (an iterable that streams the
+    rows again) when recent_limit is None.
+    """
+    kept: List[Dict[str, Any]] = []
+    totals = {"jobs": 0, "bw": 0, "color": 0, "pages": 0}
 
     pstats = defaultdict(lambda: {"jobs": 0, "bw": 0, "color": 0, "pages": 0, "user": "", "login": ""})
     for entry in entries:
-        key = (entry.get("user_key"), entry.get("login_key"))
-        pstats[key]["jobs"] += 1
-        pstats[key]["bw"] += entry["bw"]
-        pstats[key]["color"] += entry["color"]
-        pstats[key]["pages"] += entry["pages"]
-        pstats[key]["user"] = entry.get("user_display") or normalize_name(entry.get("user"))
-        pstats[key]["login"] = entry.get("login_display") or normalize_name(entry.get("login"), "N/A")
+        totals["jobs"] += 1
+        totals["bw"] += entry.bw
+        totals["color"] += entry.color
+        totals["pages"] += entry.pages
+        if keep_entries or (recent_limit is not None and len(kept) < recent_limit):
+            kept.append(entry)
+
+        stats = pstats[(entry.user_key, entry.login_key)]
+        stats["jobs"] += 1
+        stats["bw"] += entry.bw
+        stats["color"] += entry.color
+        stats["pages"] += entry.pages
+        stats["user"] = entry.user_display
+        stats["login"] = entry.login_display
 
     top_users = [
         {
@@ -1351,21 +2657,32 @@ def _aggregate_entries_to_report(entries: List[Dict[str, Any]]) -> Dict[str, Any
         for data in sorted(pstats.values(), key=lambda item: (item["pages"], item["jobs"]), reverse=True)
     ]
 
-    recent = sorted(entries, key=lambda entry: entry.get("start") or datetime.min, reverse=True)
+    if keep_entries:
+        recent = sorted(kept, key=lambda entry: entry.get("start") or datetime.min, reverse=True)
+        if recent_limit is not None:
+            recent = recent[:recent_limit]
+    elif recent_limit is None and rescan is not None:
+        recent = rescan
+    else:
+        recent = kept
 
     return {
-        "entries": entries,
+        "entries": kept if keep_entries else [],
         "top_users": top_users,
+        "user_stats": dict(pstats),
         "recent": recent,
-        "totals": {
-            "jobs": total_jobs,
-            "bw": total_bw,
-            "color": total_color,
-            "pages": total_pages,
-        },
+        "totals": totals,
     }
 
 
+class _JobLogRescan:
+    """Re-iterable iter_job_logs(...): each iteration streams the rows again."""
+
+    def __init__(self, *args: Any):
+        self.args = args
+
+    def __iter__(self) -> Iterator[JobRecord]:
+        return iter_job_logs(*self.args)
 
 
 def load_joblog_report(
@@ -1375,15 +2692,21 @@ def load_joblog_report(
     computer_kw: Optional[str],
     start_dt: Optional[datetime],
     end_dt: Optional[datetime],
+    keep_entries: bool = True,
+    recent_limit: Optional[int] = None,
 ) -> Optional[Dict[str, Any]]:
-    # New DB-based implementation
-    # 1. Fetch from DB
-    entries = fetch_job_logs(printer, user_kw, mode_kw, computer_kw, start_dt, end_dt)
-    
-    # 2. Aggregate
-    report = _aggregate_entries_to_report(entries)
-    
-    # 3. Add metadata
+    # keep_entries=False: stream the rows (bounded memory) and keep only the
+    # per-user totals plus recent_limit recent rows; recent_limit=None then
+    # re-streams all rows when "recent" is iterated
+    filters = (printer, user_kw, mode_kw, computer_kw, start_dt, end_dt)
+    if keep_entries:
+        report = _aggregate_entries_to_report(fetch_job_logs(*filters), recent_limit=recent_limit)
+    else:
+        report = _aggregate_entries_to_report(
+            iter_job_logs(*filters), keep_entries=False, recent_limit=recent_limit,
+            rescan=_JobLogRescan(*filters),
+        )
+
     report["printer"] = printer
     report["file_path"] = Path("MySQL_DB") 
     return report
@@ -1392,7 +2715,7 @@ def load_joblog_report(
 def print_joblog_report(report: Dict[str, Any], limit: int, top: int) -> None:
     file_path = report["file_path"]
     print(f"使用檔案: {file_path.name}")
-    if not report["entries"]:
+    if not report["totals"]["jobs"]:
         print("找不到符合條件的紀錄。")
         return
 
@@ -1412,10 +2735,10 @@ def print_joblog_report(report: Dict[str, Any], limit: int, top: int) -> None:
             f"- {user}{login_part}: {data['jobs']} 筆, {data['pages']} 張 (黑白 {data['bw']} / 彩色 {data['color']})"
         )
 
+    # "recent" may be a stream (load_joblog_report(keep_entries=False))
     recent = report["recent"]
-    max_rows = len(recent) if limit <= 0 else min(limit, len(recent))
     print("最新紀錄：")
-    for entry in recent[:max_rows]:
+    for entry in (recent if limit <= 0 else itertools.islice(recent, limit)):
         job_id = entry.get("job_id") or entry.get("account_job_id") or "?"
         user = entry.get("user") or "未知"
         login = entry.get("login") or "N/A"
@@ -1504,6 +2827,223 @@ def aggregate_usage_by_categories(
     return stats
 
 
+# Same rule as determine_mode_kind(), for backfilling mode_kind in SQL
+# (the column collation makes LIKE case-insensitive, like .lower() there).
+# %% because it is used in statements that also take parameters.
+MODE_KIND_SQL = (
+    "CASE WHEN mode LIKE '%%列印%%' OR mode LIKE '%%print%%' THEN 'print' "
+    "WHEN mode LIKE '%%影印%%' OR mode LIKE '%%copy%%' THEN 'copy' "
+    "ELSE 'other' END"
+)
+_MODE_KIND_READY: Dict[str, Any] = {"ready": False, "checked_at": 0.0}
+
+
+def _mode_kind_ready(cursor) -> bool:
+    """True once no job_logs row is waiting for a mode_kind backfill (checked every 5s)."""
+    now = time.monotonic()
+    if now - _MODE_KIND_READY["checked_at"] < 5.0:
+        return _MODE_KIND_READY["ready"]
+    try:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM job_logs WHERE mode_kind IS NULL) AS pending")
+        ready = not cursor.fetchone()["pending"]
+    except Exception:
+        ready = False
+    _MODE_KIND_READY.update(ready=ready, checked_at=now)
+    return ready
+
+
+def backfill_mode_kind(conn, batch: int = 50000, progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """Classify existing rows in id ranges (rows ingested since the column was added are already set)."""
+    updated = 0
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT MIN(id) AS lo, MAX(id) AS hi FROM job_logs WHERE mode_kind IS NULL")
+        bounds = cursor.fetchone()
+        if not bounds or bounds["lo"] is None:
+            return 0
+        lo, hi = bounds["lo"], bounds["hi"]
+        while lo <= hi:
+            updated += cursor.execute(
+                f"UPDATE job_logs SET mode_kind = {MODE_KIND_SQL} "
+                "WHERE id BETWEEN %s AND %s AND mode_kind IS NULL",
+                (lo, lo + batch - 1),
+            )
+            if progress:
+                progress(updated, min(lo + batch - 1, hi))
+            lo += batch
+    _MODE_KIND_READY["checked_at"] = 0.0
+    return updated
+
+
+def _category_case_exprs(categories: List[str], kind_expr: str = "mode_kind") -> List[str]:
+    # Category keys come from USAGE_CATEGORY_CONFIG, never from user input
+    exprs = []
+    for cat in categories:
+        conf = USAGE_CATEGORY_CONFIG[cat]
+        col = "bw_pages" if conf["color"] == "bw" else "color_pages"
+        exprs.append(f"CASE WHEN {kind_expr} = '{conf['mode']}' AND {col} > 0 THEN {col} ELSE 0 END")
+    return exprs
+
+
+def _category_sum_columns(categories: List[str], kind_expr: str = "mode_kind") -> str:
+    exprs = _category_case_exprs(categories, kind_expr)
+    return ", ".join(f"SUM({expr}) AS `{cat}`" for cat, expr in zip(categories, exprs))
+
+
+def _usage_stats_from_rows(rows: List[Dict[str, Any]], categories: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Pre-aggregated SQL rows -> the aggregate_usage_by_categories() result shape."""
+    stats: Dict[str, Dict[str, Any]] = {}
+    for r in rows:
+        display_name = normalize_name(r["user_name"] or "", "未知")
+        key = display_name.lower()
+        record = stats.setdefault(
+            key,
+            {"name": display_name, "username": key, "totals": {cat: 0 for cat in categories}, "total": 0},
+        )
+        for cat in categories:
+            value = int(r[cat] or 0)
+            record["totals"][cat] += value
+            record["total"] += value
+    return stats
+
+
+@db_helper
+def fetch_category_usage(
+    users: List[Dict[str, Any]],
+    categories: List[str],
+    printer_addr: Optional[str] = None,
+    start_dt: Optional[datetime] = None,
+    end_dt: Optional[datetime] = None,
+    by_printer: bool = False,
+) -> Dict[str, Any]:
+    """
+    USAGE_CATEGORY_CONFIG totals for the users of one report page.
+    Returns aggregate_usage_by_categories()-shaped stats, or {printer: stats}
+    with by_printer=True. Summed in SQL on mode_kind; before the mode_kind
+    backfill has run it falls back to fetching rows and aggregating in Python.
+    """
+    categories = [c for c in categories if c in USAGE_CATEGORY_CONFIG] or DEFAULT_USAGE_CATEGORIES
+    if not users:
+        return {}
+
+    conn = get_db_connection(read_only=True)
+    try:
+        with conn.cursor() as cursor:
+            if _mode_kind_ready(cursor):
+                where_sql, params = _build_job_logs_where_clause(
+                    printer_addr, None, None, None, start_dt, end_dt, None, cursor
+                )
+                users_sql, users_params = _users_filter_sql(users)
+                group_cols = "printer_addr, user_name" if by_printer else "user_name"
+                # ORDER BY MAX(start_time) DESC keeps the first-seen order the
+                # Python aggregation had over rows sorted newest first
+                cursor.execute(
+                    f"""
+                    SELECT {group_cols}, {_category_sum_columns(categories)}
+                    FROM job_logs
+                    {where_sql}{users_sql}
+                    GROUP BY {group_cols}
+                    ORDER BY MAX(start_time) DESC
+                    """,
+                    params + users_params,
+                )
+                rows = cursor.fetchall()
+                if not by_printer:
+                    return _usage_stats_from_rows(rows, categories)
+                per_printer: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+                for r in rows:
+                    per_printer[r["printer_addr"]].append(r)
+                return {p: _usage_stats_from_rows(p_rows, categories) for p, p_rows in per_printer.items()}
+    finally:
+        conn.close()
+
+    entries = fetch_job_logs_by_users(users, printer_addr=printer_addr, start_dt=start_dt, end_dt=end_dt)
+    if not by_printer:
+        return aggregate_usage_by_categories(entries, categories, None)
+    per_printer_entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for entry in entries:
+        per_printer_entries[entry.get("printer", "")].append(entry)
+    return {p: aggregate_usage_by_categories(logs, categories, None) for p, logs in per_printer_entries.items()}
+
+
+@db_helper
+def fetch_printer_user_usage_page(
+    page: int,
+    per_page: int,
+    categories: List[str],
+    user_kw: Optional[str] = None,
+    start_dt: Optional[datetime] = None,
+    end_dt: Optional[datetime] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    One page of the all-printers counts view: (printer, user) pairs with their
+    USAGE_CATEGORY_CONFIG totals, highest total first, in a single query.
+    Returns (entries, total_pairs); each entry has printer, name, username,
+    totals and total. Pagination is over pairs, so every page but the last
+    holds exactly per_page rows; per_page <= 0 returns every pair (export).
+    """
+    categories = [c for c in categories if c in USAGE_CATEGORY_CONFIG] or DEFAULT_USAGE_CATEGORIES
+    page = max(page, 1)
+
+    conn = get_db_connection(read_only=True)
+    try:
+        with conn.cursor() as cursor:
+            where_sql, params = _build_job_logs_where_clause(
+                "all", user_kw, None, None, start_dt, end_dt, None, cursor
+            )
+            # Before the mode_kind backfill has run, classify mode on the fly
+            kind_expr = "mode_kind" if _mode_kind_ready(cursor) else f"({MODE_KIND_SQL})"
+            total_expr = " + ".join(_category_case_exprs(categories, kind_expr))
+            limit_sql = ""
+            query_params = list(params)
+            if per_page > 0:
+                limit_sql = "LIMIT %s OFFSET %s"
+                query_params.extend([per_page, (page - 1) * per_page])
+            # NULL and '' user names both display as 未知, so they share a row;
+            # COUNT(*) OVER () runs after GROUP BY and counts the pairs
+            cursor.execute(
+                f"""
+                SELECT printer_addr, COALESCE(user_name, '') AS user_name,
+                       {_category_sum_columns(categories, kind_expr)},
+                       SUM({total_expr}) AS pair_total,
+                       COUNT(*) OVER () AS total_pairs
+                FROM job_logs
+                {where_sql}
+                GROUP BY printer_addr, COALESCE(user_name, '')
+                ORDER BY pair_total DESC, MAX(start_time) DESC, printer_addr
+                {limit_sql}
+                """,
+                query_params,
+            )
+            rows = cursor.fetchall()
+            if rows:
+                total_pairs = int(rows[0]["total_pairs"])
+            elif page > 1:
+                # Past the last page: the window count came back with no rows
+                cursor.execute(
+                    f"SELECT COUNT(DISTINCT printer_addr, COALESCE(user_name, '')) AS cnt FROM job_logs {where_sql}",
+                    params,
+                )
+                total_pairs = int(cursor.fetchone()["cnt"])
+            else:
+                total_pairs = 0
+    finally:
+        conn.close()
+
+    entries = []
+    for r in rows:
+        display_name = normalize_name(r["user_name"], "未知")
+        totals = {cat: int(r[cat] or 0) for cat in categories}
+        entries.append({
+            "printer": r["printer_addr"],
+            "name": display_name,
+            "username": display_name.lower(),
+            "totals": totals,
+            "total": sum(totals.values()),
+        })
+    return entries, total_pairs
+
+
+@db_helper
 def log_update_event(source: str, status: str, message: str, log_id: int = 0) -> int:
     """
     Log an update event to DB.
@@ -1525,6 +3065,8 @@ def log_update_event(source: str, status: str, message: str, log_id: int = 0) ->
                 print(f"DEBUG: Updating Log ID={log_id} to {status}")
                 sql = "UPDATE update_logs SET status=%s, message=%s, end_time=NOW() WHERE id=%s"
                 cursor.execute(sql, (status, message, log_id))
+                # A finished refresh starts a new ingestion generation
+                invalidate_ingestion_generation()
                 return log_id
     except Exception as e:
         print(f"Logging failed: {e}")
@@ -1533,16 +3075,110 @@ def log_update_event(source: str, status: str, message: str, log_id: int = 0) ->
         conn.close()
 
 
+def append_update_log_message(log_id: int, text: str) -> None:
+    """Add a line to a finished log's message without touching end_time (the generation's Last-Modified)."""
+    if log_id <= 0:
+        return
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE update_logs SET message = CONCAT(COALESCE(message, ''), %s) WHERE id = %s",
+                (f"；{text}", log_id),
+            )
+    except Exception as e:
+        print(f"Logging failed: {e}")
+    finally:
+        conn.close()
+
+
+# 資料版本 (ingestion generation)：最近一次完成的更新紀錄
+# Cached briefly so conditional requests can be answered without touching the DB.
+GENERATION_CACHE_TTL = float(os.getenv("GENERATION_CACHE_TTL", "5"))
+_GENERATION_CACHE: Dict[str, Any] = {"value": None, "fetched_at": 0.0}
+
+
+@db_helper
+def fetch_ingestion_generation() -> Tuple[int, Optional[datetime]]:
+    """
+    Return (generation, last_modified) for the data currently in the DB.
+    generation is the id of the latest finished update_logs entry (0 if none).
+    Any finished refresh counts, since partially failed runs still ingest data.
+    last_modified is timezone-aware UTC.
+    """
+    conn = get_db_connection(read_only=True)
+    try:
+        with conn.cursor() as cursor:
+            # end_time is NOW() in the server's time zone; UNIX_TIMESTAMP undoes that
+            cursor.execute(
+                "SELECT id, UNIX_TIMESTAMP(end_time) AS end_ts FROM update_logs "
+                "WHERE end_time IS NOT NULL AND status <> 'running' "
+                "ORDER BY id DESC LIMIT 1"
+            )
+            row = cursor.fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return 0, None
+    return row['id'], datetime.fromtimestamp(int(row['end_ts']), timezone.utc)
+
+
+def get_ingestion_generation() -> Tuple[int, Optional[datetime]]:
+    """Cached wrapper around fetch_ingestion_generation (TTL: GENERATION_CACHE_TTL)."""
+    cached = _GENERATION_CACHE["value"]
+    if cached is not None and time.monotonic() - _GENERATION_CACHE["fetched_at"] < GENERATION_CACHE_TTL:
+        return cached
+    try:
+        value = fetch_ingestion_generation()
+    except Exception as e:
+        print(f"Generation lookup failed: {e}")
+        # Never cache a failure; a zero generation disables conditional hits
+        return 0, None
+    _GENERATION_CACHE["value"] = value
+    _GENERATION_CACHE["fetched_at"] = time.monotonic()
+    return value
+
+
+def invalidate_ingestion_generation() -> None:
+    _GENERATION_CACHE["value"] = None
+    _GENERATION_CACHE["fetched_at"] = 0.0
+
+
+def reset_db_caches() -> None:
+    """
+    Forget everything this process cached about the database contents:
+    dimension ids, readiness flags, the generation and pagination totals.
+    Needed when the tables are dropped and recreated underneath it.
+    """
+    DIMENSION_CACHE.clear()
+    dimensions.invalidate_ready()
+    search_index.invalidate_ready()
+    _MODE_KIND_READY["checked_at"] = 0.0
+    invalidate_ingestion_generation()
+    COUNT_STORE.clear()
+    _COLLECTOR_RUN_CACHE["generation"] = None
+
+
+# Pagination totals per filter signature and ingestion generation (count_store.py)
+COUNT_STORE = count_store.CountStore(
+    get_ingestion_generation, estimate=_estimate_count if count_store.COUNT_SKETCHES else None
+)
+
+
 def cmd_download(args: argparse.Namespace) -> None:
     source = getattr(args, "source", "manual")
     log_id = log_update_event(source, "running", "開始下載更新...", 0)
     print(f"DEBUG: cmd_download started with log_id={log_id}")
     
     try:
-        download_exports(resolve_printers(args.printer), source)
+        download_exports(resolve_printers(args.printer), source, args.drain or None, log_id)
         print("DEBUG: download_exports finished, updating log...")
         log_update_event(source, "success", "更新成功完成", log_id)
         print("DEBUG: log updated to success")
+        # Warm up only after the log is closed, so the webapp sees the new generation
+        summary = warmup_webapp()
+        if summary:
+            append_update_log_message(log_id, summary)
     except Exception as e:
         print(f"DEBUG: download_exports failed: {e}")
         log_update_event(source, "error", f"更新失敗: {str(e)}", log_id)
@@ -1561,14 +3197,17 @@ def cmd_jobs(args: argparse.Namespace) -> None:
     for base in printers:
         print(f"\n== {base} ==")
         
-        # Use DB-based loader (same as webapp)
+        # Use DB-based loader (same as webapp), streamed: --limit 0 prints
+        # every row without holding the window in memory
         report = load_joblog_report(
             base, 
             args.user, 
             args.mode, 
             args.computer, 
             start_dt, 
-            end_dt
+            end_dt,
+            keep_entries=False,
+            recent_limit=args.limit if args.limit > 0 else None,
         )
         
         if not report:
@@ -1584,6 +3223,129 @@ def cmd_jobs(args: argparse.Namespace) -> None:
         print_aggregated_summary(summary, args.summary_limit)
 
 
+def cmd_import(args: argparse.Namespace) -> None:
+    printer = resolve_printers(args.printer)[0] if args.printer else None
+    stats = import_exports(
+        args.sources,
+        kind=args.kind,
+        printer=printer,
+        workers=args.workers,
+        bulk=args.bulk,
+        state_path=Path(args.state) if args.state else None,
+        restart=args.restart,
+    )
+    print(
+        f"匯入完成: {stats['imported']} 個檔案 / {stats['rows']} 筆，"
+        f"略過 {stats['skipped']}，重複 {stats['duplicate']}，失敗 {stats['failed']}"
+    )
+    if stats["failed"]:
+        sys.exit(1)
+
+
+def cmd_profile_queries(args: argparse.Namespace) -> None:
+    if args.clear:
+        query_profiler.clear_slow_queries(get_profiler_connection)
+        print("已清除 slow_queries 紀錄")
+        return
+
+    report = query_profiler.fetch_slow_query_report(get_profiler_connection, days=args.days, limit=args.limit)
+    if not report:
+        print(f"最近 {args.days} 天沒有慢查詢紀錄 (需設定 QUERY_PROFILE=1，門檻 QUERY_PROFILE_SLOW_MS)")
+        return
+
+    print(f"最近 {args.days} 天慢查詢 (依總耗時排序)")
+    for idx, entry in enumerate(report, 1):
+        print(
+            f"\n#{idx} {entry['helper'] or '-'} | {entry['count']} 次 | 總 {entry['total_ms']:.0f} ms | "
+            f"平均 {entry['avg_ms']:.0f} ms | 最長 {entry['max_ms']:.0f} ms | 最多 {entry['max_rows'] or 0} 筆 | "
+            f"最近 {format_dt(entry['last_seen'])}"
+        )
+        print(f"  {entry['shape']}")
+        if entry["explain_summary"]:
+            print(f"  EXPLAIN: {entry['explain_summary']}")
+        if args.explain:
+            if entry["params"]:
+                print(f"  參數: {entry['params']}")
+            if entry["explain_json"]:
+                print(entry["explain_json"])
+
+
+def cmd_backfill_dimensions(args: argparse.Namespace) -> None:
+    init_db()
+    t0 = time.perf_counter()
+
+    def progress(updated: int, upto_id: int) -> None:
+        print(f"  已更新 {updated} 筆 (id <= {upto_id})")
+
+    conn = get_db_connection()
+    try:
+        updated = dimensions.backfill(conn, batch=args.batch, progress=progress)
+        print(f"維度回填完成: {updated} 筆，耗時 {time.perf_counter() - t0:.1f}s")
+        t0 = time.perf_counter()
+        classified = backfill_mode_kind(conn, batch=args.batch, progress=progress)
+        print(f"mode_kind 回填完成: {classified} 筆，耗時 {time.perf_counter() - t0:.1f}s")
+    finally:
+        conn.close()
+
+
+def cmd_migrate(args: argparse.Namespace) -> None:
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            version = schema.current_version(cursor)
+            todo = schema.pending(version)
+            print(f"資料庫結構版本: {version}（程式版本: {schema.CURRENT_VERSION}）")
+            if not todo:
+                print("已是最新版本")
+                return
+            for migration in todo:
+                print(f"  待執行 {migration.version}: {migration.name}")
+                if args.status:
+                    for sql in migration.statements:
+                        print(f"    {online_ddl.describe(sql)}")
+            if args.status:
+                return
+            t0 = time.perf_counter()
+            version = schema.migrate(cursor, progress=print)
+            print(f"結構更新完成: 版本 {version}，耗時 {time.perf_counter() - t0:.1f}s")
+    finally:
+        conn.close()
+
+
+def cmd_reindex_search(args: argparse.Namespace) -> None:
+    init_db()
+    if args.backend == "fulltext":
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                search_index.create_fulltext_indexes(cursor)
+            print("已建立 FULLTEXT (ngram) 索引，設定 SEARCH_BACKEND=fulltext 後啟用")
+        except Exception as e:
+            print(f"無法建立 FULLTEXT ngram 索引 (MariaDB 不支援 ngram parser): {e}")
+            sys.exit(1)
+        finally:
+            conn.close()
+        return
+
+    t0 = time.perf_counter()
+
+    def progress(rows: int, last_id: int) -> None:
+        print(f"  已索引 {rows} 筆 (id <= {last_id})")
+
+    stats = update_search_index(rebuild=args.rebuild, progress=progress)
+    print(f"搜尋索引完成: {stats['rows']} 筆，新增 {stats['values']} 個關鍵值，耗時 {time.perf_counter() - t0:.1f}s")
+
+
+def cmd_sketch_counts(args: argparse.Namespace) -> None:
+    t0 = time.perf_counter()
+    days = None if args.all else args.days
+    rows = refresh_count_sketches(days)
+    scope = "全部資料" if days is None else f"最近 {days} 天"
+    print(f"計數草圖已更新 ({scope}): {rows} 筆 (日期 / 列印機)，耗時 {time.perf_counter() - t0:.1f}s")
+    if not count_store.COUNT_SKETCHES:
+        print("提示: 設定 COUNT_SKETCHES=1 後，分頁總數才會使用計數草圖估算")
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Sharp MFP 匯出與查詢工具")
     sub = parser.add_subparsers(dest="command")
@@ -1592,6 +3354,10 @@ def build_parser() -> argparse.ArgumentParser:
     download_parser = sub.add_parser("download", help="從 Sharp MFP 下載並同步 User Count 和 Job Log 到資料庫")
     download_parser.add_argument("-p", "--printer", nargs="*", help="指定列印機 IP（空白表示所有列印機）")
     download_parser.add_argument("--source", choices=["manual", "auto"], default="manual", help="觸發來源（manual=手動, auto=自動排程）")
+    download_parser.add_argument(
+        "--drain", action="store_true",
+        help="確認 Job Log 已寫入資料庫後清除列印機上的紀錄（亦可設定 JOBLOG_DRAIN=1）",
+    )
     download_parser.set_defaults(func=cmd_download)
 
     count_parser = sub.add_parser("counts", help="查詢用戶列印數量 (usercount)")
@@ -1615,13 +3381,57 @@ def build_parser() -> argparse.ArgumentParser:
     jobs_parser.add_argument("--summary-limit", type=int, default=10, help="跨列印機彙總顯示的使用者數 (<=0 表示全部)")
     jobs_parser.set_defaults(func=cmd_jobs)
 
+    import_parser = sub.add_parser("import", help="批次匯入歷史匯出 CSV (job log / user count)")
+    import_parser.add_argument("sources", nargs="+", help="目錄、glob 或檔案 (例如 exports/joblog 'exports/**/*.csv')")
+    import_parser.add_argument("--kind", choices=["joblog", "usercount"], help="強制指定類別 (預設依檔名判斷)")
+    import_parser.add_argument("--printer", help="強制指定列印機 IP (預設依檔名 host_tag 判斷)")
+    import_parser.add_argument("--workers", type=int, default=4, help="並行處理的檔案數")
+    import_parser.add_argument("--bulk", action="store_true", help="job log 使用 LOAD DATA LOCAL INFILE 批次載入")
+    import_parser.add_argument("--state", help=f"進度檔路徑 (預設 {IMPORT_STATE_FILE})")
+    import_parser.add_argument("--restart", action="store_true", help="忽略進度檔，全部重新匯入")
+    import_parser.set_defaults(func=cmd_import)
+
+    profile_parser = sub.add_parser("profile-queries", help="慢查詢報告 (需設定 QUERY_PROFILE=1 收集)")
+    profile_parser.add_argument("--days", type=int, default=7, help="統計最近幾天")
+    profile_parser.add_argument("--limit", type=int, default=20, help="顯示前幾名查詢")
+    profile_parser.add_argument("--explain", action="store_true", help="同時輸出參數與完整 EXPLAIN JSON")
+    profile_parser.add_argument("--clear", action="store_true", help="清除所有慢查詢紀錄")
+    profile_parser.set_defaults(func=cmd_profile_queries)
+
+    migrate_parser = sub.add_parser("migrate", help="更新資料庫結構 (大型資料表以線上 DDL / 影子表複製，不鎖表)")
+    migrate_parser.add_argument("--status", action="store_true", help="只列出待執行的結構更新")
+    migrate_parser.set_defaults(func=cmd_migrate)
+
+    reindex_parser = sub.add_parser("reindex-search", help="更新關鍵字搜尋索引 (檔案名稱 / 用戶)")
+    reindex_parser.add_argument("--rebuild", action="store_true", help="清空後重建整個索引")
+    reindex_parser.add_argument("--backend", choices=["local", "fulltext"], default="local",
+                                help="local=內建 n-gram 索引；fulltext=建立 MySQL FULLTEXT ngram 索引")
+    reindex_parser.set_defaults(func=cmd_reindex_search)
+
+    backfill_parser = sub.add_parser("backfill-dimensions", help="為既有 job log 回填維度表 ID (printer / user / computer / mode) 與 mode_kind")
+    backfill_parser.add_argument("--batch", type=int, default=dimensions.BACKFILL_BATCH, help="每次 UPDATE 的 id 範圍")
+    backfill_parser.set_defaults(func=cmd_backfill_dimensions)
+
+    sketch_parser = sub.add_parser("sketch-counts", help="重建分頁總數用的每日計數草圖 (HyperLogLog，需設定 COUNT_SKETCHES=1 啟用)")
+    sketch_parser.add_argument("--days", type=int, default=count_store.SKETCH_REFRESH_DAYS, help="重建最近幾天")
+    sketch_parser.add_argument("--all", action="store_true", help="重建全部資料 (歷史匯入後執行)")
+    sketch_parser.set_defaults(func=cmd_sketch_counts)
+
     return parser
 
 
+# Commands that write to the database apply pending migrations; the rest only
+# check the schema version so a report never waits on DDL locks
+MIGRATING_COMMANDS = {"download", "import", "backfill-dimensions", "reindex-search", "sketch-counts"}
+
+
 def main():
     parser = build_parser()
     args = parser.parse_args()
-    if not getattr(args, "command", None):
+    command = getattr(args, "command", None)
+    if command != "migrate":
+        init_db(apply=command is None or command in MIGRATING_COMMANDS)
+    if not command:
         download_exports()
         return
 
@@ -1635,10 +3445,8 @@ if __name__ == "__main__":
             sys.stdout.reconfigure(encoding='utf-8')
         except AttributeError:
             # Python < 3.7
-            import codecs
             sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer)
-            
-    init_db()  # Ensure DB schema is up-to-date
+
     main()
 
 
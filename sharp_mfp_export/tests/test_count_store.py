@@ -0,0 +1,198 @@
+from datetime import date, datetime
+
+import pytest
+
+import count_store
+from count_store import (
+    CountStore,
+    HyperLogLog,
+    build_sketches,
+    coverage_after_refresh,
+    estimate,
+    filter_signature,
+    merged,
+    sketch_window,
+    sketches_cover,
+)
+
+
+def _sketch(values):
+    sketch = HyperLogLog()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+@pytest.mark.parametrize("n", [0, 1, 10, 1000, 100000])
+def test_hll_estimate_within_error(n):
+    count = _sketch(f"user-{i}" for i in range(n)).count()
+    assert abs(count - n) <= max(1, n * 0.05)
+
+
+def test_hll_ignores_duplicates():
+    assert _sketch(["a", "b", "a", "b", "a"]).count() == 2
+
+
+def test_hll_merge_is_union():
+    left = _sketch(f"u{i}" for i in range(0, 6000))
+    right = _sketch(f"u{i}" for i in range(4000, 10000))
+    union = _sketch(f"u{i}" for i in range(10000))
+    left.merge(right)
+    assert left.to_bytes() == union.to_bytes()
+    assert merged([_sketch(["x"]).to_bytes(), _sketch(["y"]).to_bytes(), _sketch(["x"]).to_bytes()]).count() == 2
+
+
+def test_hll_bytes_round_trip():
+    sketch = _sketch(str(i) for i in range(500))
+    assert HyperLogLog(registers=sketch.to_bytes()).count() == sketch.count()
+
+
+def test_user_pair_key_folds_like_the_collation():
+    assert count_store.user_pair_key("Ming ", "MING") == count_store.user_pair_key("ming", "ming")
+    assert count_store.user_pair_key(None, "a") != count_store.user_pair_key("", "a")
+
+
+def _grouped_rows():
+    # (day, printer_addr, user_name, login_name) grouped with job counts
+    return [
+        {"day": date(2026, 1, 1), "printer_addr": "p1", "user_name": "a", "login_name": "a", "jobs": 3},
+        {"day": date(2026, 1, 1), "printer_addr": "p1", "user_name": "B", "login_name": "b", "jobs": 2},
+        {"day": date(2026, 1, 2), "printer_addr": "p1", "user_name": "b", "login_name": "B", "jobs": 1},
+        {"day": date(2026, 1, 1), "printer_addr": "p2", "user_name": "a", "login_name": "a", "jobs": 4},
+        {"day": date(2026, 1, 2), "printer_addr": "p2", "user_name": "c", "login_name": None, "jobs": 5},
+    ]
+
+
+def test_estimate_from_sketch_rows():
+    sketches = build_sketches(_grouped_rows())
+    assert sketches[(date(2026, 1, 1), "p1")][0] == 5
+    rows = [
+        {"printer_addr": printer, "jobs": jobs, "users": sketch.to_bytes()}
+        for (day, printer), (jobs, sketch) in sketches.items()
+    ]
+    assert estimate("jobs", rows) == 15
+    # a, b, c across all printers
+    assert estimate("users", rows) == 3
+    # p1: a, b; p2: a, c
+    assert estimate("pairs", rows) == 4
+    assert estimate("users", []) is None
+
+
+def test_sketch_window():
+    start = datetime(2026, 1, 1)
+    end = datetime(2026, 3, 31, 23, 59, 59)
+    assert sketch_window({"printer": "p1", "start": start, "end": end}) == (date(2026, 1, 1), date(2026, 3, 31), "p1")
+    assert sketch_window({"printer": "all", "start": None, "end": None, "keyword": " "}) == (None, None, None)
+    assert sketch_window({"start": start}) == (date(2026, 1, 1), None, None)
+    # Keyword filter, partial days and short windows need an exact count
+    assert sketch_window({"start": start, "end": end, "keyword": "report"}) is None
+    assert sketch_window({"start": datetime(2026, 1, 1, 8), "end": end}) is None
+    assert sketch_window({"start": start, "end": datetime(2026, 3, 31, 12)}) is None
+    assert sketch_window({"start": start, "end": datetime(2026, 1, 2, 23, 59, 59)}) is None
+
+
+def test_sketch_coverage_after_refresh():
+    assert coverage_after_refresh(None, None) is None
+    # First partial build: only its own days
+    assert coverage_after_refresh(None, date(2026, 3, 1)) == date(2026, 3, 1)
+    # Daily refreshes keep the range contiguous
+    state = {"covered_from": date(2026, 3, 1), "refreshed_on": date(2026, 3, 3)}
+    assert coverage_after_refresh(state, date(2026, 3, 2)) == date(2026, 3, 1)
+    full = {"covered_from": None, "refreshed_on": date(2026, 3, 3)}
+    assert coverage_after_refresh(full, date(2026, 3, 3)) is None
+    # A gap (refreshes stopped for a while) restarts the range
+    assert coverage_after_refresh(full, date(2026, 3, 10)) == date(2026, 3, 10)
+
+
+def test_sketches_cover():
+    today = date(2026, 3, 31)
+    assert not sketches_cover(None, None, None, today)
+
+    partial = {"covered_from": date(2026, 3, 1), "refreshed_on": today}
+    assert sketches_cover(partial, date(2026, 3, 1), date(2026, 3, 30), today)
+    assert sketches_cover(partial, date(2026, 3, 2), None, today)
+    assert not sketches_cover(partial, None, None, today)
+    assert not sketches_cover(partial, date(2026, 2, 1), date(2026, 3, 30), today)
+
+    full = {"covered_from": None, "refreshed_on": today}
+    assert sketches_cover(full, None, None, today)
+    assert sketches_cover(full, date(2026, 1, 1), date(2026, 12, 31), today)
+
+    stale = {"covered_from": None, "refreshed_on": date(2026, 3, 20)}
+    assert sketches_cover(stale, None, date(2026, 3, 20), today)
+    assert not sketches_cover(stale, None, date(2026, 3, 21), today)
+    assert not sketches_cover(stale, None, None, today)
+
+
+def test_filter_signature_normalises():
+    base = filter_signature({"printer": None, "user": "ming"})
+    assert filter_signature({"printer": "all", "user": " Ming "}) == base
+    assert filter_signature({"printer": "ALL", "user": "ming", "keyword": ""}) == base
+    assert filter_signature({"user": "ming"}) == base
+    assert filter_signature({"printer": "p1", "user": "ming"}) != base
+    assert filter_signature({"start": datetime(2026, 1, 1)}) != filter_signature({"start": datetime(2026, 1, 2)})
+
+
+class _Exact:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+
+def test_count_store_caches_per_generation():
+    generation = [1]
+    store = CountStore(lambda: (generation[0], None))
+    exact = _Exact(10)
+    assert store.count("users", {"printer": "p1"}, exact) == 10
+    assert store.count("users", {"printer": " P1 "}, exact) == 10
+    assert exact.calls == 1
+    store.count("jobs", {"printer": "p1"}, exact)
+    assert exact.calls == 2
+
+    generation[0] = 2
+    exact.value = 11
+    assert store.count("users", {"printer": "p1"}, exact) == 11
+    assert exact.calls == 3
+    store.clear()
+    store.count("users", {"printer": "p1"}, exact)
+    assert exact.calls == 4
+
+
+def test_count_store_does_not_cache_unknown_generation():
+    store = CountStore(lambda: (0, None))
+    exact = _Exact(7)
+    store.count("users", {}, exact)
+    store.count("users", {}, exact)
+    assert exact.calls == 2
+
+
+def test_count_store_is_bounded():
+    store = CountStore(lambda: (1, None), max_entries=2)
+    exact = _Exact(1)
+    for printer in ("p1", "p2", "p3"):
+        store.count("jobs", {"printer": printer}, exact)
+    store.count("jobs", {"printer": "p1"}, exact)
+    assert exact.calls == 4
+
+
+def test_count_store_prefers_estimate():
+    def approx(kind, filters):
+        return 99 if kind == "users" else None
+
+    store = CountStore(lambda: (1, None), estimate=approx)
+    exact = _Exact(5)
+    assert store.count("users", {}, exact) == 99
+    assert store.count("pairs", {}, exact) == 5
+    assert exact.calls == 1
+
+
+def test_count_store_falls_back_when_estimate_fails():
+    def broken(kind, filters):
+        raise RuntimeError("no sketches")
+
+    store = CountStore(lambda: (1, None), estimate=broken)
+    assert store.count("users", {}, _Exact(5)) == 5
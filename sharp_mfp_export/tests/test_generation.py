@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+
+import sharp_mfp_export as sme
+
+
+class FakeUpdateLogsConnection:
+    def __init__(self, row):
+        self.row = row
+        self.sql = None
+
+    def cursor(self, *args):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.sql = sql
+        return 1
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+def test_last_modified_is_utc(monkeypatch):
+    conn = FakeUpdateLogsConnection({"id": 7, "end_ts": 1769846709})
+    monkeypatch.setattr(sme, "get_db_connection", lambda read_only=False: conn)
+    generation, last_modified = sme.fetch_ingestion_generation()
+    assert "UNIX_TIMESTAMP(end_time)" in conn.sql
+    assert generation == 7
+    assert last_modified == datetime(2026, 1, 31, 8, 5, 9, tzinfo=timezone.utc)
+
+
+def test_no_finished_refresh(monkeypatch):
+    monkeypatch.setattr(sme, "get_db_connection", lambda read_only=False: FakeUpdateLogsConnection(None))
+    assert sme.fetch_ingestion_generation() == (0, None)
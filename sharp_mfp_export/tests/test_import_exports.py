@@ -0,0 +1,104 @@
+from pathlib import Path
+
+import pytest
+
+import sharp_mfp_export as sme
+
+
+class FakeUserCountsConnection:
+    """Just enough of a pymysql connection for sync_usercount_to_db."""
+
+    def __init__(self, table):
+        self.table = table
+        self._row = None
+
+    def cursor(self, *args):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        assert sql.startswith("SELECT 1 FROM user_counts")
+        printer, snapshot = params
+        hit = any(r[0] == printer and r[-1] == snapshot for r in self.table)
+        self._row = (1,) if hit else None
+        return int(hit)
+
+    def fetchone(self):
+        return self._row
+
+    def executemany(self, sql, values):
+        assert "INSERT INTO user_counts" in sql
+        self.table.extend(values)
+        return len(values)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def user_counts(monkeypatch):
+    table = []
+    monkeypatch.setattr(sme, "get_db_connection", lambda read_only=False: FakeUserCountsConnection(table))
+    monkeypatch.setattr(sme, "update_search_index", lambda: {"rows": 0, "values": 0})
+    monkeypatch.setattr(sme.count_store, "COUNT_SKETCHES", False)
+    return table
+
+
+def _write_usercount(directory, name):
+    path = directory / name
+    path.write_text(
+        "用戶名稱,印表機:黑白已使用,影印:全彩已使用\n"
+        "alice,10,2\n"
+        "bob,5,0\n",
+        encoding=sme.CSV_ENCODING,
+    )
+    return path
+
+
+def test_reimporting_a_snapshot_does_not_duplicate_rows(tmp_path, user_counts):
+    exports = tmp_path / "usercount"
+    exports.mkdir()
+    _write_usercount(exports, "uc_10.0.0.5_20260101-080000.csv")
+    state = tmp_path / "state.json"
+
+    first = sme.import_exports([str(exports)], state_path=state)
+    assert first["rows"] == 2
+    assert len(user_counts) == 2
+
+    # restart ignores the state file: only user_counts itself prevents the duplicate
+    second = sme.import_exports([str(exports)], state_path=state, restart=True)
+    assert second["imported"] == 1
+    assert second["rows"] == 0
+    assert len(user_counts) == 2
+
+
+def test_snapshot_from_the_collector_is_not_imported_again(tmp_path, user_counts):
+    collected = tmp_path / "collector"
+    collected.mkdir()
+    sme.sync_usercount_to_db(_write_usercount(collected, "uc_10.0.0.5_20260101-080000.csv"), "http://10.0.0.5")
+
+    # Same snapshot, different bytes (e.g. re-exported): digest dedupe does not catch it
+    archive = tmp_path / "archive"
+    archive.mkdir()
+    path = _write_usercount(archive, "uc_10.0.0.5_20260101-080000.csv")
+    path.write_text(path.read_text(encoding=sme.CSV_ENCODING) + "carol,1,0\n", encoding=sme.CSV_ENCODING)
+
+    stats = sme.import_exports([str(archive)], state_path=tmp_path / "state.json")
+    assert stats["rows"] == 0
+    assert len(user_counts) == 2
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("uc_192.168.1.10_20260131080509.csv", ("uc", "192.168.1.10", "20260131080509")),
+    ("joblog_printer_8080_20260131.csv", ("joblog", "printer_8080", "20260131")),
+    ("joblog_host_.csv", ("joblog", "host", "")),
+    ("joblog_20260131.csv", None),
+    ("usercount.csv", None),
+])
+def test_split_export_filename(name, expected):
+    assert sme.split_export_filename(Path("/exports") / name) == expected
@@ -0,0 +1,81 @@
+import pickle
+from datetime import datetime
+
+import pytest
+
+from job_record import JobRecord
+
+
+def _record(**overrides):
+    values = dict(
+        job_id="101", mode="列印", user="  王小明 ", login=None, start=datetime(2026, 1, 31, 8, 5, 9),
+        bw=3, color=1, printer="http://10.0.0.5",
+    )
+    values.update(overrides)
+    return JobRecord(**values)
+
+
+def test_fields_and_pages():
+    record = _record()
+    assert record["job_id"] == "101"
+    assert record["pages"] == 4
+    assert _record(pages=9)["pages"] == 9
+    assert record["file_name"] is None
+
+
+def test_derived_fields():
+    record = _record(user="  Ming ", login="")
+    assert record["user_display"] == "Ming"
+    assert record["user_key"] == "ming"
+    assert record.login_display == "N/A"
+    assert record.login_key == "n/a"
+    assert _record(user=None).user_display == "未知"
+
+
+def test_derived_fields_follow_updates_before_first_access():
+    record = _record(user="Lee")
+    record.user = "Chen"
+    assert record.user_key == "chen"
+
+
+def test_dict_access():
+    record = _record()
+    with pytest.raises(KeyError):
+        record["missing"]
+    assert record.get("missing") is None
+    assert record.get("missing", 0) == 0
+    assert record.get("bw") == 3
+    assert "user_key" in record
+    assert "start" in record
+    assert "missing" not in record
+    assert list(record.keys()) == list(JobRecord.FIELDS + JobRecord.DERIVED)
+
+
+def test_to_dict():
+    data = _record().to_dict()
+    assert set(data) == set(JobRecord.FIELDS + JobRecord.DERIVED)
+    assert data["user_display"] == "王小明"
+    assert data["printer"] == "http://10.0.0.5"
+    assert dict(_record()) == data
+
+
+def test_slots_reject_unknown_attributes():
+    with pytest.raises(AttributeError):
+        _record().extra = 1
+
+
+def test_pickle_round_trip():
+    record = _record()
+    assert record.user_key == "王小明"
+    restored = pickle.loads(pickle.dumps(record))
+    assert restored == record
+    assert restored.user_display == "王小明"
+    assert restored.to_dict() == record.to_dict()
+
+
+def test_equality_and_hash():
+    assert _record() == _record()
+    assert _record() != _record(bw=4)
+    assert _record() != _record().to_dict()
+    with pytest.raises(TypeError):
+        hash(_record())
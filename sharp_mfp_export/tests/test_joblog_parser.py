@@ -0,0 +1,84 @@
+import csv
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from sharp_mfp_export import (
+    CSV_ENCODING,
+    JOBLOG_RECORD_FIELDS,
+    _joblog_entries_from_csv_raw,
+    _joblog_records_from_csv,
+    _tsv_field,
+)
+
+CHINESE_HEADER = [
+    "工作ID", "帳戶工作ID", "工作模式", "電腦名稱", "用戶名稱", "登入名稱", "開始日期", "完成日期",
+    "黑白總張數", "全彩總張數", "檔案名稱", "傳送類型", "直接位址",
+]
+ENGLISH_HEADER = [
+    "Job ID", "Account Job ID", "Job Mode", "Computer Name", "User Name", "Login Name",
+    "Start Date", "Completion Date", "黑白總張數", "全彩總張數", "檔案名稱", "傳送類型", "直接位址",
+]
+ROWS = [
+    ["101", "A1", "列印", "PC-01", "王小明", "ming", "2026/01/31 08:05:09", "2026/01/31 08:06:00",
+     "3", "1", "report.pdf", "", ""],
+    ["102", "", "掃描", "", " 陳 ", "", "2026-01-31 09:00:00", "N/A", "1,234", "", "", "Email", "a@b.c"],
+    ["103", "A3", "影印", "PC-02", "", "chen", "", "2026/02/30 08:00:00", "N/A", "-2", "x.doc", "", ""],
+    ["104", "A4", "列印", "PC-03", "lee", "lee", "2026/01/31 ０8:05:09"],
+    ["105", "A5", "列印", "PC-04", "lin", "lin", "2026/13/01 08:00:00", "2026/01/31 10:00:00",
+     " 7 ", "2", "y.pdf", "", "", "extra cell"],
+]
+
+
+def _write_csv(path: Path, header, rows) -> Path:
+    with open(path, "w", encoding=CSV_ENCODING, newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return path
+
+
+def _as_tuple(entry):
+    return tuple(entry[field] for field in JOBLOG_RECORD_FIELDS)
+
+
+@pytest.mark.parametrize("header", [CHINESE_HEADER, ENGLISH_HEADER], ids=["zh", "en"])
+def test_columnar_parser_matches_row_parser(tmp_path, header):
+    path = _write_csv(tmp_path / "joblog_host_20260131.csv", header, ROWS)
+    records = _joblog_records_from_csv(path)
+    assert records == [_as_tuple(e) for e in _joblog_entries_from_csv_raw(path)]
+    assert len(records) == len(ROWS)
+
+
+def test_columnar_parser_values(tmp_path):
+    path = _write_csv(tmp_path / "joblog_host_20260131.csv", CHINESE_HEADER, ROWS)
+    first, second, third, short, _ = [dict(zip(JOBLOG_RECORD_FIELDS, r)) for r in _joblog_records_from_csv(path)]
+    assert first["start"] == datetime(2026, 1, 31, 8, 5, 9)
+    assert (first["bw"], first["color"], first["pages"]) == (3, 1, 4)
+    assert second["account_job_id"] is None and second["computer"] is None
+    assert second["end"] is None
+    assert second["bw"] == 1234
+    assert second["file_name"] == ""
+    assert third["start"] is None and third["end"] is None
+    assert short["start"] is None and short["file_name"] is None
+
+
+def test_columnar_parser_header_only(tmp_path):
+    path = _write_csv(tmp_path / "joblog_host_20260131.csv", CHINESE_HEADER, [])
+    assert _joblog_records_from_csv(path) == []
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, "\\N"),
+    (datetime(2026, 1, 31, 8, 5, 9), "2026-01-31 08:05:09"),
+    (42, "42"),
+    ("", ""),
+    ("plain 名稱", "plain 名稱"),
+    ("a\tb", "a\\tb"),
+    ("line1\nline2\r", "line1\\nline2\\r"),
+    ("C:\\scan\\out.pdf", "C:\\\\scan\\\\out.pdf"),
+    ("\\N", "\\\\N"),
+])
+def test_tsv_field(value, expected):
+    assert _tsv_field(value) == expected
@@ -0,0 +1,67 @@
+import metrics
+import sharp_mfp_export as sme
+
+
+def test_histogram_delta_covers_one_run():
+    histogram = metrics.Histogram("test_phase_seconds", "test")
+    histogram.observe(5.0, printer="p1", phase="login")
+    before = histogram.totals()
+    histogram.observe(1.5, printer="p1", phase="login")
+    histogram.observe(2.0, printer="p2", phase="download_joblog")
+    histogram.observe(0.5, printer="p2", phase="download_joblog")
+
+    delta = metrics.histogram_delta(before, histogram.totals())
+    assert delta == {
+        (("phase", "login"), ("printer", "p1")): (1.5, 1.0),
+        (("phase", "download_joblog"), ("printer", "p2")): (2.5, 2.0),
+    }
+    assert metrics.histogram_delta(histogram.totals(), histogram.totals()) == {}
+
+
+class FakeTimingsConnection:
+    def __init__(self, table):
+        self.table = table
+
+    def cursor(self, *args):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def executemany(self, sql, rows):
+        assert "collector_phase_timings" in sql
+        self.table.extend(rows)
+
+    def close(self):
+        pass
+
+
+def test_save_collector_timings(monkeypatch):
+    table = []
+    monkeypatch.setattr(sme, "get_db_connection", lambda read_only=False: FakeTimingsConnection(table))
+    timings = {
+        (("phase", "login"), ("printer", "p1")): (0.25, 1.0),
+        (("phase", "login"), ("printer", "p2")): (3.0, 2.0),
+    }
+    assert sme.save_collector_timings(42, timings, {"p2"}) == 2
+    assert sorted(table) == [(42, "p1", "login", 0.25, 1, 0), (42, "p2", "login", 3.0, 2, 1)]
+    assert sme.save_collector_timings(42, {}, set()) == 0
+
+
+def test_collector_run_families_render():
+    rows = [
+        {"printer_addr": "p1", "phase": "login", "seconds": 0.25, "failed": 0, "trigger_source": "auto", "run_ts": 1769846709},
+        {"printer_addr": "p1", "phase": "stream_joblog", "seconds": 12.5, "failed": 0, "trigger_source": "auto", "run_ts": 1769846709},
+        {"printer_addr": "p2", "phase": "login", "seconds": 5.0, "failed": 1, "trigger_source": "auto", "run_ts": 1769846709},
+    ]
+    registry = metrics.Registry()
+    registry.register_callback(lambda: sme.collector_run_families(rows))
+    text = registry.render()
+    assert 'collector_last_run_phase_seconds{phase="stream_joblog",printer="p1"} 12.5' in text
+    assert 'collector_last_run_failed{printer="p2"} 1' in text
+    assert 'collector_last_run_failed{printer="p1"} 0' in text
+    assert 'collector_last_run_timestamp_seconds{source="auto"} 1769846709' in text
+    assert sme.collector_run_families([]) == []
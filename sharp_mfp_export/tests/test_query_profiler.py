@@ -0,0 +1,98 @@
+import pytest
+
+from query_profiler import SlowQueryWriter, explain_summary, normalise_sql
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM job_logs WHERE id = 42", "SELECT * FROM job_logs WHERE id = ?"),
+    ("SELECT * FROM job_logs WHERE id = %s", "SELECT * FROM job_logs WHERE id = ?"),
+    ("SELECT * FROM t WHERE name = %(name)s", "SELECT * FROM t WHERE name = ?"),
+    ("SELECT * FROM t WHERE a = 'x' AND b = 'it''s' AND c = 'a\\'b'", "SELECT * FROM t WHERE a = ? AND b = ? AND c = ?"),
+    ("SELECT 1.5, col2 FROM t", "SELECT ?, col2 FROM t"),
+    ("SELECT * FROM t WHERE id IN (%s, %s,%s)", "SELECT * FROM t WHERE id IN (...)"),
+    ("SELECT * FROM t WHERE id in (1, 2, 3)", "SELECT * FROM t WHERE id IN (...)"),
+    ("SELECT *\n  FROM t\n\tWHERE  x = 1  ", "SELECT * FROM t WHERE x = ?"),
+    ("  INSERT INTO t (a, b) VALUES (1, 'x'), (2, 'y')", "INSERT INTO t (a, b) VALUES (...)"),
+    ("REPLACE INTO t (a) VALUES (%s)", "REPLACE INTO t (a) VALUES (...)"),
+])
+def test_normalise_sql(sql, expected):
+    assert normalise_sql(sql) == expected
+
+
+def test_normalise_sql_same_shape_for_different_batches():
+    one = "INSERT INTO job_logs (a, b) VALUES (%s, %s) ON DUPLICATE KEY UPDATE b = VALUES(b)"
+    many = "INSERT INTO job_logs (a, b) VALUES (1, 'x'), (2, 'y'), (3, 'z') ON DUPLICATE KEY UPDATE b = VALUES(b)"
+    assert normalise_sql(one) == normalise_sql(many)
+
+
+def test_normalise_sql_same_shape_for_different_in_lists():
+    assert normalise_sql("SELECT id FROM t WHERE id IN (1)") == normalise_sql("SELECT id FROM t WHERE id IN (1, 2, 3, 4)")
+
+
+def test_explain_summary():
+    plan = '{"query_block": {"ordering_operation": {"using_filesort": true, "table": {"table_name": "job_logs", "access_type": "range", "key": "idx_start", "rows_examined_per_scan": 120}}}}'
+    assert explain_summary(plan) == "filesort job_logs:range/idx_start/120"
+    assert explain_summary(None) == ""
+    assert explain_summary("not json") == ""
+
+
+class FakeSlowQueriesConnection:
+    def __init__(self, table, fail=False):
+        self.table = table
+        self.fail = fail
+
+    def cursor(self, *args):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def executemany(self, sql, rows):
+        if self.fail:
+            raise RuntimeError("server has gone away")
+        assert "INSERT INTO slow_queries" in sql
+        self.table.extend(rows)
+
+    def close(self):
+        pass
+
+
+def _entry(n):
+    return {
+        "shape_hash": f"h{n}", "shape": "SELECT ?", "sample_sql": f"SELECT {n}", "params": "",
+        "helper": "fetch", "duration_ms": 250.0, "rows_returned": 1, "explain_json": None,
+    }
+
+
+def test_slow_query_writer_batches_off_the_request():
+    table, connects = [], []
+
+    def connect():
+        connects.append(1)
+        return FakeSlowQueriesConnection(table)
+
+    writer = SlowQueryWriter(connect, flush_interval=3600)
+    for n in range(3):
+        writer.add(_entry(n))
+    assert connects == [] and table == []
+    assert writer.flush() == 3
+    assert connects == [1]
+    assert [row[0] for row in table] == ["h0", "h1", "h2"]
+    assert writer.flush() == 0
+    assert connects == [1]
+
+
+def test_slow_query_writer_keeps_entries_after_a_failed_flush():
+    table = []
+    fail = [True]
+    writer = SlowQueryWriter(lambda: FakeSlowQueriesConnection(table, fail[0]), flush_interval=3600, max_pending=2)
+    for n in range(3):
+        writer.add(_entry(n))
+    assert writer.dropped == 1
+    assert writer.flush() == 0
+    fail[0] = False
+    assert writer.flush() == 2
+    assert len(table) == 2
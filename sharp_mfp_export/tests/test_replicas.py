@@ -0,0 +1,112 @@
+import pytest
+
+import replicas
+from replicas import Replica, ReplicaRouter
+
+A = Replica("replica-a", 3306)
+B = Replica("replica-b", 3306)
+
+
+def router(lags, policy="primary", max_lag=30.0):
+    """Router over A and B whose lag checks return (or raise) lags[replica]."""
+    def check(replica):
+        value = lags[replica]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    r = ReplicaRouter([A, B], check, max_lag=max_lag, policy=policy, check_interval=0.0)
+    r._preferred = 0
+    return r
+
+
+def test_routes_to_preferred_fresh_replica():
+    assert router({A: 1.0, B: 0.0}).route() == A
+
+
+def test_skips_stopped_and_failing_replicas():
+    assert router({A: None, B: 2.0}).route() == B
+    r = router({A: ConnectionError("down"), B: 2.0})
+    assert r.route() == B
+    assert [s["healthy"] for s in r.status()] == [False, True]
+
+
+def test_sticks_to_the_replica_it_moved_to():
+    lags = {A: 100.0, B: 1.0}
+    r = router(lags)
+    assert r.route() == B
+    lags[A] = 0.0
+    assert r.route() == B
+
+
+def test_lagging_replicas_go_to_primary_by_default():
+    assert router({A: 100.0, B: 50.0}).route() is None
+
+
+def test_notice_policy_uses_least_lagged_replica():
+    assert router({A: 100.0, B: 50.0}, policy="notice").route() == B
+
+
+def test_nothing_usable_means_primary():
+    assert router({A: None, B: ConnectionError("down")}, policy="notice").route() is None
+
+
+def test_mark_failed_backs_off():
+    r = router({A: 0.0, B: 0.0})
+    r.mark_failed(A, ConnectionError("refused"))
+    assert r.route() == B
+
+
+def test_as_of_key_only_while_lagging():
+    assert router({A: 0.0, B: 0.0}).as_of_key() == ""
+    assert router({A: 100.0, B: 100.0}).as_of_key() == ""  # primary serves
+    assert router({A: 100.0, B: 100.0}, policy="notice").as_of_key().startswith("asof-")
+
+
+def test_no_replicas_configured():
+    r = ReplicaRouter([], lambda replica: 0.0)
+    assert not r.enabled
+    assert r.route() is None
+
+
+class StatusCursor:
+    def __init__(self, results):
+        self.results = results  # statement -> row, None or exception
+        self._row = None
+
+    def execute(self, statement):
+        result = self.results[statement]
+        if isinstance(result, Exception):
+            raise result
+        self._row = result
+
+    def fetchone(self):
+        return self._row
+
+
+def test_read_lag_from_slave_status():
+    cursor = StatusCursor({"SHOW SLAVE STATUS": {"Seconds_Behind_Master": 4}})
+    assert replicas.read_lag(cursor) == 4.0
+
+
+def test_read_lag_falls_back_to_replica_status():
+    error = StatusCursor({
+        "SHOW SLAVE STATUS": RuntimeError("syntax error"),
+        "SHOW REPLICA STATUS": {"Seconds_Behind_Source": 7},
+    })
+    assert replicas.read_lag(error) == 7.0
+    empty = StatusCursor({"SHOW SLAVE STATUS": None, "SHOW REPLICA STATUS": {"Seconds_Behind_Source": 2}})
+    assert replicas.read_lag(empty) == 2.0
+
+
+def test_read_lag_stopped_replication():
+    cursor = StatusCursor({"SHOW SLAVE STATUS": {"Seconds_Behind_Master": None}})
+    assert replicas.read_lag(cursor) is None
+    cursor = StatusCursor({"SHOW SLAVE STATUS": None, "SHOW REPLICA STATUS": RuntimeError("unknown")})
+    assert replicas.read_lag(cursor) is None
+
+
+def test_read_lag_raises_when_no_statement_works():
+    cursor = StatusCursor({"SHOW SLAVE STATUS": RuntimeError("a"), "SHOW REPLICA STATUS": RuntimeError("b")})
+    with pytest.raises(RuntimeError):
+        replicas.read_lag(cursor)
@@ -0,0 +1,23 @@
+import online_ddl
+import schema
+
+
+def test_migrations_are_numbered_in_order():
+    versions = [m.version for m in schema.MIGRATIONS]
+    assert versions == list(range(1, len(versions) + 1))
+    assert schema.CURRENT_VERSION == versions[-1]
+    assert len({m.name for m in schema.MIGRATIONS}) == len(versions)
+
+
+def test_pending():
+    assert [m.version for m in schema.pending(schema.CURRENT_VERSION - 1)] == [schema.CURRENT_VERSION]
+    assert schema.pending(schema.CURRENT_VERSION) == []
+
+
+def test_alter_statements_are_idempotent():
+    # Replayed on databases created before schema_version existed
+    for migration in schema.MIGRATIONS:
+        for sql in migration.statements:
+            alter = online_ddl.parse_alter(sql)
+            if alter is not None:
+                assert "IF NOT EXISTS" in alter.clauses, (migration.name, sql)
@@ -0,0 +1,125 @@
+import search_index
+
+
+class FailingCursor:
+    """Fails every search_values query; records the watermark writes."""
+
+    def __init__(self):
+        self.watermarks = []
+
+    def execute(self, sql, params=None):
+        if "search_index_state" in sql:
+            self.watermarks.append(params[0])
+            return 1
+        raise RuntimeError("search_values is locked")
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.statements = []
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        self._rows = []
+        if sql.startswith("SELECT id, field, value FROM search_values"):
+            self._rows = [{"id": 1, "field": "file_name", "value": "報表.pdf"}]
+        return 0
+
+    def fetchall(self):
+        return self._rows
+
+    def executemany(self, sql, values):
+        self.statements.append(sql)
+        return len(values)
+
+
+def test_index_terms_cover_unigrams_and_bigrams():
+    assert search_index.index_terms("Ab c") == {"a", "b", "c", "ab"}
+    assert search_index.query_terms("報表") == {"報表"}
+    assert search_index.query_terms("x") == {"x"}
+
+
+def test_index_written_indexes_new_values():
+    cursor = RecordingCursor()
+    assert search_index.index_written(cursor, {("file_name", "報表.pdf"), ("scan_type", "")}) == 1
+    assert any(s.startswith("INSERT IGNORE INTO search_values") for s in cursor.statements)
+    assert any(s.startswith("INSERT IGNORE INTO search_postings") for s in cursor.statements)
+
+
+def test_index_written_skips_empty_batches():
+    cursor = RecordingCursor()
+    assert search_index.index_written(cursor, {("file_name", None), ("destination", "")}) == 0
+    assert cursor.statements == []
+
+
+def test_index_written_failure_marks_index_stale():
+    cursor = FailingCursor()
+    assert search_index.index_written(cursor, {("file_name", "a.pdf")}) == 0
+    # Watermark 0: _index_ready() reports not ready (LIKE fallback) until a full pass
+    assert cursor.watermarks == [0]
+
+
+class PostingsCursor:
+    """Answers the term probes from `postings` ({term: count}) and records the candidate query."""
+
+    def __init__(self, postings, values=()):
+        self.postings = postings
+        self.values = list(values)
+        self.probes = []
+        self.candidate_sql = None
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        if "search_index_state" in sql:
+            self._rows = [{"indexed": 10, "latest": 10}]
+        elif sql.startswith("SELECT COUNT(*) AS n"):
+            term, limit = params[-2], params[-1]
+            self.probes.append((term, limit))
+            self._rows = [{"n": min(self.postings.get(term, 0), limit)}]
+        else:
+            self.candidate_sql = sql
+            self.candidate_params = params
+            self._rows = [{"field": "file_name", "value": v} for v in self.values]
+        return len(self._rows)
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+
+def _resolve(monkeypatch, cursor, keyword, max_candidates=100):
+    monkeypatch.setattr(search_index, "SEARCH_MAX_CANDIDATES", max_candidates)
+    search_index.invalidate_ready()
+    return search_index.resolve_values(cursor, keyword, search_index.FILENAME_FIELDS)
+
+
+def test_resolve_values_starts_from_the_rarest_term(monkeypatch):
+    cursor = PostingsCursor({"報表": 40, "表.": 3, ".p": 90, "pd": 95, "df": 99}, values=["月報表.pdf"])
+    matches = _resolve(monkeypatch, cursor, "報表.pdf")
+    assert matches["file_name"] == ["月報表.pdf"]
+    assert "GROUP BY" not in cursor.candidate_sql
+    assert cursor.candidate_params[-3] == "表."
+    # Later probes only look as far as the best count so far
+    assert cursor.probes == [(".p", 101), ("df", 90), ("pd", 90), ("報表", 90), ("表.", 40)]
+
+
+def test_resolve_values_gives_up_on_common_terms(monkeypatch):
+    cursor = PostingsCursor({"pd": 5000, "df": 5000})
+    assert _resolve(monkeypatch, cursor, "pdf") is None
+    assert cursor.candidate_sql is None
+    assert cursor.probes == [("df", 101), ("pd", 101)]
+
+
+def test_resolve_values_stops_at_a_missing_term(monkeypatch):
+    cursor = PostingsCursor({"ab": 50, "bc": 0, "cd": 7})
+    assert _resolve(monkeypatch, cursor, "abcd") == {f: [] for f in search_index.FILENAME_FIELDS}
+    assert cursor.probes == [("ab", 101), ("bc", 50)]
+
+
+def test_resolve_values_too_many_matches(monkeypatch):
+    monkeypatch.setattr(search_index, "SEARCH_MAX_VALUES", 2)
+    cursor = PostingsCursor({"ab": 5}, values=["ab1", "ab2", "ab3"])
+    assert _resolve(monkeypatch, cursor, "ab") is None
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+
+from sharp_mfp_export import (
+    TIME_FORMATS,
+    TimestampParser,
+    _parse_fixed_width_time,
+    _parse_time_value_slow,
+    parse_time_value,
+)
+
+VALID = [
+    "2026/01/31 08:05:09",
+    "2026-01-31 08:05:09",
+    "2026-01-31T08:05:09",
+    "2024/02/29 23:59:59",
+]
+# Right shape for the fast path, but not a timestamp strptime accepts
+MALFORMED = [
+    "2026/ 1/31 08:05:09",
+    "2026/+1/31 08:05:09",
+    "+026/01/31 08:05:09",
+    "2026/01/31 08:05:-9",
+    "2026/01/31 ０8:05:09",
+    "2026/02/30 08:05:09",
+    "2026/13/01 08:05:09",
+    "2026/01/31T08:05:09",
+    "2026-01/31 08:05:09",
+]
+
+
+def _strptime(value):
+    for fmt in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+@pytest.mark.parametrize("value", VALID)
+def test_fast_path_matches_strptime_on_valid(value):
+    expected = _strptime(value)
+    assert expected is not None
+    assert _parse_fixed_width_time(value) == expected
+
+
+@pytest.mark.parametrize("value", MALFORMED)
+def test_fast_path_rejects_what_strptime_rejects(value):
+    assert _strptime(value) is None
+    assert _parse_fixed_width_time(value) is None
+    assert parse_time_value(value) is None
+    assert TimestampParser().parse(value) is None
+
+
+@pytest.mark.parametrize("value", VALID + MALFORMED + ["2026-01-31", "2026/01/31 08:05", "N/A", "", "  "])
+def test_parse_time_value_matches_slow_path(value):
+    cleaned = value.strip()
+    expected = _parse_time_value_slow(cleaned) if cleaned and cleaned.upper() != "N/A" else None
+    assert parse_time_value(value) == expected
+
+
+def test_parser_learns_format_and_falls_back():
+    parser = TimestampParser()
+    assert parser.parse("2026-01-31 08:05") == datetime(2026, 1, 31, 8, 5)
+    assert parser.fmt == "%Y-%m-%d %H:%M"
+    # A value in another format still parses through the full list
+    assert parser.parse("2026/01/31 08:05:09") == datetime(2026, 1, 31, 8, 5, 9)
+    assert parser.parse("2026-02-01") == datetime(2026, 2, 1)
+    assert parser.parse("garbage") is None
+    assert parser.parse(None) is None
+
+
+def test_parser_cache_is_bounded():
+    parser = TimestampParser(cache_size=3)
+    values = [f"2026/01/0{d} 00:00:00" for d in range(1, 8)]
+    assert parser.parse_many(values) == [datetime(2026, 1, d) for d in range(1, 8)]
+    assert len(parser._cache) <= 3
@@ -0,0 +1,48 @@
+import urllib.parse
+from datetime import date
+
+import view_popularity as vp
+
+TODAY = date(2026, 3, 4)  # ISO week 2026-W10
+
+
+def test_to_relative_replaces_current_and_previous_periods():
+    items = [("month", "2026-03"), ("week", "2026-W09"), ("printer", "all")]
+    assert vp.to_relative(items, TODAY) == [("month", "@this_month"), ("week", "@last_week"), ("printer", "all")]
+
+
+def test_to_relative_keeps_other_periods_and_params():
+    items = [("month", "2025-12"), ("week", "2026-W01"), ("start", "2026-03")]
+    assert vp.to_relative(items, TODAY) == items
+
+
+def test_last_month_wraps_the_year():
+    assert vp.to_relative([("month", "2025-12")], date(2026, 1, 15)) == [("month", "@last_month")]
+
+
+def test_resolve_round_trips_on_the_same_day():
+    items = sorted([("month", "2026-02"), ("printer", "http://10.0.0.5"), ("user", "王小明")])
+    signature = urllib.parse.urlencode(sorted(vp.to_relative(items, TODAY)))
+    assert "%40last_month" in signature
+    assert vp.resolve(signature, TODAY) == urllib.parse.urlencode(items)
+
+
+def test_resolve_moves_relative_tokens_forward():
+    signature = urllib.parse.urlencode([("month", "@this_month"), ("week", "@this_week")])
+    assert vp.resolve(signature, date(2026, 4, 1)) == "month=2026-04&week=2026-W14"
+
+
+def test_resolve_leaves_concrete_values_and_unknown_tokens():
+    assert vp.resolve("month=2025-01&week=%40someday", TODAY) == "month=2025-01&week=%40someday"
+
+
+def test_internal_params_are_never_replayed():
+    # Signatures recorded before __-parameters were dropped
+    signature = "__profile=1&__token=secret&month=%40this_month"
+    assert vp.resolve(signature, TODAY) == "month=2026-03"
+
+
+def test_recorder_drops_internal_params():
+    recorder = vp.PopularityRecorder(connect=lambda: None, flush_interval=3600)
+    recorder.record("/counts", [("__token", "secret"), ("__profile", "1"), ("printer", "all")])
+    assert [sig for (_, _, sig) in recorder._hits] == ["printer=all"]
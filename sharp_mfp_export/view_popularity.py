@@ -0,0 +1,241 @@
+"""
+Popularity-driven cache warm-up.
+
+webapp.py records the normalised query signature of every cached view it
+serves (/counts, /leaders). Hits are buffered in memory and flushed to the
+view_requests table (one row per day and signature) at most every
+FLUSH_INTERVAL seconds. Dates that mean "this month / last month / this
+week / last week" are stored as relative tokens (@this_month, ...) so the
+popularity of "the current month" carries over a month boundary.
+
+After a successful ingest, warm() replays the WARMUP_TOP_K most requested
+signatures of the last WARMUP_WINDOW_DAYS through the app, at most
+WARMUP_CONCURRENCY at a time, and reports how much of the recorded traffic
+those views cover.
+"""
+
+import hashlib
+import os
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+WARMUP_TOP_K = int(os.getenv("WARMUP_TOP_K", "20"))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "3"))
+WARMUP_WINDOW_DAYS = int(os.getenv("WARMUP_WINDOW_DAYS", "30"))
+FLUSH_INTERVAL = float(os.getenv("VIEW_POPULARITY_FLUSH_INTERVAL", "60"))
+MAX_SIGNATURE_CHARS = 1000
+
+VIEW_REQUESTS_DDL = """
+CREATE TABLE IF NOT EXISTS view_requests (
+    day DATE NOT NULL,
+    path VARCHAR(64) NOT NULL,
+    signature_hash CHAR(32) NOT NULL,
+    signature TEXT NOT NULL,
+    hits INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, path, signature_hash),
+    INDEX idx_path_hash (path, signature_hash)
+);
+"""
+
+# Query parameters whose value may be replaced by a relative token
+_RELATIVE_PARAMS = ("month", "week")
+# Internal parameters (__profile, __token, ...): never recorded, replayed or cached on
+INTERNAL_PARAM_PREFIX = "__"
+
+
+def _month_value(day: date, months_back: int) -> str:
+    year, month = day.year, day.month - months_back
+    while month < 1:
+        year, month = year - 1, month + 12
+    return f"{year:04d}-{month:02d}"
+
+
+def _week_value(day: date, weeks_back: int) -> str:
+    year, week, _ = (day - timedelta(weeks=weeks_back)).isocalendar()
+    return f"{year:04d}-W{week:02d}"
+
+
+def _relative_tokens(today: date) -> Dict[str, Dict[str, str]]:
+    """{param: {token: concrete value}} for today."""
+    return {
+        "month": {"@this_month": _month_value(today, 0), "@last_month": _month_value(today, 1)},
+        "week": {"@this_week": _week_value(today, 0), "@last_week": _week_value(today, 1)},
+    }
+
+
+def public_items(items: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Query items without the internal (__-prefixed) parameters."""
+    return [(key, value) for key, value in items if not key.startswith(INTERNAL_PARAM_PREFIX)]
+
+
+def to_relative(items: List[Tuple[str, str]], today: Optional[date] = None) -> List[Tuple[str, str]]:
+    """Replace current / previous month and week values with relative tokens."""
+    tokens = _relative_tokens(today or date.today())
+    relative = []
+    for key, value in items:
+        if key in _RELATIVE_PARAMS:
+            for token, concrete in tokens[key].items():
+                if value == concrete:
+                    value = token
+                    break
+        relative.append((key, value))
+    return relative
+
+
+def resolve(signature: str, today: Optional[date] = None) -> str:
+    """Stored signature -> query string for today (relative tokens resolved)."""
+    tokens = _relative_tokens(today or date.today())
+    items = []
+    # public_items: signatures recorded before internal parameters were dropped
+    for key, value in public_items(urllib.parse.parse_qsl(signature, keep_blank_values=True)):
+        if key in _RELATIVE_PARAMS:
+            value = tokens[key].get(value, value)
+        items.append((key, value))
+    return urllib.parse.urlencode(sorted(items))
+
+
+def signature_hash(signature: str) -> str:
+    return hashlib.md5(signature.encode("utf-8")).hexdigest()
+
+
+class PopularityRecorder:
+    """Counts view signatures in memory and flushes them to view_requests."""
+
+    def __init__(self, connect: Callable[[], Any], flush_interval: float = FLUSH_INTERVAL):
+        self._connect = connect
+        self.flush_interval = flush_interval
+        self._hits: Counter = Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._flushing = False
+
+    def record(self, path: str, items: List[Tuple[str, str]]) -> None:
+        signature = urllib.parse.urlencode(sorted(to_relative(public_items(items))))
+        if len(signature) > MAX_SIGNATURE_CHARS:
+            return
+        with self._lock:
+            self._hits[(date.today(), path, signature)] += 1
+            due = not self._flushing and time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self._flushing = True
+        if due:
+            # Off the request thread; one flush at a time
+            threading.Thread(target=self.flush, name="view-popularity-flush", daemon=True).start()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._hits = self._hits, Counter()
+            self._last_flush = time.monotonic()
+        try:
+            if not pending:
+                return 0
+            rows = [
+                (day, path, signature_hash(sig), sig, hits)
+                for (day, path, sig), hits in pending.items()
+            ]
+            conn = self._connect()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.executemany(
+                        """
+                        INSERT INTO view_requests (day, path, signature_hash, signature, hits)
+                        VALUES (%s, %s, %s, %s, %s)
+                        ON DUPLICATE KEY UPDATE hits = hits + VALUES(hits)
+                        """,
+                        rows,
+                    )
+            finally:
+                conn.close()
+            return len(rows)
+        except Exception as e:
+            print(f"View popularity flush failed: {e}")
+            # Keep the counts for the next attempt
+            with self._lock:
+                self._hits.update(pending)
+            return 0
+        finally:
+            with self._lock:
+                self._flushing = False
+
+
+def fetch_top_views(
+    connect: Callable[[], Any], limit: int = WARMUP_TOP_K, days: int = WARMUP_WINDOW_DAYS
+) -> Tuple[List[Dict[str, Any]], int]:
+    """(top `limit` signatures by hits over the last `days`, total hits in that window)."""
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT path, signature_hash, MAX(signature) AS signature, SUM(hits) AS hits
+                FROM view_requests
+                WHERE day >= CURDATE() - INTERVAL %s DAY
+                GROUP BY path, signature_hash
+                ORDER BY hits DESC
+                LIMIT %s
+                """,
+                (days, limit),
+            )
+            top = list(cursor.fetchall())
+            cursor.execute(
+                "SELECT COALESCE(SUM(hits), 0) AS total FROM view_requests WHERE day >= CURDATE() - INTERVAL %s DAY",
+                (days,),
+            )
+            total = int(cursor.fetchone()["total"])
+    finally:
+        conn.close()
+    return top, total
+
+
+def warm(
+    views: List[Dict[str, Any]],
+    total_hits: int,
+    fetch: Callable[[str], int],
+    concurrency: int = WARMUP_CONCURRENCY,
+) -> Dict[str, Any]:
+    """
+    Request each view through fetch(url) -> status code, `concurrency` at a
+    time. Returns counts, duration and coverage: the share of recorded
+    requests that hit one of the views warmed successfully.
+    """
+    started = time.perf_counter()
+    urls = []
+    for view in views:
+        query = resolve(view["signature"])
+        urls.append(f"{view['path']}?{query}" if query else view["path"])
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        statuses = list(pool.map(_safe_fetch(fetch), urls))
+
+    warmed_hits = sum(int(v["hits"]) for v, status in zip(views, statuses) if status == 200)
+    return {
+        "views": len(views),
+        "warmed": sum(1 for status in statuses if status == 200),
+        "failed": [url for url, status in zip(urls, statuses) if status != 200],
+        "coverage": warmed_hits / total_hits if total_hits else 0.0,
+        "duration": time.perf_counter() - started,
+    }
+
+
+def _safe_fetch(fetch: Callable[[str], int]) -> Callable[[str], int]:
+    def run(url: str) -> int:
+        try:
+            return fetch(url)
+        except Exception as e:
+            print(f"Warm-up of {url} failed: {e}")
+            return 0
+
+    return run
+
+
+def summary_message(result: Dict[str, Any]) -> str:
+    """One line for update_logs."""
+    return (
+        f"預熱 {result['warmed']}/{result['views']} 個熱門頁面"
+        f"（覆蓋近 {WARMUP_WINDOW_DAYS} 天 {result['coverage']:.0%} 請求），耗時 {result['duration']:.1f}s"
+    )
@@ -1,27 +1,31 @@
 from __future__ import annotations
 
 from datetime import datetime
+from functools import wraps
+import hashlib
+import os
+import random
 from io import BytesIO
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 import urllib.parse
 from collections import defaultdict
 import subprocess
 
-from flask import Flask, render_template, request, send_file, Response, stream_with_context
+from flask import Flask, render_template, request, send_file, Response, stream_with_context, make_response, g
 from flask_caching import Cache
 
-try:
+# openpyxl is only needed by the /export routes and loads on the first export
+if TYPE_CHECKING:
     from openpyxl import Workbook
-except ImportError as exc:  # pragma: no cover - runtime guard
-    raise RuntimeError("請先安裝 openpyxl 套件：pip install openpyxl") from exc
 
 from sharp_mfp_export import (
     PRINTERS,
     DEFAULT_USAGE_CATEGORIES,
     USAGE_CATEGORY_CONFIG,
     aggregate_joblog_reports,
-    aggregate_usage_by_categories,
+    fetch_category_usage,
+    fetch_printer_user_usage_page,
     format_dt,
     load_joblog_report,
     parse_month_range,
@@ -29,17 +33,28 @@ from sharp_mfp_export import (
     parse_week_range,
     fetch_latest_user_counts,
     fetch_aggregated_users_paginated,
-    fetch_job_logs_by_users,
+    iter_job_logs_by_users,
     host_tag,
     normalize_name,
     run_download_process,
-    fetch_total_user_printer_pairs,
     log_update_event,
+    append_update_log_message,
+    get_db_connection,
     fetch_total_jobs_count,
+    get_ingestion_generation,
+    invalidate_ingestion_generation,
+    REPLICA_ROUTER,
+    get_profiler_connection,
 )
 
 import logging
+import time
 import ldap_service
+import metrics
+import replicas
+import view_popularity
+import query_profiler
+import request_profiler
 
 # Configure logging
 logging.basicConfig(
@@ -54,6 +69,130 @@ app.config['CACHE_TYPE'] = 'SimpleCache'
 app.config['CACHE_DEFAULT_TIMEOUT'] = 300  # 5 minutes
 cache = Cache(app)
 
+# Password for /update_data and the /admin pages
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "2851@9364")
+
+# Endpoints wrapped in cache.cached (used for hit/miss accounting)
+CACHED_ENDPOINTS = {"counts", "leaders"}
+
+# Query signatures of real traffic, replayed after each ingest (view_popularity.py)
+VIEW_POPULARITY = view_popularity.PopularityRecorder(get_db_connection)
+# Set on warm-up requests so they are not counted as traffic
+WARMUP_HEADER = "X-Cache-Warmup"
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.before_request
+def _reset_replica_notice():
+    replicas.reset_served()
+
+
+@app.context_processor
+def _inject_data_as_of():
+    # Set when a lagging replica served this page (DB_REPLICA_LAG_POLICY=notice)
+    as_of = replicas.data_as_of()
+    return {"data_as_of": as_of.strftime("%Y-%m-%d %H:%M:%S") if as_of else None}
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.get("request_started")
+    endpoint = request.endpoint or "unknown"
+    if started is not None:
+        metrics.HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            endpoint=endpoint,
+            method=request.method,
+            status=response.status_code,
+        )
+    if endpoint in CACHED_ENDPOINTS and response.status_code == 200:
+        result = "miss" if g.get("view_cache_miss") else "hit"
+        metrics.VIEW_CACHE_REQUESTS.inc(endpoint=endpoint, result=result)
+    if endpoint in CACHED_ENDPOINTS and response.status_code in (200, 304) and not request.headers.get(WARMUP_HEADER):
+        VIEW_POPULARITY.record(request.path, _normalised_query_items())
+    return response
+
+
+def mark_cache_miss(view):
+    """Goes under @cache.cached: only runs when the cached body was not found."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.view_cache_miss = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+# Never sampled: scrapes, static files and the admin pages themselves
+PROFILE_EXCLUDED_ENDPOINTS = {
+    "metrics_endpoint", "static", "admin_queries", "admin_profiles", "admin_profile_download", "admin_warmup", "update_data",
+}
+
+
+def _should_profile() -> bool:
+    if request.args.get("__profile") == "1":
+        token = request.args.get("__token") or request.headers.get("X-Admin-Token", "")
+        return token == ADMIN_TOKEN
+    rate = request_profiler.PROFILE_SAMPLE_RATE
+    return rate > 0 and request.endpoint not in PROFILE_EXCLUDED_ENDPOINTS and random.random() < rate
+
+
+@app.before_request
+def _start_request_profiler():
+    if _should_profile():
+        g.profiler = request_profiler.StackSampler().start()
+
+
+# Query parameters of the profiling hook; kept out of saved profiles (__token is ADMIN_TOKEN)
+PROFILE_PARAMS = ("__profile", "__token")
+
+
+def _profile_url() -> str:
+    """Request path and query for the profile metadata, without the profiling parameters."""
+    query = urllib.parse.urlencode(
+        [(key, value) for key, values in request.args.lists() if key not in PROFILE_PARAMS for value in values]
+    )
+    return f"{request.path}?{query}" if query else request.path
+
+
+@app.after_request
+def _finish_request_profiler(response):
+    sampler = g.pop("profiler", None)
+    if sampler is None:
+        return response
+    sampler.stop()
+    meta = {
+        "url": _profile_url(),
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "trigger": "manual" if request.args.get("__profile") == "1" else "sampled",
+    }
+    try:
+        name = request_profiler.save_profile(sampler, meta)
+        response.headers["X-Profile"] = name
+    except OSError as exc:
+        logging.warning(f"Failed to save request profile: {exc}")
+    response.headers["Server-Timing"] = request_profiler.server_timing(sampler)
+    return response
+
+
+@app.teardown_request
+def _stop_request_profiler(exc):
+    # after_request is skipped when response processing itself fails
+    sampler = g.pop("profiler", None)
+    if sampler is not None:
+        sampler.stop()
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
 # Register custom Jinja2 filter for printer label conversion
 @app.template_filter('printer_label')
 def printer_label_filter(url: str) -> str:
@@ -67,6 +206,74 @@ def user_display_name_filter(username: str, show_username: bool = True) -> str:
     return ldap_service.format_user_display(username, show_username)
 
 
+def _normalised_query_items() -> List[Tuple[str, str]]:
+    """
+    Non-empty query items, sorted. Internal parameters (__profile, __token)
+    are left out: they must not be recorded for warm-up, replayed, or split
+    the view cache.
+    """
+    return sorted(view_popularity.public_items(
+        [(key, value) for key, values in request.args.lists() for value in values if value != ""]
+    ))
+
+
+def _normalised_query_signature() -> str:
+    """Sorted query string without empty values, so equivalent URLs share one key."""
+    return urllib.parse.urlencode(_normalised_query_items())
+
+
+def _generation_cache_key(*args, **kwargs) -> str:
+    """
+    Flask-Caching key: route + ingestion generation + normalised query, plus
+    the replica "data as of" step while a lagging replica serves reads (the
+    cached page carries that notice).
+    """
+    generation, _ = get_ingestion_generation()
+    digest = hashlib.md5(_normalised_query_signature().encode("utf-8")).hexdigest()
+    as_of = REPLICA_ROUTER.as_of_key()
+    return f"view/{request.path}/{generation}/{digest}" + (f"/{as_of}" if as_of else "")
+
+
+def conditional_on_generation(view):
+    """
+    Attach ETag / Last-Modified derived from the ingestion generation and the
+    normalised query, and answer If-None-Match / If-Modified-Since with 304
+    before the view (and its DB queries) runs.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        generation, last_modified = get_ingestion_generation()
+        if not generation:
+            # No finished refresh yet (or DB unreachable): serve normally
+            return view(*args, **kwargs)
+
+        raw = f"{generation}|{request.path}|{_normalised_query_signature()}|{REPLICA_ROUTER.as_of_key()}"
+        etag = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+        not_modified = False
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        elif request.if_modified_since and last_modified is not None:
+            not_modified = last_modified <= request.if_modified_since
+
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # Browsers must revalidate, which is now a cheap 304
+        response.cache_control.no_cache = True
+        response.cache_control.private = True
+        return response
+
+    return wrapper
+
+
 try:
     from sharp_mfp_export import PRINTER_ALIASES
 except ImportError:
@@ -144,13 +351,105 @@ import threading
 
 download_lock = Lock()
 
+@app.route("/admin/queries")
+def admin_queries():
+    if request.args.get("token", "") != ADMIN_TOKEN:
+        return Response("密碼錯誤，您沒有權限檢視此頁面。", status=403, mimetype="text/plain")
+
+    if request.args.get("reset") == "1":
+        query_profiler.PROFILER.reset()
+
+    order = request.args.get("order", "total_ms")
+    if order not in ("total_ms", "max_ms", "avg_ms", "count", "rows"):
+        order = "total_ms"
+    days = _to_int(request.args.get("days"), 7)
+    limit = _to_int(request.args.get("limit"), 20)
+
+    persisted: List[Dict[str, Any]] = []
+    persisted_error = ""
+    try:
+        persisted = query_profiler.fetch_slow_query_report(get_profiler_connection, days=days, limit=limit)
+    except Exception as exc:
+        persisted_error = str(exc)
+
+    return render_template(
+        "admin_queries.html",
+        title="慢查詢分析",
+        token=request.args.get("token", ""),
+        enabled=query_profiler.PROFILE_ENABLED,
+        slow_ms=query_profiler.PROFILER.slow_ms,
+        live=query_profiler.PROFILER.top(limit=limit, order_by=order),
+        persisted=persisted,
+        persisted_error=persisted_error,
+        order=order,
+        days=days,
+        limit=limit,
+    )
+
+
+@app.route("/admin/profiles")
+def admin_profiles():
+    if request.args.get("token", "") != ADMIN_TOKEN:
+        return Response("密碼錯誤，您沒有權限檢視此頁面。", status=403, mimetype="text/plain")
+    return render_template(
+        "admin_profiles.html",
+        title="請求效能分析",
+        token=request.args.get("token", ""),
+        profiles=request_profiler.list_profiles(),
+        categories=request_profiler.CATEGORIES,
+        sample_rate=request_profiler.PROFILE_SAMPLE_RATE,
+    )
+
+
+@app.route("/admin/profiles/<name>")
+def admin_profile_download(name: str):
+    if request.args.get("token", "") != ADMIN_TOKEN:
+        return Response("密碼錯誤，您沒有權限檢視此頁面。", status=403, mimetype="text/plain")
+    path = request_profiler.profile_path(name)
+    if path is None:
+        return Response("找不到此分析檔。", status=404, mimetype="text/plain")
+    return send_file(path, mimetype="text/plain", as_attachment=True, download_name=path.name)
+
+
+# Warmed when no traffic has been recorded yet
+DEFAULT_WARMUP_VIEWS = [{"path": "/counts", "signature": "", "hits": 0}, {"path": "/leaders", "signature": "", "hits": 0}]
+
+
+def _warmup_fetch(url: str) -> int:
+    with app.test_client() as client:
+        return client.get(url, headers={WARMUP_HEADER: "1"}).status_code
+
+
+def run_popularity_warmup() -> Dict[str, Any]:
+    """Pre-render the top-K most requested cached views for the current generation."""
+    # Triggered right after an ingest: the generation cached in this process
+    # (GENERATION_CACHE_TTL) may still be the old one, and warming under it is wasted
+    invalidate_ingestion_generation()
+    VIEW_POPULARITY.flush()
+    try:
+        views, total_hits = view_popularity.fetch_top_views(get_db_connection)
+    except Exception as e:
+        logging.error(f"Failed to load view popularity: {e}")
+        views, total_hits = [], 0
+    return view_popularity.warm(views or DEFAULT_WARMUP_VIEWS, total_hits, _warmup_fetch)
+
+
+@app.route("/admin/warmup", methods=["POST"])
+def admin_warmup():
+    # Called by the CronJob (warmup_webapp) after an ingest: warming must run
+    # in this process, where the view cache lives
+    if request.headers.get("X-Admin-Token", request.args.get("token", "")) != ADMIN_TOKEN:
+        return Response("密碼錯誤，您沒有權限執行預熱。", status=403, mimetype="text/plain")
+    result = run_popularity_warmup()
+    return {**result, "message": view_popularity.summary_message(result)}
+
+
 @app.route("/update_data")
 def update_data():
     def generate():
         token = request.args.get("token", "")
-        expected_token = "2851@9364"
 
-        if token != expected_token:
+        if token != ADMIN_TOKEN:
             yield 'data: {"status": "error", "message": "密碼錯誤，您沒有權限執行更新。"}\n\n'
             return
 
@@ -166,7 +465,7 @@ def update_data():
             yield 'data: {"status": "start", "message": "開始更新程序..."}\n\n'
 
             # Use internal generator instead of subprocess
-            for line in run_download_process(None): # None = all printers
+            for line in run_download_process(None, log_id=log_id): # None = all printers
                 line = line.strip()
                 if not line:
                     continue
@@ -176,16 +475,16 @@ def update_data():
                     yield f'data: {{"status": "log", "message": "{line}"}}\n\n'
 
             # If we completed the loop, it means success (exceptions yielded as FAIL messages)
-            
+            # Close the log first: it bumps the ingestion generation the cache is keyed on
+            log_update_event("web_manual", "success", "更新完成 (Web)", log_id)
+
             yield 'data: {"status": "log", "message": "正在預熱緩存..."}\n\n'
             try:
-                # Warm up cache for main endpoints
-                with app.test_client() as client:
-                    client.get("/counts")
-                    client.get("/jobs")
-                    client.get("/leaders")
-                
-                log_update_event("web_manual", "success", "更新完成 (Web)", log_id)
+                # Warm up the most requested views
+                summary = view_popularity.summary_message(run_popularity_warmup())
+                append_update_log_message(log_id, summary)
+                yield f'data: {{"status": "log", "message": "{summary}"}}\n\n'
+
                 yield 'data: {"status": "done", "message": "更新完成！"}\n\n'
             except Exception as w_err:
                 err_msg = f"緩存預熱失敗: {str(w_err)}"
@@ -277,7 +576,10 @@ def _collect_job_reports(
     reports: Dict[str, Dict[str, Any]] = {}
     missing: List[str] = []
     for printer in printers:
-        report = load_joblog_report(printer, user_kw, mode_kw, computer_kw, start_dt, end_dt)
+        # Leaders only need per-user totals: stream the rows instead of holding them
+        report = load_joblog_report(
+            printer, user_kw, mode_kw, computer_kw, start_dt, end_dt, keep_entries=False, recent_limit=0
+        )
         if not report:
             missing.append(printer)
             continue
@@ -394,7 +696,7 @@ def _prepare_jobs_context(query_args: Dict[str, Any]) -> Dict[str, Any]:
         }
 
     # 2. Fetch detailed logs for these users
-    detailed_entries = fetch_job_logs_by_users(
+    detailed_entries = iter_job_logs_by_users(
         users_list,
         printer_addr=printer_pick,
         mode_kw=mode_pick,
@@ -405,9 +707,11 @@ def _prepare_jobs_context(query_args: Dict[str, Any]) -> Dict[str, Any]:
     )
     
     # 3. Aggregate into report format
-    user_map = {} # (user, login) -> list of entries
+    # Users from the id-based aggregation match on user_id (covers case variants and NULL logins)
+    by_user_id = all(u.get("user_id") for u in users_list)
+    user_map = {} # (user, login) or user_id -> list of entries
     for entry in detailed_entries:
-        key = (entry["user"], entry["login"])
+        key = entry.user_id if by_user_id else (entry.user, entry.login)
         if key not in user_map:
             user_map[key] = []
         user_map[key].append(entry)
@@ -415,23 +719,22 @@ def _prepare_jobs_context(query_args: Dict[str, Any]) -> Dict[str, Any]:
     final_blocks = []
     # Preserve order from users_list (which is sorted by pages DESC)
     for u in users_list:
-        key = (u["user"], u["login"])
+        key = u["user_id"] if by_user_id else (u["user"], u["login"])
         entries = user_map.get(key, [])
         if not entries:
             continue
             
         # Calculate totals
         total_jobs = len(entries)
-        total_pages = sum(e["pages"] for e in entries)
-        total_bw = sum(e["bw"] for e in entries)
-        total_color = sum(e["color"] for e in entries)
+        total_pages = sum(e.pages for e in entries)
+        total_bw = sum(e.bw for e in entries)
+        total_color = sum(e.color for e in entries)
         
         # Printer sub-totals
         p_stats = defaultdict(lambda: {"jobs": 0, "pages": 0})
         for e in entries:
-            p_addr = e["printer"]
-            p_stats[p_addr]["jobs"] += 1
-            p_stats[p_addr]["pages"] += e["pages"]
+            p_stats[e.printer]["jobs"] += 1
+            p_stats[e.printer]["pages"] += e.pages
             
         p_summaries = []
         for addr, st in p_stats.items():
@@ -551,6 +854,7 @@ def _prepare_counts_context(query: Dict[str, Any], export_mode: bool = False) ->
     results = []
     aggregated = None
     total_users = 0
+    total_records = 0
     
     # View Mode Logic
     if view_mode == "single_printer":
@@ -573,15 +877,14 @@ def _prepare_counts_context(query: Dict[str, Any], export_mode: bool = False) ->
             )
             
             if p_users:
-                p_detailed = fetch_job_logs_by_users(
+                # Category totals come back already summed by SQL
+                stats = fetch_category_usage(
                     p_users,
+                    categories,
                     printer_addr=printer_pick,
-                    mode_kw=None,
-                    computer_kw=None,
                     start_dt=start_dt,
                     end_dt=end_dt
                 )
-                stats = aggregate_usage_by_categories(p_detailed, categories, None)
                 formatted_entries = _format_usage_entries(stats, categories, 0, False)
                 
                 results.append({
@@ -599,73 +902,28 @@ def _prepare_counts_context(query: Dict[str, Any], export_mode: bool = False) ->
                 })
     
     elif view_mode == "all_printers":
-        # All Printers View: Unified table with printer column
-        # Fetch paginated users across ALL printers
-        all_users, total_users = fetch_aggregated_users_paginated(
+        # All Printers View: Unified table with printer column.
+        # Paginated over (printer, user) pairs, category totals summed by SQL
+        pair_entries, total_records = fetch_printer_user_usage_page(
             page, per_page,
-            printer_addr="all",  # All printers
+            categories,
             user_kw=user_kw,
-            mode_kw=None,
-            computer_kw=None,
             start_dt=start_dt,
             end_dt=end_dt
         )
-        
-        if all_users:
-            # Calculate total records (user-printer pairs) for display
-            total_records = fetch_total_user_printer_pairs(
-                printer_addr="all",
-                user_kw=user_kw,
-                mode_kw=None,
-                computer_kw=None,
-                start_dt=start_dt,
-                end_dt=end_dt
-            )
-            
-            # Fetch detailed logs for these users across all printers
-            all_detailed = fetch_job_logs_by_users(
-                all_users,
-                printer_addr="all",
-                mode_kw=None,
-                computer_kw=None,
-                start_dt=start_dt,
-                end_dt=end_dt
-            )
-            
-            # Group logs by printer first, then aggregate per printer
-            from collections import defaultdict
-            printer_logs = defaultdict(list)
-            for log in all_detailed:
-                printer = log.get("printer", "")  # Changed from printer_addr to printer
-                printer_logs[printer].append(log)
-            
-            # Aggregate each printer's data and combine with printer info
-            unified_entries = []
-            for printer, logs in printer_logs.items():
-                # Use existing aggregation function for consistency
-                stats = aggregate_usage_by_categories(logs, categories, None)
-                
-                # stats is a dict: {user_key: {"name": ..., "totals": {...}, "total": ...}}
-                for user_key, user_data in stats.items():
-                    category_map = {}
-                    for cat in categories:
-                        # user_data["totals"] contains the category counts
-                        category_map[cat] = user_data["totals"].get(cat, 0)
-                    
-                    unified_entries.append({
-                        "name": user_data["name"],
-                        "username": user_data.get("username", ""),  # Add username
-                        "login": "",  # Not available in aggregated stats
-                        "category_map": category_map,
-                        "total": user_data["total"],
-                        "printer": printer
-                    })
-            
-            # Sort by total pages desc
-            unified_entries.sort(key=lambda x: x["total"], reverse=True)
-            
-            # Store in results (single "block" for all printers)
-            results = unified_entries
+        total_users = total_records
+
+        results = [
+            {
+                "name": entry["name"],
+                "username": entry["username"],
+                "login": "",  # Not available in aggregated stats
+                "category_map": entry["totals"],
+                "total": entry["total"],
+                "printer": entry["printer"],
+            }
+            for entry in pair_entries
+        ]
     
     elif view_mode == "aggregated":
         # Aggregated View: Cross-printer user totals
@@ -680,15 +938,13 @@ def _prepare_counts_context(query: Dict[str, Any], export_mode: bool = False) ->
         )
         
         if agg_users:
-            agg_detailed = fetch_job_logs_by_users(
+            agg_stats = fetch_category_usage(
                 agg_users,
+                categories,
                 printer_addr="all",
-                mode_kw=None,
-                computer_kw=None,
                 start_dt=start_dt,
                 end_dt=end_dt
             )
-            agg_stats = aggregate_usage_by_categories(agg_detailed, categories, None)
             aggregated_entries = _format_usage_entries(agg_stats, categories, 0, False)
             aggregated = {"entries": aggregated_entries} if aggregated_entries else None
     
@@ -708,7 +964,7 @@ def _prepare_counts_context(query: Dict[str, Any], export_mode: bool = False) ->
             "page": page,
             "per_page": per_page,
             "total_users": total_users,
-            "total_records": total_records if view_mode == "all_printers" and locals().get("total_records") else 0,
+            "total_records": total_records,
             "total_pages": total_pages_count,
             "has_prev": page > 1,
             "has_next": page < total_pages_count,
@@ -852,6 +1108,14 @@ def _prepare_leaders_context(query: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+def _new_workbook() -> Workbook:
+    try:
+        from openpyxl import Workbook
+    except ImportError as exc:  # pragma: no cover - runtime guard
+        raise RuntimeError("請先安裝 openpyxl 套件：pip install openpyxl") from exc
+    return Workbook()
+
+
 def _workbook_response(wb: Workbook, filename: str):
     stream = BytesIO()
     wb.save(stream)
@@ -865,7 +1129,7 @@ def _workbook_response(wb: Workbook, filename: str):
 
 
 def _build_jobs_workbook(reports: List[Dict[str, Any]]) -> Workbook:
-    wb = Workbook()
+    wb = _new_workbook()
     first_sheet = True
     for report in reports:
         printer = report["printer"]
@@ -892,7 +1156,7 @@ def _build_jobs_workbook(reports: List[Dict[str, Any]]) -> Workbook:
 
 
 def _build_counts_workbook(results: List[Dict[str, Any]], categories: List[str]) -> Workbook:
-    wb = Workbook()
+    wb = _new_workbook()
     first_sheet = True
     for block in results:
         title = _printer_label(block["printer"])[:31]
@@ -920,7 +1184,7 @@ def _build_counts_workbook(results: List[Dict[str, Any]], categories: List[str])
 
 
 def _build_combined_counts_workbook(entries: List[Dict[str, Any]], categories: List[str]) -> Workbook:
-    wb = Workbook()
+    wb = _new_workbook()
     ws = wb.active
     ws.title = "跨機器彙總"
     headers = ["用戶", "帳號"] + [USAGE_CATEGORY_CONFIG[key]["label"] for key in categories] + ["總張數"]
@@ -940,7 +1204,7 @@ def _build_all_printers_workbook(entries: List[Dict[str, Any]], categories: List
     Build workbook for 'all_printers' view mode.
     Creates a single sheet with unified table including printer column.
     """
-    wb = Workbook()
+    wb = _new_workbook()
     ws = wb.active
     ws.title = "所有列印機統計"
     
@@ -965,7 +1229,7 @@ def _build_all_printers_workbook(entries: List[Dict[str, Any]], categories: List
 
 
 def _build_leaders_workbook(rows: List[Dict[str, Any]], show_printer_column: bool) -> Workbook:
-    wb = Workbook()
+    wb = _new_workbook()
     ws = wb.active
     ws.title = "排行榜"
     
@@ -1037,7 +1301,9 @@ def index():
 
 
 @app.route("/counts")
-@cache.cached(timeout=300, query_string=True)
+@conditional_on_generation
+@cache.cached(timeout=300, make_cache_key=_generation_cache_key)
+@mark_cache_miss
 def counts():
     query = _build_counts_query()
     context = _prepare_counts_context(query)
@@ -1058,6 +1324,7 @@ def counts():
 
 
 @app.route("/jobs")
+@conditional_on_generation
 def jobs():
     query = _build_jobs_query()
     context = _prepare_jobs_context(query)
@@ -1074,7 +1341,9 @@ def jobs():
 
 
 @app.route("/leaders")
-@cache.cached(timeout=300, query_string=True)
+@conditional_on_generation
+@cache.cached(timeout=300, make_cache_key=_generation_cache_key)
+@mark_cache_miss
 def leaders():
     query = _build_leaders_query()
     context = _prepare_leaders_context(query)
@@ -1098,7 +1367,7 @@ def _build_user_jobs_workbook(user_blocks: List[Dict[str, Any]]) -> Workbook:
     Build workbook for jobs page export (user-grouped data).
     Each user_block has: name, login, totals, entries
     """
-    wb = Workbook()
+    wb = _new_workbook()
     ws = wb.active
     ws.title = "作業紀錄"
     
@@ -1128,6 +1397,7 @@ def _build_user_jobs_workbook(user_blocks: List[Dict[str, Any]]) -> Workbook:
 
 
 @app.route("/export/jobs")
+@conditional_on_generation
 def export_jobs():
     query = _build_jobs_query()
     context = _prepare_jobs_context(query)
@@ -1140,6 +1410,7 @@ def export_jobs():
 
 
 @app.route("/export/stats")
+@conditional_on_generation
 def export_stats():
     """
     Unified export route that handles all three view modes and export scopes.
@@ -1215,6 +1486,7 @@ def export_stats_combined():
 
 
 @app.route("/export/leaders")
+@conditional_on_generation
 def export_leaders():
     export_range = request.args.get("export_range", "current_filter")
     